@@ -1,17 +1,22 @@
-from langchain_openai import ChatOpenAI
 from langchain.prompts import ChatPromptTemplate
-from rag.retriever import KnowledgeBaseRetriever
+from agents.registry import get_chat_model, get_knowledge_base
+from agents.response_cache import ResponseCache, build_response_cache
+from agents.tracing import atraced_invoke, atraced_stream, traced_invoke
 
 class AccountSpecialist:
-    def __init__(self):
+    def __init__(self, model=None, retriever=None, response_cache: ResponseCache = None):
         try:
-            self.model = ChatOpenAI(model="gpt-4-turbo", temperature=0.3)
+            self.model = model or get_chat_model("gpt-4-turbo", temperature=0.3)
             self.api_available = True
         except Exception:
             self.model = None
             self.api_available = False
             
-        self.retriever = KnowledgeBaseRetriever("data/sample_data/account")
+        self.retriever = retriever or get_knowledge_base()
+        # Knowledge base domain this specialist searches
+        self.domain = "account"
+        # Opt-in cache of answers to identical prompts (RESPONSE_CACHE_SPECIALISTS)
+        self.response_cache = response_cache if response_cache is not None else build_response_cache(self.domain)
         self.prompt = ChatPromptTemplate.from_template("""
 You are an account management specialist for a telecommunications company.
 You help customers with account changes, password resets, plan upgrades, and account information.
@@ -25,6 +30,9 @@ Customer Context:
 Relevant Knowledge Base Information:
 {context}
 
+Conversation So Far:
+{conversation}
+
 Customer Query: {query}
 
 Provide step-by-step instructions when possible. For security-sensitive operations 
@@ -32,16 +40,113 @@ like password resets, explain the verification process required.
 
 Response:""")
     
-    def handle_query(self, query: str, customer_context: dict) -> str:
+    def handle_query(self, query: str, customer_context: dict, context_docs: list = None,
+                    conversation: str = "") -> str:
         # Use fallback if API is not available
         if not self.api_available:
             return self._fallback_response(query, customer_context)
             
         # Try to retrieve relevant account information
+        if context_docs is None:
+            context_docs = self.retrieve_context(query)
+        
         try:
-            context_docs = self.retriever.retrieve(query, k=3)
-            context = "\n".join([doc.page_content for doc in context_docs])
+            messages = self._format_messages(query, customer_context, context_docs, conversation)
+            key, cached = self._cached_response(messages)
+            if cached is not None:
+                return cached
+            response = traced_invoke("account_specialist", self.model, messages)
+            self._cache_response(key, response.content)
+            return response.content
         except Exception:
+            # Fallback response when API is unavailable
+            return self._fallback_response(query, customer_context)
+    
+    async def ahandle_query(self, query: str, customer_context: dict, context_docs: list = None,
+                            conversation: str = "") -> str:
+        """Async variant of handle_query using the retriever's and model's async calls"""
+        if not self.api_available:
+            return self._fallback_response(query, customer_context)
+            
+        if context_docs is None:
+            context_docs = await self.aretrieve_context(query)
+        
+        try:
+            messages = self._format_messages(query, customer_context, context_docs, conversation)
+            key, cached = await self._acached_response(messages)
+            if cached is not None:
+                return cached
+            response = await atraced_invoke("account_specialist", self.model, messages)
+            await self._acache_response(key, response.content)
+            return response.content
+        except Exception:
+            return self._fallback_response(query, customer_context)
+    
+    async def astream_query(self, query: str, customer_context: dict, context_docs: list = None,
+                           conversation: str = ""):
+        """Streaming variant of ahandle_query that yields the response text as the model generates it"""
+        if not self.api_available:
+            yield self._fallback_response(query, customer_context)
+            return
+            
+        if context_docs is None:
+            context_docs = await self.aretrieve_context(query)
+        
+        messages = self._format_messages(query, customer_context, context_docs, conversation)
+        key, cached = await self._acached_response(messages)
+        if cached is not None:
+            yield cached
+            return
+        
+        streamed = []
+        try:
+            async for token in atraced_stream("account_specialist", self.model, messages):
+                streamed.append(token)
+                yield token
+        except Exception:
+            # Fall back only if nothing was sent yet; a partial answer can't be taken back
+            if not streamed:
+                yield self._fallback_response(query, customer_context)
+        else:
+            await self._acache_response(key, "".join(streamed))
+    
+    def retrieve_context(self, query: str) -> list:
+        """Knowledge base chunks for the query ([] if retrieval fails); may be prefetched by the orchestrator"""
+        try:
+            return self.retriever.retrieve(query, k=3, domain=self.domain)
+        except Exception:
+            return []
+    
+    async def aretrieve_context(self, query: str) -> list:
+        try:
+            return await self.retriever.aretrieve(query, k=3, domain=self.domain)
+        except Exception:
+            return []
+    
+    def _cached_response(self, messages: list):
+        """The prompt's cache key and cached answer; (None, None) if this specialist doesn't cache"""
+        if self.response_cache is None:
+            return None, None
+        return self.response_cache.lookup("account_response", self.model, messages)
+    
+    def _cache_response(self, key: str, response: str):
+        if key is not None:
+            self.response_cache.set(key, response)
+    
+    async def _acached_response(self, messages: list):
+        if self.response_cache is None:
+            return None, None
+        return await self.response_cache.alookup("account_response", self.model, messages)
+    
+    async def _acache_response(self, key: str, response: str):
+        if key is not None:
+            await self.response_cache.aset(key, response)
+    
+    def _format_messages(self, query: str, customer_context: dict, context_docs: list, conversation: str = "") -> list:
+        """Build the prompt messages from the query, retrieved docs, conversation so far and customer context"""
+        if context_docs:
+            context = "\n".join([doc.page_content for doc in context_docs])
+        else:
             context = "No additional context available."
         
         # Format customer context
@@ -50,21 +155,15 @@ Response:""")
         plan_type = customer_context.get("plan_type", "Individual")
         account_since = customer_context.get("account_since", "2023")
         
-        try:
-            response = self.model.invoke(
-                self.prompt.format_messages(
-                    query=query,
-                    context=context,
-                    account_id=account_id,
-                    account_status=account_status,
-                    plan_type=plan_type,
-                    account_since=account_since
-                )
-            )
-            return response.content
-        except Exception:
-            # Fallback response when API is unavailable
-            return self._fallback_response(query, customer_context)
+        return self.prompt.format_messages(
+            query=query,
+            context=context,
+            conversation=conversation or "No previous messages.",
+            account_id=account_id,
+            account_status=account_status,
+            plan_type=plan_type,
+            account_since=account_since
+        )
     
     def _fallback_response(self, query: str, customer_context: dict) -> str:
         """Provide fallback response when OpenAI API is unavailable"""
@@ -0,0 +1,246 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional
+import numpy as np
+
+def normalize_query(text: str) -> str:
+    """Canonical form used as a cache key: lowercase, single spaces, no trailing punctuation"""
+    text = re.sub(r"\s+", " ", text.lower()).strip()
+    return text.rstrip("?!. ")
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire after a time-to-live."""
+
+    def __init__(self, max_size: int = 1024, ttl_seconds: float = 3600):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            value, expires_at = entry
+            if time.monotonic() > expires_at:
+                del self._entries[key]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "size": len(self._entries),
+            "max_size": self.max_size
+        }
+
+class SemanticCache:
+    """Cache that answers lookups for near-duplicate texts by embedding similarity.
+
+    Vectors are L2-normalized on insert so similarity is a single matrix-vector
+    product over all cached entries. Embedding failures are treated as misses.
+    Entries live in a preallocated max_size x dim matrix used as a ring buffer
+    (all entries share one TTL, so the oldest slot is always the next to go);
+    inserts and evictions overwrite or unmark one row instead of copying it.
+    """
+
+    def __init__(self, embeddings, threshold: float = 0.92, max_size: int = 1024, ttl_seconds: float = 3600):
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._keys: List[Optional[str]] = [None] * max_size
+        self._values: List[Any] = [None] * max_size
+        self._expires = np.zeros(max_size)
+        self._valid = np.zeros(max_size, dtype=bool)
+        # Allocated on the first insert, once the embedding size is known
+        self._matrix = None
+        # Slot of the oldest entry, the number of live entries and the slots ever written
+        self._oldest = 0
+        self._count = 0
+        self._used = 0
+        self._lock = threading.Lock()
+        # Embeddings computed for misses, reused when the answer is stored
+        self._pending = TTLCache(max_size=256, ttl_seconds=60)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, text: str) -> Optional[Any]:
+        try:
+            vector = self._pending.get(text)
+            if vector is None:
+                vector = self._normalize(self.embeddings.embed_query(text))
+        except Exception:
+            self.misses += 1
+            return None
+        return self._lookup(text, vector)
+
+    async def aget(self, text: str) -> Optional[Any]:
+        try:
+            vector = self._pending.get(text)
+            if vector is None:
+                vector = self._normalize(await self.embeddings.aembed_query(text))
+        except Exception:
+            self.misses += 1
+            return None
+        return self._lookup(text, vector)
+
+    def set(self, text: str, value: Any):
+        vector = self._pending.get(text)
+        if vector is None:
+            try:
+                vector = self._normalize(self.embeddings.embed_query(text))
+            except Exception:
+                return
+        self._insert(text, vector, value)
+
+    async def aset(self, text: str, value: Any):
+        vector = self._pending.get(text)
+        if vector is None:
+            try:
+                vector = self._normalize(await self.embeddings.aembed_query(text))
+            except Exception:
+                return
+        self._insert(text, vector, value)
+
+    def _insert(self, text: str, vector: np.ndarray, value: Any):
+        with self._lock:
+            self._evict_expired()
+            if self._count >= self.max_size:
+                self._drop_oldest()
+            if self._matrix is None:
+                self._matrix = np.zeros((self.max_size, vector.shape[0]), dtype=np.float32)
+            slot = (self._oldest + self._count) % self.max_size
+            self._matrix[slot] = vector
+            self._keys[slot] = text
+            self._values[slot] = value
+            self._expires[slot] = time.monotonic() + self.ttl_seconds
+            self._valid[slot] = True
+            self._count += 1
+            self._used = max(self._used, slot + 1)
+
+    def _lookup(self, text: str, vector: np.ndarray) -> Optional[Any]:
+        with self._lock:
+            self._evict_expired()
+            if self._count:
+                scores = np.where(self._valid[:self._used], self._matrix[:self._used] @ vector, -np.inf)
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    self.hits += 1
+                    return self._values[best]
+
+        self._pending.set(text, vector)
+        self.misses += 1
+        return None
+
+    def _evict_expired(self):
+        now = time.monotonic()
+        while self._count and self._expires[self._oldest] < now:
+            self._drop_oldest()
+
+    def _drop_oldest(self):
+        slot = self._oldest
+        self._valid[slot] = False
+        self._keys[slot] = self._values[slot] = None
+        self._oldest = (slot + 1) % self.max_size
+        self._count -= 1
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def clear(self):
+        with self._lock:
+            self._keys = [None] * self.max_size
+            self._values = [None] * self.max_size
+            self._valid[:] = False
+            self._oldest = self._count = self._used = 0
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "size": self._count,
+            "threshold": self.threshold
+        }
+
+class QueryCache:
+    """Two-tier cache keyed on normalized query text: exact LRU/TTL first, then optional semantic."""
+
+    def __init__(self, exact: TTLCache = None, semantic: SemanticCache = None):
+        self.exact = exact if exact is not None else TTLCache()
+        self.semantic = semantic
+
+    def get(self, query: str) -> Optional[Any]:
+        key = normalize_query(query)
+        value = self.exact.get(key)
+        if value is None and self.semantic is not None:
+            value = self.semantic.get(key)
+            if value is not None:
+                # Promote so the next identical query skips the embedding call
+                self.exact.set(key, value)
+        return value
+
+    async def aget(self, query: str) -> Optional[Any]:
+        key = normalize_query(query)
+        value = self.exact.get(key)
+        if value is None and self.semantic is not None:
+            value = await self.semantic.aget(key)
+            if value is not None:
+                self.exact.set(key, value)
+        return value
+
+    def set(self, query: str, value: Any):
+        key = normalize_query(query)
+        self.exact.set(key, value)
+        if self.semantic is not None:
+            self.semantic.set(key, value)
+
+    async def aset(self, query: str, value: Any):
+        key = normalize_query(query)
+        self.exact.set(key, value)
+        if self.semantic is not None:
+            await self.semantic.aset(key, value)
+
+    def clear(self):
+        self.exact.clear()
+        if self.semantic is not None:
+            self.semantic.clear()
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        stats = {"exact": self.exact.stats()}
+        if self.semantic is not None:
+            stats["semantic"] = self.semantic.stats()
+        return stats
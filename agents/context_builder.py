@@ -0,0 +1,224 @@
+import os
+import re
+from typing import Callable, Dict, List
+from langchain.prompts import ChatPromptTemplate
+from agents.cache import TTLCache
+from agents.tracing import atraced_invoke, record_cache, traced_invoke
+
+_WORD = re.compile(r"\w+|[^\w\s]")
+
+def _load_encoding():
+    """The OpenAI tokenizer, or None when it can't be loaded (offline or not installed)"""
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        return None
+
+# Loaded at import, so no request waits on a first-use download of the tokenizer file
+_encoding = _load_encoding()
+
+def count_tokens(text: str) -> int:
+    """Tokens in text by the OpenAI tokenizer, or a word-and-punctuation estimate if it couldn't be loaded"""
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return len(_WORD.findall(text))
+
+def truncate_tokens(text: str, budget: int) -> str:
+    """text cut to at most budget tokens (at a word boundary)"""
+    if count_tokens(text) <= budget:
+        return text
+    words = text.split()
+    low, high = 0, len(words)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if count_tokens(" ".join(words[:middle]) + " ...") <= budget:
+            low = middle
+        else:
+            high = middle - 1
+    return " ".join(words[:low]) + " ..." if low else ""
+
+def extractive_summary(previous: str, messages: List[Dict]) -> str:
+    """Fold messages into a running summary locally: one short point per customer question or routed intent"""
+    points = [previous] if previous else []
+    for message in messages:
+        if message["role"] == "user":
+            points.append(f"customer asked: {truncate_tokens(message['content'], 24)}")
+        elif "intent" in message.get("metadata", {}):
+            point = f"handled as {message['metadata']['intent']}"
+            # Repeats of the same routing add nothing
+            if not points or not points[-1].endswith(point):
+                points.append(point)
+    return "; ".join(points)
+
+class ContextBuilder:
+    """Conversation history for specialist prompts, kept under a token budget.
+    
+    The newest messages are quoted verbatim, newest first, until the budget
+    is used up; older ones are folded into a rolling summary. The summary is
+    cached per session and only extended with the messages that have aged
+    out since the last turn, so it is never recomputed from the whole
+    history. Summaries are capped at summary_share of the budget, dropping
+    their oldest points first. Use abuild on the event loop: a model-backed
+    summarizer is then awaited instead of blocking it.
+    """
+    
+    def __init__(self, budget_tokens: int = None, summary_share: float = 0.3,
+                 summarizer: Callable[[str, List[Dict]], str] = None,
+                 max_sessions: int = 10000, ttl_seconds: float = 1800):
+        if budget_tokens is None:
+            budget_tokens = int(os.getenv("CONTEXT_TOKEN_BUDGET", "400"))
+        self.budget_tokens = budget_tokens
+        self.summary_budget = int(budget_tokens * summary_share)
+        self.summarizer = summarizer or extractive_summary
+        # user_id -> {"through": marker of the last summarized message, "summary": text}
+        self.summaries = TTLCache(max_size=max_sessions, ttl_seconds=ttl_seconds)
+    
+    def build(self, user_id: str, history: List[Dict]) -> str:
+        """Prompt-ready conversation context for the user's history (oldest message first)"""
+        recent, older = self._split(history)
+        summary = self._summary(user_id, older) if older else ""
+        return self._join(summary, recent)
+    
+    async def abuild(self, user_id: str, history: List[Dict]) -> str:
+        """Async variant of build that awaits the summarizer's asummarize when it has one"""
+        recent, older = self._split(history)
+        summary = await self._asummary(user_id, older) if older else ""
+        return self._join(summary, recent)
+    
+    def _split(self, history: List[Dict]):
+        """The lines quoted verbatim, and the older messages that have to be summarized"""
+        if not history or self.budget_tokens <= 0:
+            return [], []
+        
+        lines = [self._format(message) for message in history]
+        costs = [count_tokens(line) for line in lines]
+        if sum(costs) <= self.budget_tokens:
+            return lines, []
+        
+        # Room for the summary is kept back once some history has to be summarized
+        available = self.budget_tokens - self.summary_budget
+        keep, used = 0, 0
+        for cost in reversed(costs):
+            if used + cost > available:
+                break
+            keep, used = keep + 1, used + cost
+        recent = lines[len(lines) - keep:] if keep else []
+        if not recent:
+            # A single oversized latest message is shortened rather than dropped
+            recent, keep = [truncate_tokens(lines[-1], available)], 1
+        
+        return recent, history[:len(history) - keep]
+    
+    @staticmethod
+    def _join(summary: str, recent: List[str]) -> str:
+        lines = [f"Earlier in the conversation: {summary}"] if summary else []
+        return "\n".join(lines + recent)
+    
+    def _summary(self, user_id: str, older: List[Dict]) -> str:
+        previous, new = self._pending(user_id, older)
+        if not new:
+            return previous
+        try:
+            summary = self.summarizer(previous, new)
+        except Exception as e:
+            print(f"Error summarizing conversation: {e}")
+            summary = extractive_summary(previous, new)
+        return self._store(user_id, new, summary)
+    
+    async def _asummary(self, user_id: str, older: List[Dict]) -> str:
+        previous, new = self._pending(user_id, older)
+        if not new:
+            return previous
+        asummarize = getattr(self.summarizer, "asummarize", None)
+        try:
+            # Local summarizers are cheap enough to run inline
+            summary = await asummarize(previous, new) if asummarize else self.summarizer(previous, new)
+        except Exception as e:
+            print(f"Error summarizing conversation: {e}")
+            summary = extractive_summary(previous, new)
+        return self._store(user_id, new, summary)
+    
+    def _pending(self, user_id: str, older: List[Dict]):
+        """The cached summary so far and the older messages not yet folded into it"""
+        cached = self.summaries.get(user_id)
+        new = self._unsummarized(older, cached["through"] if cached else None)
+        record_cache("conversation_summary", not new)
+        return (cached["summary"] if cached else ""), new
+    
+    def _store(self, user_id: str, new: List[Dict], summary: str) -> str:
+        summary = self._fit(summary)
+        self.summaries.set(user_id, {"through": self._marker(new[-1]), "summary": summary})
+        return summary
+    
+    def _unsummarized(self, older: List[Dict], through) -> List[Dict]:
+        """The messages in older after the last one already in the summary"""
+        if through is None:
+            return older
+        for index in range(len(older) - 1, -1, -1):
+            if self._marker(older[index]) == through:
+                return older[index + 1:]
+        # The marker message has left the history window; everything newer is new
+        return [message for message in older if message["timestamp"] > through[0]]
+    
+    @staticmethod
+    def _marker(message: Dict):
+        return (message["timestamp"], message["role"], message["content"])
+    
+    def _fit(self, summary: str) -> str:
+        """Drop the summary's oldest points until it fits the summary budget"""
+        points = summary.split("; ")
+        while len(points) > 1 and count_tokens("; ".join(points)) > self.summary_budget:
+            points.pop(0)
+        return truncate_tokens("; ".join(points), self.summary_budget)
+    
+    @staticmethod
+    def _format(message: Dict) -> str:
+        speaker = "Customer" if message["role"] == "user" else "Agent"
+        return f"{speaker}: {message['content']}"
+
+class LLMSummarizer:
+    """Summarizer that asks a chat model to extend the running summary"""
+    
+    prompt = ChatPromptTemplate.from_template("""
+Update the running summary of a customer service conversation with the new messages.
+Keep it under 60 words, as short "; "-separated points, and keep account details,
+the customer's problem and anything already promised.
+
+Summary so far: {summary}
+
+New messages:
+{messages}
+
+Updated summary:""")
+    
+    def __init__(self, model):
+        self.model = model
+    
+    def __call__(self, previous: str, messages: List[Dict]) -> str:
+        response = traced_invoke("context_summarizer", self.model, self._format_messages(previous, messages))
+        return response.content.strip()
+    
+    async def asummarize(self, previous: str, messages: List[Dict]) -> str:
+        response = await atraced_invoke("context_summarizer", self.model, self._format_messages(previous, messages))
+        return response.content.strip()
+    
+    def _format_messages(self, previous: str, messages: List[Dict]) -> list:
+        text = "\n".join(ContextBuilder._format(message) for message in messages)
+        return self.prompt.format_messages(summary=previous or "(none)", messages=text)
+
+def build_context_builder(ttl_seconds: float = 1800) -> ContextBuilder:
+    """Context builder configured from the environment.
+    
+    CONTEXT_TOKEN_BUDGET sets the history budget; CONTEXT_SUMMARY_MODEL (e.g.
+    gpt-3.5-turbo) summarizes older turns with that model instead of locally.
+    """
+    summarizer = None
+    model_name = os.getenv("CONTEXT_SUMMARY_MODEL")
+    if model_name:
+        try:
+            from agents.registry import get_chat_model
+            summarizer = LLMSummarizer(get_chat_model(model_name, temperature=0.0))
+        except Exception:
+            summarizer = None
+    return ContextBuilder(summarizer=summarizer, ttl_seconds=ttl_seconds)
@@ -1,50 +1,89 @@
 from typing import List, Dict
 from datetime import datetime, timedelta
+from agents.session_store import SessionStore, StripedLock, build_session_store
+import asyncio
+import os
+import threading
+import weakref
 
 class ConversationMemory:
-    def __init__(self, max_turns: int = 10, ttl_minutes: int = 30):
-        self.conversations = {}
+    """Per-user conversation history, bounded in messages per session and expiring by TTL.
+    
+    Messages live in a SessionStore (see agents.session_store): in this
+    process by default, or in SQLite or Redis (SESSION_STORE_URL) so every
+    worker sees the same history. A session keeps its last max_turns messages
+    and expires ttl_minutes after its last message. Expired sessions are
+    dropped when read and by a background sweep every sweep_seconds (0
+    disables the sweeper; stores that expire sessions themselves need none).
+    On the event loop use astart_turn, aadd_message and aget_conversation,
+    which call a blocking store (SQLite, Redis) from a worker thread.
+    """
+    
+    def __init__(self, max_turns: int = 10, ttl_minutes: int = 30, max_sessions: int = None,
+                 sweep_seconds: float = None, store: SessionStore = None):
         self.max_turns = max_turns
         self.ttl = timedelta(minutes=ttl_minutes)
+        self.store = store or build_session_store(max_sessions=max_sessions)
+        if sweep_seconds is None:
+            sweep_seconds = float(os.getenv("CONVERSATION_SWEEP_SECONDS", "60"))
+        self.sweep_seconds = sweep_seconds
+        self._lock = threading.Lock()
+        self._user_locks = StripedLock()
+        self._sweeper = None
+        self._stop = threading.Event()
     
     def add_message(self, user_id: str, role: str, content: str, metadata: Dict = None):
         """Add message to conversation history"""
-        if user_id not in self.conversations:
-            self.conversations[user_id] = {
-                "messages": [],
-                "last_updated": datetime.now(),
-                "context": {}
-            }
-        
         message = {
             "role": role,
             "content": content,
             "timestamp": datetime.now(),
             "metadata": metadata or {}
         }
-        
-        self.conversations[user_id]["messages"].append(message)
-        self.conversations[user_id]["last_updated"] = datetime.now()
-        
-        # Keep only recent messages
-        if len(self.conversations[user_id]["messages"]) > self.max_turns:
-            self.conversations[user_id]["messages"] = self.conversations[user_id]["messages"][-self.max_turns:]
+        self.store.append(user_id, message, self.max_turns, self.ttl.total_seconds())
+        self._start_sweeper()
+    
+    async def aadd_message(self, user_id: str, role: str, content: str, metadata: Dict = None):
+        """add_message for the event loop; a blocking store is written from a worker thread"""
+        await self._off_loop(self.add_message, user_id, role, content, metadata)
     
     def get_conversation(self, user_id: str) -> List[Dict]:
         """Get conversation history for user"""
-        if user_id not in self.conversations:
-            return []
-        
-        # Check if conversation expired
-        if datetime.now() - self.conversations[user_id]["last_updated"] > self.ttl:
-            del self.conversations[user_id]
-            return []
-        
-        return self.conversations[user_id]["messages"]
+        return self.store.get(user_id)
+    
+    async def aget_conversation(self, user_id: str) -> List[Dict]:
+        """get_conversation for the event loop; a blocking store is read from a worker thread"""
+        return await self._off_loop(self.get_conversation, user_id)
     
     def get_context_summary(self, user_id: str) -> str:
         """Generate context summary for current conversation"""
-        messages = self.get_conversation(user_id)
+        return self.summarize(self.get_conversation(user_id))
+    
+    def start_turn(self, user_id: str, query: str) -> List[Dict]:
+        """Read the user's history, then record their new message, as one step.
+        
+        Concurrent turns from the same user (within this process) are
+        serialized here, so each sees a consistent history and their messages
+        are stored in arrival order; other users are not held up.
+        """
+        with self._user_locks.lock(user_id):
+            history = self.get_conversation(user_id)
+            self.add_message(user_id, "user", query)
+        return history
+    
+    async def astart_turn(self, user_id: str, query: str) -> List[Dict]:
+        """start_turn for the event loop; a blocking store is used from a worker thread"""
+        return await self._off_loop(self.start_turn, user_id, query)
+    
+    async def _off_loop(self, function, *args):
+        # The in-process store is quicker than a thread hop
+        if not self.store.blocking:
+            return function(*args)
+        return await asyncio.to_thread(function, *args)
+    
+    @staticmethod
+    def summarize(messages: List[Dict]) -> str:
+        """Short summary of the most recent messages"""
         if not messages:
             return ""
         
@@ -57,4 +96,40 @@ class ConversationMemory:
                 intent = msg["metadata"]["intent"]
                 context_parts.append(f"Classified as: {intent}")
         
-        return " | ".join(context_parts)
\ No newline at end of file
+        return " | ".join(context_parts)
+    
+    def sweep(self) -> int:
+        """Drop expired sessions; returns how many were removed"""
+        return self.store.sweep()
+    
+    def stats(self) -> Dict:
+        """Session and message counts (plus eviction counters and memory estimate for the in-process store)"""
+        return {"backend": type(self.store).__name__, **self.store.stats()}
+    
+    def close(self):
+        """Stop the background sweeper"""
+        self._stop.set()
+    
+    def _start_sweeper(self):
+        # Started on first use so idle instances cost no thread
+        if self._sweeper is not None or self.sweep_seconds <= 0 or self.store.expires_itself:
+            return
+        with self._lock:
+            if self._sweeper is None:
+                self._sweeper = threading.Thread(
+                    target=_sweep_loop, args=(weakref.ref(self), self.sweep_seconds, self._stop),
+                    name="conversation-sweeper", daemon=True
+                )
+                self._sweeper.start()
+
+def _sweep_loop(memory_ref, interval: float, stop: threading.Event):
+    """Sweep until stopped or the memory is garbage collected (held weakly so it can be)"""
+    while not stop.wait(interval):
+        memory = memory_ref()
+        if memory is None:
+            return
+        try:
+            memory.sweep()
+        except Exception as e:
+            print(f"Error sweeping conversation memory: {e}")
+        del memory
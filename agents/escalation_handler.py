@@ -1,10 +1,31 @@
-from langchain_openai import ChatOpenAI
 from langchain.prompts import ChatPromptTemplate
+from agents.keyword_matcher import KeywordMatcher
+from agents.registry import get_chat_model
+from agents.tracing import atraced_invoke, atraced_stream, traced_invoke
+
+# Escalation reasons and the keywords that indicate them, in priority order
+COMPLEXITY_KEYWORDS = {
+    "Account cancellation requires human verification": {
+        "cancel": 1.0, "cancellation": 1.0, "cancelled": 1.0, "canceled": 1.0,
+        "disconnect": 1.0, "terminate": 1.0, "termination": 1.0
+    },
+    "Customer complaint requires personalized attention": {
+        "complaint": 1.0, "dissatisfied": 1.0, "angry": 1.0
+    },
+    "Legal matter requires specialized handling": {
+        "legal": 1.0, "lawsuit": 1.0, "attorney": 1.0, "lawyer": 1.0
+    },
+    "Customer explicitly requested human agent": {
+        "supervisor": 1.0, "manager": 1.0, "human": 1.0
+    }
+}
+
+_complexity_matcher = KeywordMatcher(COMPLEXITY_KEYWORDS)
 
 class EscalationHandler:
-    def __init__(self):
+    def __init__(self, model=None):
         try:
-            self.model = ChatOpenAI(model="gpt-4-turbo", temperature=0.2)
+            self.model = model or get_chat_model("gpt-4-turbo", temperature=0.2)
             self.api_available = True
         except Exception:
             self.model = None
@@ -21,6 +42,9 @@ Customer Context:
 - Account ID: {account_id}
 - Issue Complexity: {complexity_reason}
 
+Conversation So Far:
+{conversation}
+
 Customer Query: {query}
 
 Provide a professional, empathetic response that explains the escalation process.
@@ -28,7 +52,7 @@ Include estimated response times and what information the human agent will have
 
 Response:""")
     
-    def handle_query(self, query: str, customer_context: dict) -> str:
+    def handle_query(self, query: str, customer_context: dict, conversation: str = "") -> str:
         # Use fallback if API is not available
         if not self.api_available:
             complexity_reason = self._determine_complexity(query)
@@ -39,11 +63,12 @@ Response:""")
         account_id = customer_context.get("account_id", "Unknown")
         
         try:
-            response = self.model.invoke(
+            response = traced_invoke("escalation_handler", self.model,
                 self.prompt.format_messages(
                     query=query,
                     account_id=account_id,
-                    complexity_reason=complexity_reason
+                    complexity_reason=complexity_reason,
+                    conversation=conversation or "No previous messages."
                 )
             )
             return response.content
@@ -51,6 +76,53 @@ Response:""")
             # Fallback response when API is unavailable
             return self._fallback_response(query, customer_context, complexity_reason)
     
+    async def ahandle_query(self, query: str, customer_context: dict, conversation: str = "") -> str:
+        """Async variant of handle_query that awaits the model without blocking the event loop"""
+        complexity_reason = self._determine_complexity(query)
+        if not self.api_available:
+            return self._fallback_response(query, customer_context, complexity_reason)
+        
+        account_id = customer_context.get("account_id", "Unknown")
+        
+        try:
+            response = await atraced_invoke("escalation_handler", self.model,
+                self.prompt.format_messages(
+                    query=query,
+                    account_id=account_id,
+                    complexity_reason=complexity_reason,
+                    conversation=conversation or "No previous messages."
+                )
+            )
+            return response.content
+        except Exception:
+            return self._fallback_response(query, customer_context, complexity_reason)
+    
+    async def astream_query(self, query: str, customer_context: dict, conversation: str = ""):
+        """Streaming variant of ahandle_query that yields the response text as the model generates it"""
+        complexity_reason = self._determine_complexity(query)
+        if not self.api_available:
+            yield self._fallback_response(query, customer_context, complexity_reason)
+            return
+        
+        account_id = customer_context.get("account_id", "Unknown")
+        
+        streamed = False
+        try:
+            async for token in atraced_stream("escalation_handler", self.model,
+                self.prompt.format_messages(
+                    query=query,
+                    account_id=account_id,
+                    complexity_reason=complexity_reason,
+                    conversation=conversation or "No previous messages."
+                )
+            ):
+                streamed = True
+                yield token
+        except Exception:
+            # Fall back only if nothing was sent yet; a partial answer can't be taken back
+            if not streamed:
+                yield self._fallback_response(query, customer_context, complexity_reason)
+    
     def _fallback_response(self, query: str, customer_context: dict, complexity_reason: str) -> str:
         """Provide fallback response when OpenAI API is unavailable"""
         account_id = customer_context.get("account_id", "your account")
@@ -66,15 +138,5 @@ Is there anything else I can help clarify while we arrange this connection?"""
     
     def _determine_complexity(self, query: str) -> str:
         """Determine why this query needs human escalation"""
-        query_lower = query.lower()
-        
-        if any(word in query_lower for word in ["cancel", "disconnect", "terminate"]):
-            return "Account cancellation requires human verification"
-        elif any(word in query_lower for word in ["complaint", "dissatisfied", "angry"]):
-            return "Customer complaint requires personalized attention"
-        elif any(word in query_lower for word in ["legal", "lawsuit", "attorney"]):
-            return "Legal matter requires specialized handling"
-        elif any(word in query_lower for word in ["supervisor", "manager", "human"]):
-            return "Customer explicitly requested human agent"
-        else:
-            return "Complex issue requiring human expertise"
\ No newline at end of file
+        reason, _ = _complexity_matcher.best(query)
+        return reason or "Complex issue requiring human expertise"
\ No newline at end of file
@@ -0,0 +1,209 @@
+"""
+Local CPU-only intent model used as a fast path in front of the LLM.
+
+A TF-IDF bag of word n-grams and character n-grams feeding a softmax
+regression, trained with numpy. The model is saved as a compressed .npz
+(vocabulary, idf, weights, labels) that loads in a few milliseconds.
+
+Usage:
+    python -m agents.fast_intent train --data evaluation/test_cases.json \\
+        --traffic logs/intent_traffic.jsonl --out data/models/intent_fastpath.npz
+    python -m agents.fast_intent predict "my bill is too high"
+"""
+
+import argparse
+import json
+import math
+import os
+import time
+from collections import Counter
+from typing import Dict, Iterable, List, Tuple
+import numpy as np
+from agents.cache import normalize_query
+
+DEFAULT_MODEL_PATH = "data/models/intent_fastpath.npz"
+
+def extract_features(text: str) -> Counter:
+    """Word unigrams/bigrams plus character 3-5 grams of each word"""
+    words = normalize_query(text).split()
+    features = Counter()
+    for i, word in enumerate(words):
+        features[f"w:{word}"] += 1
+        if i + 1 < len(words):
+            features[f"b:{word} {words[i + 1]}"] += 1
+        padded = f"<{word}>"
+        for n in (3, 4, 5):
+            for start in range(len(padded) - n + 1):
+                features[f"c:{padded[start:start + n]}"] += 1
+    return features
+
+class FastIntentModel:
+    def __init__(self, vocabulary: List[str], idf: np.ndarray, weights: np.ndarray,
+                 bias: np.ndarray, labels: List[str]):
+        self.vocabulary = {term: index for index, term in enumerate(vocabulary)}
+        self.idf = idf.astype(np.float32)
+        self.weights = weights.astype(np.float32)
+        self.bias = bias.astype(np.float32)
+        self.labels = list(labels)
+
+    @classmethod
+    def train(cls, examples: List[Tuple[str, str]], epochs: int = 200, learning_rate: float = 2.0,
+              l2: float = 1e-3, max_features: int = 50000, batch_size: int = 512, seed: int = 0) -> "FastIntentModel":
+        """Fit TF-IDF features and a softmax regression on (query, intent) pairs"""
+        labels = sorted({intent for _, intent in examples})
+        label_index = {label: i for i, label in enumerate(labels)}
+        featurized = [extract_features(query) for query, _ in examples]
+
+        document_frequency = Counter()
+        for features in featurized:
+            document_frequency.update(features.keys())
+        vocabulary = [term for term, _ in document_frequency.most_common(max_features)]
+        total = len(examples)
+        idf = np.array([math.log((1 + total) / (1 + document_frequency[term])) + 1 for term in vocabulary],
+                       dtype=np.float32)
+
+        model = cls(vocabulary, idf, np.zeros((len(vocabulary), len(labels))), np.zeros(len(labels)), labels)
+        targets = np.array([label_index[intent] for _, intent in examples])
+        rows = [model._sparse(features) for features in featurized]
+        rng = np.random.default_rng(seed)
+
+        for _ in range(epochs):
+            order = rng.permutation(total)
+            for start in range(0, total, batch_size):
+                batch = order[start:start + batch_size]
+                inputs = model._dense([rows[i] for i in batch])
+                probabilities = _softmax(inputs @ model.weights + model.bias)
+                probabilities[np.arange(len(batch)), targets[batch]] -= 1.0
+                probabilities /= len(batch)
+                model.weights -= learning_rate * (inputs.T @ probabilities + l2 * model.weights)
+                model.bias -= learning_rate * probabilities.sum(axis=0)
+
+        return model
+
+    def predict(self, query: str) -> Dict[str, float]:
+        """Top intent with its probability and the margin over the runner-up"""
+        probabilities = self.predict_proba(query)
+        ranked = np.argsort(probabilities)[::-1]
+        top = float(probabilities[ranked[0]])
+        runner_up = float(probabilities[ranked[1]]) if len(ranked) > 1 else 0.0
+        return {
+            "intent": self.labels[ranked[0]],
+            "confidence": top,
+            "margin": top - runner_up
+        }
+
+    def predict_proba(self, query: str) -> np.ndarray:
+        indices, values = self._sparse(extract_features(query))
+        logits = self.bias.copy()
+        if len(indices):
+            logits += values @ self.weights[indices]
+        return _softmax(logits[np.newaxis, :])[0]
+
+    def _sparse(self, features: Counter) -> Tuple[np.ndarray, np.ndarray]:
+        """Sublinear TF-IDF weights for the known features, L2-normalized"""
+        indices, values = [], []
+        for term, count in features.items():
+            index = self.vocabulary.get(term)
+            if index is not None:
+                indices.append(index)
+                values.append((1 + math.log(count)) * self.idf[index])
+        values = np.array(values, dtype=np.float32)
+        norm = np.linalg.norm(values)
+        if norm:
+            values /= norm
+        return np.array(indices, dtype=np.int64), values
+
+    def _dense(self, rows: List[Tuple[np.ndarray, np.ndarray]]) -> np.ndarray:
+        inputs = np.zeros((len(rows), len(self.vocabulary)), dtype=np.float32)
+        for row, (indices, values) in enumerate(rows):
+            inputs[row, indices] = values
+        return inputs
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        terms = sorted(self.vocabulary, key=self.vocabulary.get)
+        np.savez_compressed(
+            path,
+            vocabulary=np.array(terms),
+            idf=self.idf,
+            weights=self.weights.astype(np.float16),
+            bias=self.bias,
+            labels=np.array(self.labels)
+        )
+
+    @classmethod
+    def load(cls, path: str) -> "FastIntentModel":
+        with np.load(path, allow_pickle=False) as data:
+            return cls(data["vocabulary"].tolist(), data["idf"], data["weights"], data["bias"],
+                       data["labels"].tolist())
+
+def _softmax(logits: np.ndarray) -> np.ndarray:
+    shifted = np.exp(logits - logits.max(axis=1, keepdims=True))
+    return shifted / shifted.sum(axis=1, keepdims=True)
+
+def load_default_fast_model():
+    """Load the model at INTENT_FASTPATH_MODEL (or the default path) if it exists"""
+    path = os.getenv("INTENT_FASTPATH_MODEL", DEFAULT_MODEL_PATH)
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        return FastIntentModel.load(path)
+    except Exception as e:
+        print(f"Error loading fast intent model from {path}: {e}")
+        return None
+
+def load_examples(test_case_paths: Iterable[str] = (), traffic_paths: Iterable[str] = (),
+                  min_confidence: float = 0.8) -> List[Tuple[str, str]]:
+    """Labeled (query, intent) pairs from golden test cases and logged classifier traffic"""
+    examples = []
+    for path in test_case_paths:
+        with open(path, "r") as f:
+            examples.extend((case["query"], case["expected_intent"]) for case in json.load(f))
+
+    for path in traffic_paths:
+        with open(path, "r") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if record.get("confidence", 1.0) >= min_confidence:
+                    examples.append((record["query"], record["intent"]))
+    return examples
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description="Train or query the local fast-path intent model")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    train = subparsers.add_parser("train", help="Train and export a model")
+    train.add_argument("--data", nargs="*", default=["evaluation/test_cases.json"],
+                       help="Golden test case JSON files")
+    train.add_argument("--traffic", nargs="*", default=[],
+                       help="JSONL logs of LLM classifications (see INTENT_TRAFFIC_LOG)")
+    train.add_argument("--min-confidence", type=float, default=0.8,
+                       help="Ignore logged classifications below this confidence")
+    train.add_argument("--epochs", type=int, default=200)
+    train.add_argument("--out", default=DEFAULT_MODEL_PATH)
+
+    predict = subparsers.add_parser("predict", help="Classify a query with an exported model")
+    predict.add_argument("query")
+    predict.add_argument("--model", default=DEFAULT_MODEL_PATH)
+
+    args = parser.parse_args(argv)
+
+    if args.command == "train":
+        examples = load_examples(args.data, args.traffic, args.min_confidence)
+        start = time.perf_counter()
+        model = FastIntentModel.train(examples, epochs=args.epochs)
+        model.save(args.out)
+        print(f"Trained on {len(examples)} examples, {len(model.vocabulary)} features, "
+              f"{len(model.labels)} intents in {time.perf_counter() - start:.2f}s")
+        print(f"Saved to {args.out} ({os.path.getsize(args.out) / 1024:.1f} KB)")
+    else:
+        start = time.perf_counter()
+        model = FastIntentModel.load(args.model)
+        loaded = time.perf_counter() - start
+        print(json.dumps(model.predict(args.query)))
+        print(f"Model loaded in {loaded * 1000:.1f}ms")
+
+if __name__ == "__main__":
+    main()
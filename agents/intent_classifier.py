@@ -1,27 +1,155 @@
-from langchain_openai import ChatOpenAI
 from langchain.prompts import ChatPromptTemplate
+from agents.cache import QueryCache, SemanticCache, TTLCache
+from agents.fast_intent import FastIntentModel, load_default_fast_model
+from agents.keyword_matcher import KeywordMatcher
+from agents.registry import get_chat_model, get_embeddings
+from agents.tracing import atraced_invoke, record_cache, traced_invoke
+from typing import List, Optional
+import asyncio
 import json
 import os
+import re
+
+GREETINGS = {'hello', 'hi', 'hey', 'good morning', 'good afternoon', 'good evening'}
+
+# Keyword rules for the fallback classifier, in tie-break priority order.
+# Matching is on whole words, so inflected forms are listed explicitly.
+FALLBACK_KEYWORDS = {
+    "billing_inquiry": {
+        "bill": 1.0, "bills": 1.0, "billing": 1.0, "billed": 1.0,
+        "charge": 1.0, "charges": 1.0, "charged": 1.0,
+        "payment": 1.0, "payments": 1.0, "pay": 0.5,
+        "cost": 1.0, "costs": 1.0, "fee": 1.0, "fees": 1.0,
+        "invoice": 1.0, "refund": 1.0, "rates": 0.5, "roaming": 0.5
+    },
+    "account_management": {
+        "password": 1.0, "account": 0.5, "login": 1.0, "log in": 1.0, "username": 1.0,
+        "upgrade": 1.0, "downgrade": 1.0, "plan": 0.5, "plans": 0.5, "change": 0.5, "add a line": 1.0
+    },
+    "technical_support": {
+        "network": 1.0, "signal": 1.0, "speed": 1.0, "slow": 0.5, "connection": 1.0,
+        "outage": 1.0, "technical": 1.0, "coverage": 1.0, "5g": 1.0, "setting up": 1.0, "set up": 1.0
+    },
+    "complaint": {
+        "complaint": 1.0, "complain": 1.0, "angry": 1.0, "frustrated": 1.0, "terrible": 1.0,
+        "awful": 1.0, "dissatisfied": 1.0, "unhappy": 1.0, "ridiculous": 1.0, "money back": 1.0
+    },
+    "escalation": {
+        "manager": 1.5, "supervisor": 1.5, "human": 1.5, "agent": 1.0, "representative": 1.0,
+        "cancel": 1.5, "cancellation": 1.5
+    }
+}
+
+# Fallback confidence per winning intent; general_info covers "no keyword matched"
+FALLBACK_CONFIDENCE = {"escalation": 0.9, "general_info": 0.6}
+
+_fallback_matcher = KeywordMatcher(FALLBACK_KEYWORDS)
+
+INTENT_DESCRIPTIONS = """- billing_inquiry: Questions about bills, charges, pricing, payments
+- account_management: Password reset, plan changes, upgrades, account info
+- technical_support: Network issues, 5G coverage, speed problems, device issues
+- complaint: Complaints about service, billing disputes, dissatisfaction
+- general_info: Information about plans, features, coverage areas
+- escalation: Explicit request for human agent or supervisor"""
+
+_JSON_OBJECT = re.compile(r"\{[^{}]*\}")
+
+def classify_by_keywords(query: str) -> dict:
+    """Score the query against the fallback keyword table and return the best intent"""
+    query_lower = query.lower().strip()
+    
+    # Greeting keywords - handle simple greetings
+    if query_lower in GREETINGS:
+        return {"intent": "general_info", "confidence": 0.9}
+    
+    intent, _ = _fallback_matcher.best(query)
+    intent = intent or "general_info"
+    return {"intent": intent, "confidence": FALLBACK_CONFIDENCE.get(intent, 0.8)}
+
+def build_intent_cache() -> QueryCache:
+    """Classification cache configured from the environment.
+
+    INTENT_CACHE_SIZE=0 disables caching; INTENT_SEMANTIC_CACHE_THRESHOLD
+    (e.g. 0.93) enables the embedding-similarity tier.
+    """
+    size = int(os.getenv("INTENT_CACHE_SIZE", "2048"))
+    if size <= 0:
+        return None
+    ttl = float(os.getenv("INTENT_CACHE_TTL_SECONDS", "3600"))
+    
+    semantic = None
+    threshold = os.getenv("INTENT_SEMANTIC_CACHE_THRESHOLD")
+    if threshold:
+        try:
+            semantic = SemanticCache(get_embeddings(), threshold=float(threshold), max_size=size, ttl_seconds=ttl)
+        except Exception:
+            semantic = None
+    
+    return QueryCache(exact=TTLCache(max_size=size, ttl_seconds=ttl), semantic=semantic)
+
+def parse_json_items(content: str) -> list:
+    """The items of a JSON array in a model reply, tolerating code fences, prose and broken items.
+    
+    If the array as a whole doesn't parse, each flat {...} object in the
+    reply is parsed on its own and the ones that fail are skipped.
+    """
+    start, end = content.find("["), content.rfind("]")
+    if start != -1 and end > start:
+        try:
+            items = json.loads(content[start:end + 1])
+            if isinstance(items, list):
+                return items
+        except ValueError:
+            pass
+    items = []
+    for match in _JSON_OBJECT.finditer(content):
+        try:
+            items.append(json.loads(match.group()))
+        except ValueError:
+            continue
+    return items
+
+# Default for constructor arguments where None means "off" rather than "use the default"
+_DEFAULT = object()
 
 class IntentClassifier:
-    def __init__(self):
+    def __init__(self, model=None, cache: Optional[QueryCache] = _DEFAULT,
+                 fast_model: Optional[FastIntentModel] = _DEFAULT, fast_path_margin: float = None,
+                 batch_size: int = None, batch_concurrency: int = None, traffic_log: Optional[str] = _DEFAULT):
         try:
-            self.model = ChatOpenAI(model="gpt-4-turbo", temperature=0.1)
+            self.model = model or get_chat_model("gpt-4-turbo", temperature=0.1)
             self.api_available = True
         except Exception:
             self.model = None
             self.api_available = False
+        
+        # Only model answers are cached; keyword fallbacks are cheap to recompute.
+        # cache=None, fast_model=None and traffic_log=None turn those features off
+        self.cache = build_intent_cache() if cache is _DEFAULT else cache
+        
+        # Local model answers confident queries without an LLM round trip; only
+        # queries whose top-vs-runner-up probability margin is below the
+        # threshold go on to the LLM
+        self.fast_model = load_default_fast_model() if fast_model is _DEFAULT else fast_model
+        if fast_path_margin is None:
+            fast_path_margin = float(os.getenv("INTENT_FASTPATH_MARGIN", "0.5"))
+        self.fast_path_margin = fast_path_margin
+        self.traffic_log = os.getenv("INTENT_TRAFFIC_LOG") if traffic_log is _DEFAULT else traffic_log
+        
+        # classify_batch puts up to batch_size queries in one prompt and
+        # aclassify_batch sends up to batch_concurrency of those prompts at once
+        if batch_size is None:
+            batch_size = int(os.getenv("INTENT_BATCH_SIZE", "20"))
+        if batch_concurrency is None:
+            batch_concurrency = int(os.getenv("INTENT_BATCH_CONCURRENCY", "4"))
+        self.batch_size = max(1, batch_size)
+        self.batch_concurrency = max(1, batch_concurrency)
             
         self.prompt = ChatPromptTemplate.from_template("""
 You are an expert intent classifier for customer service queries.
 
 Classify this customer query into ONE of these intents:
-- billing_inquiry: Questions about bills, charges, pricing, payments
-- account_management: Password reset, plan changes, upgrades, account info
-- technical_support: Network issues, 5G coverage, speed problems, device issues
-- complaint: Complaints about service, billing disputes, dissatisfaction
-- general_info: Information about plans, features, coverage areas
-- escalation: Explicit request for human agent or supervisor
+{intents}
 
 Customer Query: {query}
 
@@ -29,61 +157,228 @@ Respond with valid JSON only:
 {{"intent": "intent_name", "confidence": 0.95}}
 
 Confidence should be 0.0-1.0 based on how certain you are.
-""")
+""").partial(intents=INTENT_DESCRIPTIONS)
+        
+        self.batch_prompt = ChatPromptTemplate.from_template("""
+You are an expert intent classifier for customer service queries.
+
+Classify EACH of the numbered customer queries below into ONE of these intents:
+{intents}
+
+Customer Queries:
+{queries}
+
+Respond with a valid JSON array only, one object per query, in the same order:
+[{{"id": 1, "intent": "intent_name", "confidence": 0.95}}]
+
+Confidence should be 0.0-1.0 based on how certain you are.
+""").partial(intents=INTENT_DESCRIPTIONS)
     
     def classify(self, query: str) -> dict:
+        cached = self.cache.get(query) if self.cache else None
+        local_result = self._classify_locally(query, cached)
+        if local_result is not None:
+            return local_result
+        return self._llm_classify(query)
+    
+    async def aclassify(self, query: str) -> dict:
+        """Async variant of classify that awaits the model without blocking the event loop"""
+        cached = await self.cache.aget(query) if self.cache else None
+        local_result = self._classify_locally(query, cached)
+        if local_result is not None:
+            return local_result
+        return await self._allm_classify(query)
+    
+    def classify_batch(self, queries: List[str], batch_size: int = None) -> List[dict]:
+        """Classify many queries at once; returns one result per query, in order.
+        
+        Queries answered by the cache, the fast path or the keyword fallback
+        cost no model call. The rest are deduplicated and sent batch_size to a
+        prompt, so the instructions are paid for once per batch instead of
+        once per query. Queries missing from a batch reply are classified on
+        their own; a failed batch call falls back to the keyword rules.
+        """
+        results, pending = [None] * len(queries), {}
+        for index, query in enumerate(queries):
+            cached = self.cache.get(query) if self.cache else None
+            results[index] = self._classify_locally(query, cached)
+            if results[index] is None:
+                pending.setdefault(query, []).append(index)
+        
+        for chunk in self._chunks(list(pending), batch_size):
+            self._fill(results, pending, chunk, self._classify_chunk(chunk))
+        return results
+    
+    async def aclassify_batch(self, queries: List[str], batch_size: int = None,
+                              concurrency: int = None) -> List[dict]:
+        """Async variant of classify_batch that sends up to concurrency batch prompts at a time"""
+        results, pending = [None] * len(queries), {}
+        for index, query in enumerate(queries):
+            cached = await self.cache.aget(query) if self.cache else None
+            results[index] = self._classify_locally(query, cached)
+            if results[index] is None:
+                pending.setdefault(query, []).append(index)
+        
+        semaphore = asyncio.Semaphore(max(1, concurrency or self.batch_concurrency))
+        
+        async def run(chunk: List[str]):
+            async with semaphore:
+                return chunk, await self._aclassify_chunk(chunk)
+        
+        for chunk, chunk_results in await asyncio.gather(*(run(chunk) for chunk in self._chunks(list(pending), batch_size))):
+            self._fill(results, pending, chunk, chunk_results)
+        return results
+    
+    def _classify_locally(self, query: str, cached: dict) -> dict:
+        """Cached, fast-path or (without a model) keyword result, or None when the LLM is needed"""
+        if self.cache:
+            record_cache("intent", cached is not None)
+        if cached is not None:
+            return dict(cached)
+        
+        fast_result = self._fast_classify(query)
+        if fast_result is not None:
+            return fast_result
+        
         # Use fallback if API is not available
         if not self.api_available:
             return self._fallback_classify(query)
-            
+        return None
+    
+    def _llm_classify(self, query: str) -> dict:
         try:
-            response = self.model.invoke(
+            response = traced_invoke("intent_classifier", self.model,
                 self.prompt.format_messages(query=query)
             )
-            
-            # Parse JSON response
-            result = json.loads(response.content)
-            
-            # Validate confidence is between 0 and 1
-            confidence = max(0.0, min(1.0, result.get("confidence", 0.5)))
-            
-            return {
-                "intent": result.get("intent", "general_info"),
-                "confidence": confidence
-            }
+            result = self._parse_response(response.content)
+            self._remember([(query, result)])
+            return dict(result)
             
         except Exception as e:
             # Fallback with rule-based classification when API fails
             return self._fallback_classify(query)
     
-    def _fallback_classify(self, query: str) -> dict:
-        """Rule-based fallback when OpenAI API is unavailable"""
-        query_lower = query.lower().strip()
-        
-        # Greeting keywords - handle simple greetings
-        if query_lower in ['hello', 'hi', 'hey', 'good morning', 'good afternoon', 'good evening']:
-            return {"intent": "general_info", "confidence": 0.9}
-        
-        # Billing keywords
-        elif any(word in query_lower for word in ['bill', 'charge', 'payment', 'cost', 'fee', 'invoice']):
-            return {"intent": "billing_inquiry", "confidence": 0.8}
-        
-        # Account keywords
-        elif any(word in query_lower for word in ['password', 'account', 'login', 'upgrade', 'plan', 'change']):
-            return {"intent": "account_management", "confidence": 0.8}
-        
-        # Technical keywords
-        elif any(word in query_lower for word in ['network', 'signal', 'speed', 'connection', 'outage', 'technical']):
-            return {"intent": "technical_support", "confidence": 0.8}
-        
-        # Complaint keywords
-        elif any(word in query_lower for word in ['complaint', 'angry', 'frustrated', 'terrible', 'awful']):
-            return {"intent": "complaint", "confidence": 0.8}
+    async def _allm_classify(self, query: str) -> dict:
+        try:
+            response = await atraced_invoke("intent_classifier", self.model,
+                self.prompt.format_messages(query=query)
+            )
+            result = self._parse_response(response.content)
+            await self._aremember([(query, result)])
+            return dict(result)
+            
+        except Exception:
+            return self._fallback_classify(query)
+    
+    def _classify_chunk(self, chunk: List[str]) -> List[dict]:
+        if len(chunk) == 1:
+            return [self._llm_classify(chunk[0])]
+        try:
+            response = traced_invoke("intent_classifier", self.model, self._batch_messages(chunk))
+        except Exception:
+            return [self._fallback_classify(query) for query in chunk]
+        parsed = self._parse_batch_response(response.content, chunk)
+        self._remember([(query, result) for query, result in zip(chunk, parsed) if result is not None])
+        return [result if result is not None else self._llm_classify(query)
+                for query, result in zip(chunk, parsed)]
+    
+    async def _aclassify_chunk(self, chunk: List[str]) -> List[dict]:
+        if len(chunk) == 1:
+            return [await self._allm_classify(chunk[0])]
+        try:
+            response = await atraced_invoke("intent_classifier", self.model, self._batch_messages(chunk))
+        except Exception:
+            return [self._fallback_classify(query) for query in chunk]
+        parsed = self._parse_batch_response(response.content, chunk)
+        await self._aremember([(query, result) for query, result in zip(chunk, parsed) if result is not None])
+        return [result if result is not None else await self._allm_classify(query)
+                for query, result in zip(chunk, parsed)]
+    
+    def _chunks(self, queries: List[str], batch_size: int = None) -> List[List[str]]:
+        size = max(1, batch_size or self.batch_size)
+        return [queries[start:start + size] for start in range(0, len(queries), size)]
+    
+    @staticmethod
+    def _fill(results: List[dict], pending: dict, chunk: List[str], chunk_results: List[dict]):
+        """Copy each query's result to every position it was submitted at"""
+        for query, result in zip(chunk, chunk_results):
+            for index in pending[query]:
+                results[index] = dict(result)
+    
+    def _batch_messages(self, chunk: List[str]):
+        # Queries are JSON-quoted so line breaks or quotes in them can't blur the numbering
+        numbered = "\n".join(f"{number}. {json.dumps(query)}" for number, query in enumerate(chunk, 1))
+        return self.batch_prompt.format_messages(queries=numbered)
+    
+    def _parse_batch_response(self, content: str, chunk: List[str]) -> List[dict]:
+        """Per-query results from a batch reply, None for each query the reply doesn't answer validly.
         
-        # Escalation keywords
-        elif any(word in query_lower for word in ['manager', 'supervisor', 'human', 'agent', 'cancel']):
-            return {"intent": "escalation", "confidence": 0.9}
+        Items are matched to queries by their "id" (or by position when it is
+        missing), so a reply that skips or reorders items still lines up.
+        """
+        results = [None] * len(chunk)
+        for position, item in enumerate(parse_json_items(content)):
+            if not isinstance(item, dict) or not isinstance(item.get("intent"), str):
+                continue
+            try:
+                index = int(item.get("id", position + 1)) - 1
+                result = self._parse_item(item)
+            except (TypeError, ValueError):
+                continue
+            if 0 <= index < len(chunk) and results[index] is None:
+                results[index] = result
+        return results
+    
+    def _fast_classify(self, query: str) -> dict:
+        """Local model prediction, or None when it isn't confident enough to skip the LLM"""
+        if self.fast_model is None:
+            return None
+        prediction = self.fast_model.predict(query)
+        confident = prediction["margin"] >= self.fast_path_margin
+        record_cache("intent_fast_path", confident)
+        if not confident:
+            return None
+        return {"intent": prediction["intent"], "confidence": prediction["confidence"]}
+    
+    def _remember(self, classified: List[tuple]):
+        """Cache (query, result) LLM classifications and log them as fast-path training data"""
+        if self.cache:
+            for query, result in classified:
+                self.cache.set(query, result)
+        if self.traffic_log and classified:
+            self._log_traffic(classified)
+    
+    async def _aremember(self, classified: List[tuple]):
+        """_remember for the event loop: missing cache embeddings are awaited and the log written from a thread"""
+        if self.cache:
+            await asyncio.gather(*(self.cache.aset(query, result) for query, result in classified))
+        if self.traffic_log and classified:
+            await asyncio.to_thread(self._log_traffic, classified)
+    
+    def _log_traffic(self, classified: List[tuple]):
+        try:
+            with open(self.traffic_log, "a") as f:
+                f.writelines(json.dumps({"query": query, **result}) + "\n" for query, result in classified)
+        except OSError:
+            pass
+    
+    def cache_stats(self) -> dict:
+        """Hit/miss counters for each cache tier"""
+        return self.cache.stats() if self.cache else {}
+    
+    def _parse_response(self, content: str) -> dict:
+        """Parse the model's JSON reply into an intent/confidence dict"""
+        return self._parse_item(json.loads(content))
+    
+    def _parse_item(self, result: dict) -> dict:
+        # Validate confidence is between 0 and 1
+        confidence = max(0.0, min(1.0, float(result.get("confidence", 0.5))))
         
-        # Default to general info with lower confidence
-        else:
-            return {"intent": "general_info", "confidence": 0.6}
\ No newline at end of file
+        return {
+            "intent": result.get("intent", "general_info"),
+            "confidence": confidence
+        }
+    
+    def _fallback_classify(self, query: str) -> dict:
+        """Rule-based fallback when OpenAI API is unavailable"""
+        return classify_by_keywords(query)
@@ -0,0 +1,75 @@
+import re
+from typing import Dict, List, Tuple
+
+class KeywordMatcher:
+    """Scores text against a declarative keyword table in a single regex pass.
+
+    The table maps each label to {keyword_or_phrase: weight}. All keywords are
+    compiled into one regex, structured as a character trie so shared prefixes
+    are only tested once, and anchored on word boundaries so "bill" does
+    not match inside "billion" and "agent" does not match "agents"; list
+    inflected forms explicitly when they should count. Each distinct keyword
+    contributes its weight once per text. Ties between labels go to the one
+    listed first in the table.
+    """
+
+    def __init__(self, table: Dict[str, Dict[str, float]]):
+        self.labels = list(table)
+        self._weights: Dict[str, List[Tuple[str, float]]] = {}
+        for label, keywords in table.items():
+            for keyword, weight in keywords.items():
+                self._weights.setdefault(keyword.lower(), []).append((label, weight))
+
+        # The leading lookahead on possible first characters lets the regex
+        # engine reject most positions before evaluating the word boundary
+        first_chars = "".join(sorted({re.escape(keyword[0]) for keyword in self._weights}))
+        self._pattern = re.compile(rf"(?=[{first_chars}])\b(?:{_trie_pattern(self._weights)})\b")
+
+    def matches(self, text: str) -> List[str]:
+        return self._pattern.findall(text.lower())
+
+    def score(self, text: str) -> Dict[str, float]:
+        """Total weight per label for the distinct keywords found in text"""
+        scores: Dict[str, float] = {}
+        for keyword in set(self.matches(text)):
+            for label, weight in self._weights[keyword]:
+                scores[label] = scores.get(label, 0.0) + weight
+        return scores
+
+    def best(self, text: str) -> Tuple[str, float]:
+        """Highest scoring label and its score, or (None, 0.0) when nothing matches"""
+        scores = self.score(text)
+        best_label, best_score = None, 0.0
+        for label in self.labels:
+            score = scores.get(label, 0.0)
+            if score > best_score:
+                best_label, best_score = label, score
+        return best_label, best_score
+
+def _trie_pattern(keywords) -> str:
+    """Regex alternation for keywords with common prefixes factored out.
+
+    Optional continuations are greedy, so the longest keyword at a position is
+    tried first and "billing" is preferred over "bill".
+    """
+    trie = {}
+    for keyword in keywords:
+        node = trie
+        for char in keyword:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node) -> str:
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        if len(branches) > 1:
+            body = "(?:" + "|".join(branches) + ")"
+            optional = body + "?"
+        else:
+            body = branches[0]
+            optional = f"(?:{body})?"
+        # If a keyword ends at this node, anything longer is optional
+        return optional if "" in node else body
+
+    return build(trie)
@@ -0,0 +1,335 @@
+import asyncio
+import os
+import random
+import threading
+import time
+from typing import Dict
+from agents.tracing import MODEL_GATEWAY_EVENTS
+
+try:
+    import openai
+    # APITimeoutError is a subclass of APIConnectionError
+    _TRANSIENT_ERRORS = (TimeoutError, ConnectionError, openai.APIConnectionError)
+    _STATUS_ERRORS = (openai.APIStatusError,)
+except ImportError:
+    _TRANSIENT_ERRORS = (TimeoutError, ConnectionError)
+    _STATUS_ERRORS = ()
+
+# HTTP statuses worth retrying: timeouts, conflicts, rate limits and server errors
+_RETRYABLE_STATUSES = {408, 409, 429}
+# Client errors that say nothing about the request: bad or unauthorized credentials
+_CREDENTIAL_STATUSES = {401, 403}
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling the model while the provider is considered unhealthy"""
+
+class TokenBucket:
+    """Rate limiter allowing rate calls per second on average and bursts of up to burst calls.
+
+    Callers reserve a token and are told how long to wait before using it,
+    so waiting callers are served in the order they arrived and the limiter
+    works the same for threads (time.sleep) and coroutines (asyncio.sleep).
+    """
+
+    def __init__(self, rate: float, burst: int = None):
+        self.rate = rate
+        self.capacity = float(burst or max(1, int(rate)))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Take a token; returns the seconds to wait before it may be used"""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+    def refund(self):
+        """Return a reserved token that won't be used"""
+        with self._lock:
+            self.tokens = min(self.capacity, self.tokens + 1)
+
+class CircuitBreaker:
+    """Stops calls to a failing provider.
+
+    Opens after failure_threshold consecutive failures. While open every call
+    is refused; after cooldown_seconds a single probe call is let through
+    (half-open) and its outcome closes or reopens the circuit.
+    """
+
+    def __init__(self, failure_threshold: int = 5, cooldown_seconds: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_started = None
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "closed":
+                return True
+            now = time.monotonic()
+            if self.state == "open" and now - self.opened_at >= self.cooldown_seconds:
+                self.state = "half_open"
+                self.probe_started = None
+            # A probe that never reported back (e.g. an abandoned stream) is replaced after a cooldown
+            if self.state == "half_open" and (self.probe_started is None
+                                              or now - self.probe_started >= self.cooldown_seconds):
+                self.probe_started = now
+                return True
+            return False
+
+    def release(self):
+        """Give back an allowed call that was never made"""
+        with self._lock:
+            self.probe_started = None
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self.probe_started = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    MODEL_GATEWAY_EVENTS.inc(1, "circuit_opened")
+                self.state = "open"
+                self.opened_at = time.monotonic()
+                self.probe_started = None
+
+class ModelGateway:
+    """Shared front door for chat model calls.
+
+    Every model from get_chat_model is wrapped in a GatewayModel, so the
+    intent classifier, specialists and judge share one HTTP connection pool,
+    one token-bucket rate limit, one retry policy and one circuit breaker.
+    Transient errors (timeouts, connection errors, 408/409/429/5xx) are
+    retried with full-jitter exponential backoff (honouring Retry-After)
+    until max_retries or the per-call deadline runs out. While the circuit
+    is open calls fail immediately with CircuitOpenError, so agents go
+    straight to their fallback answers instead of waiting on a dead provider.
+    """
+
+    def __init__(self, rate_per_second: float = None, burst: int = None, max_retries: int = None,
+                 deadline_seconds: float = None, attempt_timeout_seconds: float = None,
+                 backoff_seconds: float = 0.5, max_backoff_seconds: float = 8.0,
+                 failure_threshold: int = None, cooldown_seconds: float = None, max_connections: int = None):
+        if rate_per_second is None:
+            rate_per_second = float(os.getenv("LLM_RATE_LIMIT_RPS", "0"))
+        if burst is None and os.getenv("LLM_RATE_LIMIT_BURST"):
+            burst = int(os.getenv("LLM_RATE_LIMIT_BURST"))
+        if max_retries is None:
+            max_retries = int(os.getenv("LLM_MAX_RETRIES", "3"))
+        if deadline_seconds is None:
+            deadline_seconds = float(os.getenv("LLM_DEADLINE_SECONDS", "30"))
+        if attempt_timeout_seconds is None:
+            attempt_timeout_seconds = float(os.getenv("LLM_ATTEMPT_TIMEOUT_SECONDS", "20"))
+        if failure_threshold is None:
+            failure_threshold = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+        if cooldown_seconds is None:
+            cooldown_seconds = float(os.getenv("LLM_BREAKER_COOLDOWN_SECONDS", "30"))
+        if max_connections is None:
+            max_connections = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+
+        # A rate of 0 disables rate limiting
+        self.bucket = TokenBucket(rate_per_second, burst) if rate_per_second > 0 else None
+        self.breaker = CircuitBreaker(failure_threshold, cooldown_seconds)
+        self.max_retries = max_retries
+        self.deadline_seconds = deadline_seconds
+        self.attempt_timeout_seconds = attempt_timeout_seconds
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.max_connections = max_connections
+        self.counts = {"calls": 0, "retries": 0, "short_circuits": 0, "failures": 0, "throttled_seconds": 0.0}
+        self._http_client = None
+        self._http_async_client = None
+        self._lock = threading.Lock()
+
+    def wrap(self, model) -> "GatewayModel":
+        return GatewayModel(model, self)
+
+    def http_client(self):
+        """Shared pooled HTTP client for the sync OpenAI clients"""
+        with self._lock:
+            if self._http_client is None:
+                import httpx
+                self._http_client = httpx.Client(limits=self._limits(), timeout=self.attempt_timeout_seconds)
+            return self._http_client
+
+    def http_async_client(self):
+        """Shared pooled HTTP client for the async OpenAI clients"""
+        with self._lock:
+            if self._http_async_client is None:
+                import httpx
+                self._http_async_client = httpx.AsyncClient(limits=self._limits(), timeout=self.attempt_timeout_seconds)
+            return self._http_async_client
+
+    def call(self, function, *args, **kwargs):
+        """function(*args, **kwargs) under the rate limit, retry policy and circuit breaker"""
+        deadline = time.monotonic() + self.deadline_seconds
+        attempt = 0
+        while True:
+            wait = self._admit(deadline)
+            if wait:
+                time.sleep(wait)
+            try:
+                result = function(*args, **kwargs)
+            except Exception as e:
+                delay = self._after_failure(e, attempt, deadline)
+                time.sleep(delay)
+                attempt += 1
+                continue
+            self.breaker.record_success()
+            return result
+
+    async def acall(self, function, *args, **kwargs):
+        """Async variant of call for a coroutine function; each attempt is also cut off at the deadline"""
+        deadline = time.monotonic() + self.deadline_seconds
+        attempt = 0
+        while True:
+            wait = self._admit(deadline)
+            if wait:
+                await asyncio.sleep(wait)
+            try:
+                result = await asyncio.wait_for(function(*args, **kwargs), timeout=max(0.0, deadline - time.monotonic()))
+            except Exception as e:
+                delay = self._after_failure(e, attempt, deadline)
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            self.breaker.record_success()
+            return result
+
+    async def astream(self, model, *args, **kwargs):
+        """model.astream(*args, **kwargs) through the gateway; retried only until the first chunk arrives"""
+        deadline = time.monotonic() + self.deadline_seconds
+        attempt = 0
+        while True:
+            wait = self._admit(deadline)
+            if wait:
+                await asyncio.sleep(wait)
+            started = False
+            try:
+                async for chunk in model.astream(*args, **kwargs):
+                    started = True
+                    yield chunk
+            except Exception as e:
+                if started:
+                    # Part of the answer is already out; a retry would repeat it
+                    if self._retryable(e):
+                        self.breaker.record_failure()
+                    raise
+                delay = self._after_failure(e, attempt, deadline)
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            self.breaker.record_success()
+            return
+
+    def stats(self) -> Dict:
+        return {
+            "circuit": self.breaker.state,
+            "consecutive_failures": self.breaker.failures,
+            "rate_limit_rps": self.bucket.rate if self.bucket else None,
+            **{key: round(value, 3) if isinstance(value, float) else value for key, value in self.counts.items()}
+        }
+
+    def _admit(self, deadline: float) -> float:
+        """Check the breaker and take a rate limit token; returns the seconds to wait before calling"""
+        if not self.breaker.allow():
+            self._count("short_circuits")
+            raise CircuitOpenError("Model provider unavailable (circuit open)")
+        self._count("calls")
+        if self.bucket is None:
+            return 0.0
+        wait = self.bucket.reserve()
+        if wait and time.monotonic() + wait >= deadline:
+            self.bucket.refund()
+            self.breaker.release()
+            raise TimeoutError("Model call deadline reached waiting for the rate limit")
+        if wait:
+            self._count("throttled_seconds", wait)
+        return wait
+
+    def _after_failure(self, error: Exception, attempt: int, deadline: float) -> float:
+        """Record a failed attempt and return the backoff before retrying, or re-raise if it shouldn't be"""
+        if not self._retryable(error):
+            if self._bad_request(error):
+                # The provider answered; the request itself was bad
+                self.breaker.record_success()
+            else:
+                # A local bug or rejected credentials: no evidence either way, but
+                # give back a half-open probe slot so the next call can probe
+                self.breaker.release()
+            raise error
+        self.breaker.record_failure()
+        self._count("failures")
+        delay = self._backoff(attempt, error)
+        if attempt >= self.max_retries or time.monotonic() + delay >= deadline:
+            raise error
+        self._count("retries")
+        return delay
+
+    def _backoff(self, attempt: int, error: Exception) -> float:
+        # Full jitter spreads out the retries of callers that failed together
+        delay = random.uniform(0, min(self.max_backoff_seconds, self.backoff_seconds * 2 ** attempt))
+        response = getattr(error, "response", None)
+        retry_after = getattr(response, "headers", {}).get("retry-after") if response is not None else None
+        try:
+            return max(delay, float(retry_after)) if retry_after else delay
+        except ValueError:
+            return delay
+
+    @staticmethod
+    def _retryable(error: Exception) -> bool:
+        status = getattr(error, "status_code", None)
+        if isinstance(status, int):
+            return status in _RETRYABLE_STATUSES or status >= 500
+        return isinstance(error, _TRANSIENT_ERRORS)
+
+    @staticmethod
+    def _bad_request(error: Exception) -> bool:
+        """Whether the provider rejected the request itself (a 4xx other than 401/403)"""
+        status = getattr(error, "status_code", None)
+        return (isinstance(error, _STATUS_ERRORS) and isinstance(status, int)
+                and 400 <= status < 500 and status not in _CREDENTIAL_STATUSES)
+
+    def _count(self, key: str, amount: float = 1):
+        with self._lock:
+            self.counts[key] += amount
+        if key in ("retries", "short_circuits"):
+            MODEL_GATEWAY_EVENTS.inc(1, key)
+
+    def _limits(self):
+        import httpx
+        return httpx.Limits(max_connections=self.max_connections,
+                            max_keepalive_connections=min(self.max_connections, 20))
+
+class GatewayModel:
+    """A chat model whose invoke, ainvoke and astream calls go through a ModelGateway"""
+
+    def __init__(self, model, gateway: ModelGateway):
+        self.model = model
+        self.gateway = gateway
+
+    def invoke(self, input, config=None, **kwargs):
+        return self.gateway.call(self.model.invoke, input, config, **kwargs)
+
+    async def ainvoke(self, input, config=None, **kwargs):
+        return await self.gateway.acall(self.model.ainvoke, input, config, **kwargs)
+
+    async def astream(self, input, config=None, **kwargs):
+        async for chunk in self.gateway.astream(self.model, input, config, **kwargs):
+            yield chunk
+
+    def __getattr__(self, name):
+        # Everything else (model_name, temperature, ...) is the wrapped model's
+        return getattr(self.model, name)
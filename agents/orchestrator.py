@@ -1,11 +1,25 @@
-from typing import TypedDict, Annotated, Literal
+from typing import TypedDict, Annotated, List, Literal
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import contextvars
+import json
+import os
 from langgraph.graph import StateGraph, END
 from langchain_openai import ChatOpenAI
-from agents.intent_classifier import IntentClassifier
-from agents.billing_specialist import BillingSpecialist
-from agents.account_specialist import AccountSpecialist
-from agents.escalation_handler import EscalationHandler
+from langgraph.utils import RunnableCallable
+from langchain_core.callbacks.manager import adispatch_custom_event
+from agents.context_builder import ContextBuilder, build_context_builder
 from agents.conversation_memory import ConversationMemory
+from agents.registry import (
+    get_intent_classifier,
+    get_billing_specialist,
+    get_account_specialist,
+    get_escalation_handler,
+)
+from agents.tracing import atrace_node, start_trace, trace_node
+
+# Runs speculative knowledge base retrievals for the sync process_query path
+_prefetch_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix="prefetch")
 
 class AgentState(TypedDict):
     messages: list
@@ -15,24 +29,42 @@ class AgentState(TypedDict):
     response: str
     requires_escalation: bool
     conversation_context: str
+    prefetched: dict
+    stream: bool
+    classification: dict
 
 class OrchestratorAgent:
-    def __init__(self):
-        self.intent_classifier = IntentClassifier()
-        self.billing_agent = BillingSpecialist()
-        self.account_agent = AccountSpecialist()
-        self.escalation_agent = EscalationHandler()
-        self.memory = ConversationMemory()
+    def __init__(self, intent_classifier=None, billing_agent=None, account_agent=None,
+                 escalation_agent=None, memory: ConversationMemory = None, speculative_retrieval: bool = None,
+                 context_builder: ContextBuilder = None):
+        # Agents default to the process-wide shared instances from the registry
+        self.intent_classifier = intent_classifier or get_intent_classifier()
+        self.billing_agent = billing_agent or get_billing_specialist()
+        self.account_agent = account_agent or get_account_specialist()
+        self.escalation_agent = escalation_agent or get_escalation_handler()
+        self.memory = memory or ConversationMemory()
+        # Fits the conversation so far into the specialists' prompts
+        self.context_builder = context_builder or build_context_builder(ttl_seconds=self.memory.ttl.total_seconds())
+        # Start the retrieving specialists' knowledge base lookups while the
+        # intent is still being classified; the routed one uses its result
+        if speculative_retrieval is None:
+            speculative_retrieval = os.getenv("SPECULATIVE_RETRIEVAL", "").lower() in ("1", "true", "yes")
+        self.speculative_retrieval = speculative_retrieval
         self.graph = self._build_graph()
     
     def _build_graph(self):
         workflow = StateGraph(AgentState)
         
-        # Add nodes
-        workflow.add_node("classify_intent", self._classify_intent)
-        workflow.add_node("billing_specialist", self._billing_specialist)
-        workflow.add_node("account_specialist", self._account_specialist)
-        workflow.add_node("escalation_handler", self._escalation_handler)
+        # Add nodes (each with a sync and an async implementation so the same
+        # graph serves both invoke and ainvoke, both timed into the request trace)
+        nodes = {
+            "classify_intent": (self._classify_intent, self._aclassify_intent),
+            "billing_specialist": (self._billing_specialist, self._abilling_specialist),
+            "account_specialist": (self._account_specialist, self._aaccount_specialist),
+            "escalation_handler": (self._escalation_handler, self._aescalation_handler),
+        }
+        for name, (func, afunc) in nodes.items():
+            workflow.add_node(name, RunnableCallable(trace_node(name, func), atrace_node(name, afunc)))
         
         # Set entry point
         workflow.set_entry_point("classify_intent")
@@ -57,7 +89,15 @@ class OrchestratorAgent:
     
     def _classify_intent(self, state: AgentState) -> AgentState:
         query = state["messages"][-1]["content"]
-        result = self.intent_classifier.classify(query)
+        result = state.get("classification") or self.intent_classifier.classify(query)
+        
+        state["current_intent"] = result["intent"]
+        state["confidence"] = result["confidence"]
+        return state
+    
+    async def _aclassify_intent(self, state: AgentState) -> AgentState:
+        query = state["messages"][-1]["content"]
+        result = state.get("classification") or await self.intent_classifier.aclassify(query)
         
         state["current_intent"] = result["intent"]
         state["confidence"] = result["confidence"]
@@ -81,57 +121,315 @@ class OrchestratorAgent:
     
     def _billing_specialist(self, state: AgentState) -> AgentState:
         query = state["messages"][-1]["content"]
-        response = self.billing_agent.handle_query(query, state["customer_context"])
+        context_docs = self._prefetched_docs(state, "billing")
+        response = self.billing_agent.handle_query(query, state["customer_context"], context_docs,
+                                                  state["conversation_context"])
         state["response"] = response
         return state
     
     def _account_specialist(self, state: AgentState) -> AgentState:
         query = state["messages"][-1]["content"]
-        response = self.account_agent.handle_query(query, state["customer_context"])
+        context_docs = self._prefetched_docs(state, "account")
+        response = self.account_agent.handle_query(query, state["customer_context"], context_docs,
+                                                  state["conversation_context"])
         state["response"] = response
         return state
     
     def _escalation_handler(self, state: AgentState) -> AgentState:
         query = state["messages"][-1]["content"]
-        response = self.escalation_agent.handle_query(query, state["customer_context"])
+        response = self.escalation_agent.handle_query(query, state["customer_context"], state["conversation_context"])
         state["response"] = response
         state["requires_escalation"] = True
         return state
     
+    async def _abilling_specialist(self, state: AgentState) -> AgentState:
+        query = state["messages"][-1]["content"]
+        context_docs = await self._aprefetched_docs(state, "billing")
+        if state.get("stream"):
+            state["response"] = await self._forward_tokens(
+                self.billing_agent.astream_query(query, state["customer_context"], context_docs,
+                                                 state["conversation_context"]))
+        else:
+            state["response"] = await self.billing_agent.ahandle_query(query, state["customer_context"], context_docs,
+                                                                       state["conversation_context"])
+        return state
+    
+    async def _aaccount_specialist(self, state: AgentState) -> AgentState:
+        query = state["messages"][-1]["content"]
+        context_docs = await self._aprefetched_docs(state, "account")
+        if state.get("stream"):
+            state["response"] = await self._forward_tokens(
+                self.account_agent.astream_query(query, state["customer_context"], context_docs,
+                                                 state["conversation_context"]))
+        else:
+            state["response"] = await self.account_agent.ahandle_query(query, state["customer_context"], context_docs,
+                                                                       state["conversation_context"])
+        return state
+    
+    async def _aescalation_handler(self, state: AgentState) -> AgentState:
+        query = state["messages"][-1]["content"]
+        if state.get("stream"):
+            state["response"] = await self._forward_tokens(
+                self.escalation_agent.astream_query(query, state["customer_context"], state["conversation_context"]))
+        else:
+            state["response"] = await self.escalation_agent.ahandle_query(query, state["customer_context"],
+                                                                        state["conversation_context"])
+        state["requires_escalation"] = True
+        return state
+    
+    async def _forward_tokens(self, tokens) -> str:
+        """Emit each streamed token as a "token" graph event for astream_query and return the full text"""
+        parts = []
+        async for token in tokens:
+            parts.append(token)
+            await adispatch_custom_event("token", {"content": token})
+        return "".join(parts)
+    
+    def _prefetch_targets(self) -> dict:
+        """Route -> specialist for the specialists that would retrieve (those with a working model)"""
+        if not self.speculative_retrieval:
+            return {}
+        specialists = {"billing": self.billing_agent, "account": self.account_agent}
+        return {route: agent for route, agent in specialists.items()
+                if getattr(agent, "api_available", False) and hasattr(agent, "retrieve_context")}
+    
+    def _prefetched_docs(self, state: AgentState, route: str):
+        """The route's speculative retrieval result, or None to let the specialist retrieve itself"""
+        future = state.get("prefetched", {}).pop(route, None)
+        return future.result() if future is not None else None
+    
+    async def _aprefetched_docs(self, state: AgentState, route: str):
+        task = state.get("prefetched", {}).pop(route, None)
+        return await task if task is not None else None
+    
     def process_query(self, query: str, user_id: str = "default", customer_context: dict = None) -> dict:
-        # Get conversation history
-        conversation_history = self.memory.get_conversation(user_id)
-        context_summary = self.memory.get_context_summary(user_id)
+        with start_trace() as trace:
+            initial_state = self._prepare_state(query, user_id, customer_context)
+            prefetched = initial_state["prefetched"]
+            for route, agent in self._prefetch_targets().items():
+                # Copy the context so the retrieval is recorded in this request's trace
+                prefetched[route] = _prefetch_pool.submit(contextvars.copy_context().run, agent.retrieve_context, query)
+            try:
+                result = self.graph.invoke(initial_state)
+            finally:
+                # Drop speculative retrievals for the routes not taken
+                for future in prefetched.values():
+                    future.cancel()
+            return self._record_result(user_id, result, trace.summary())
+    
+    async def aprocess_query(self, query: str, user_id: str = "default", customer_context: dict = None,
+                             classification: dict = None) -> dict:
+        """Async variant of process_query; runs the graph with ainvoke.
+        
+        A classification already made for the query (e.g. by classify_batch)
+        is used instead of classifying it again.
+        """
+        with start_trace() as trace:
+            initial_state = await self._aprepare_state(query, user_id, customer_context)
+            initial_state["classification"] = classification
+            prefetched = initial_state["prefetched"]
+            for route, agent in self._prefetch_targets().items():
+                prefetched[route] = asyncio.ensure_future(agent.aretrieve_context(query))
+            try:
+                result = await self.graph.ainvoke(initial_state)
+            finally:
+                for task in prefetched.values():
+                    task.cancel()
+            return await self._arecord_result(user_id, result, trace.summary())
+    
+    async def aprocess_batch(self, queries: List[dict], concurrency: int = None) -> List[dict]:
+        """Answer many queries concurrently; returns {"result": ...} or {"error": ...} per query, in order.
         
-        # Add current query to memory
-        self.memory.add_message(user_id, "user", query)
+        Each query is a dict with "message" and optional "user_id" and
+        "customer_context". At most concurrency queries (BATCH_CONCURRENCY,
+        default 16) are processed at once. A user's queries run one after
+        another in submission order so their conversation stays coherent, and
+        a repeat of an earlier query from the same user (same message and
+        customer context) gets that query's answer instead of being processed
+        again. Users opening a new session with the same message and customer
+        context build the same prompt, so one of them is processed and the
+        others get (and record in their history) that answer, unless it was
+        an error or an escalation. One failing query doesn't affect the
+        others. Distinct messages are classified up front with the
+        classifier's batched prompts.
+        """
+        if concurrency is None:
+            concurrency = int(os.getenv("BATCH_CONCURRENCY", "16"))
+        semaphore = asyncio.Semaphore(max(1, concurrency))
         
-        initial_state = {
+        classifications = {}
+        if hasattr(self.intent_classifier, "aclassify_batch"):
+            messages = list(dict.fromkeys(query["message"] for query in queries))
+            try:
+                classifications = dict(zip(messages, await self.intent_classifier.aclassify_batch(messages)))
+            except Exception as e:
+                # Each query is classified on its own instead
+                print(f"Error classifying batch: {e}")
+        
+        outcomes = [None] * len(queries)
+        by_user = {}
+        for index, query in enumerate(queries):
+            by_user.setdefault(query.get("user_id") or "default", []).append(index)
+        # Outcomes of first turns (sessions without history), shared across users
+        first_turns = {}
+        
+        async def run_user(user_id: str, indices: List[int]):
+            answered = {}
+            for position, index in enumerate(indices):
+                query = queries[index]
+                key = (query["message"], json.dumps(query.get("customer_context") or {}, sort_keys=True, default=str))
+                if key in answered:
+                    outcomes[index] = {**answered[key], "coalesced": True}
+                    continue
+                
+                leading = None
+                outcome = {"error": "Error processing query: not processed"}
+                try:
+                    if position == 0 and not await self.memory.aget_conversation(user_id):
+                        # With no history the prompt is the same for every user, so the
+                        # first user to ask answers for all of them
+                        if key in first_turns:
+                            shared = await first_turns[key]
+                            if self._shareable(shared):
+                                await self._arecord_shared_turn(user_id, query["message"], shared["result"])
+                                answered[key] = shared
+                                outcomes[index] = {**shared, "coalesced": True}
+                                continue
+                        else:
+                            leading = first_turns[key] = asyncio.get_running_loop().create_future()
+                    
+                    async with semaphore:
+                        outcome = {"result": await self.aprocess_query(
+                            query["message"], user_id=user_id, customer_context=query.get("customer_context"),
+                            classification=classifications.get(query["message"]))}
+                except Exception as e:
+                    outcome = {"error": f"Error processing query: {str(e)}"}
+                finally:
+                    # Users waiting on this first turn must never be left hanging
+                    if leading is not None:
+                        leading.set_result(outcome)
+                answered[key] = outcomes[index] = outcome
+        
+        await asyncio.gather(*(run_user(user_id, indices) for user_id, indices in by_user.items()))
+        return outcomes
+    
+    async def astream_query(self, query: str, user_id: str = "default", customer_context: dict = None):
+        """Streaming variant of aprocess_query.
+        
+        Yields {"event": "intent", "intent", "confidence"} once the query is
+        classified, {"event": "token", "content"} for each piece of the
+        specialist's answer as it is generated, and finally {"event": "done"}
+        with the same fields as aprocess_query's result. The full response is
+        recorded in memory when the stream completes; if the consumer stops
+        early, whatever was streamed so far is recorded instead.
+        """
+        with start_trace() as trace:
+            initial_state = await self._aprepare_state(query, user_id, customer_context)
+            initial_state["stream"] = True
+            prefetched = initial_state["prefetched"]
+            for route, agent in self._prefetch_targets().items():
+                prefetched[route] = asyncio.ensure_future(agent.aretrieve_context(query))
+            result, recorded = None, False
+            streamed, classified = [], {}
+            try:
+                try:
+                    async for event in self.graph.astream_events(initial_state, version="v2"):
+                        kind, name = event["event"], event["name"]
+                        if kind == "on_custom_event" and name == "token":
+                            streamed.append(event["data"]["content"])
+                            yield {"event": "token", "content": event["data"]["content"]}
+                        elif kind == "on_chain_end" and name == "classify_intent":
+                            classified = event["data"]["output"]
+                            yield {"event": "intent", "intent": classified["current_intent"],
+                                   "confidence": classified["confidence"]}
+                        elif kind == "on_chain_end" and not event.get("parent_ids"):
+                            result = event["data"]["output"]
+                finally:
+                    for task in prefetched.values():
+                        task.cancel()
+                if result is None:
+                    # No final state came out of the graph; the answer is what was streamed
+                    result = self._streamed_state(streamed, classified)
+                response = await self._arecord_result(user_id, result, trace.summary())
+                recorded = True
+                yield {"event": "done", **response}
+            finally:
+                if not recorded:
+                    # The client went away (or the graph failed) mid-answer: keep what was sent,
+                    # so the history doesn't hold a question without a reply
+                    await self._arecord_result(user_id, self._streamed_state(streamed, classified))
+    
+    def _prepare_state(self, query: str, user_id: str, customer_context: dict = None) -> AgentState:
+        # Get conversation history and add the current query to memory in one step
+        conversation_history = self.memory.start_turn(user_id, query)
+        return self._initial_state(query, customer_context,
+                                   self.context_builder.build(user_id, conversation_history))
+    
+    async def _aprepare_state(self, query: str, user_id: str, customer_context: dict = None) -> AgentState:
+        """_prepare_state for the event loop: the session store and a model-written summary are awaited, not blocked on"""
+        conversation_history = await self.memory.astart_turn(user_id, query)
+        return self._initial_state(query, customer_context,
+                                   await self.context_builder.abuild(user_id, conversation_history))
+    
+    @staticmethod
+    def _initial_state(query: str, customer_context: dict, conversation_context: str) -> AgentState:
+        return {
             "messages": [{"role": "user", "content": query}],
             "current_intent": "",
             "confidence": 0.0,
             "customer_context": customer_context or {},
             "response": "",
             "requires_escalation": False,
-            "conversation_context": context_summary
+            "conversation_context": conversation_context,
+            "prefetched": {},
+            "stream": False,
+            "classification": None
         }
-        
-        result = self.graph.invoke(initial_state)
-        
+    
+    def _record_result(self, user_id: str, result: AgentState, metadata: dict = None) -> dict:
         # Add response to memory
-        self.memory.add_message(
-            user_id, 
-            "assistant", 
-            result["response"],
-            {
-                "intent": result["current_intent"],
-                "confidence": result["confidence"]
-            }
-        )
-        
+        self.memory.add_message(user_id, "assistant", result["response"], self._response_metadata(result))
+        return self._response(result, metadata)
+    
+    async def _arecord_result(self, user_id: str, result: AgentState, metadata: dict = None) -> dict:
+        await self.memory.aadd_message(user_id, "assistant", result["response"], self._response_metadata(result))
+        return self._response(result, metadata)
+    
+    async def _arecord_shared_turn(self, user_id: str, query: str, response: dict):
+        """Record a turn answered with another user's identical first-turn response"""
+        await self.memory.astart_turn(user_id, query)
+        await self.memory.aadd_message(user_id, "assistant", response["response"],
+                                       {"intent": response["intent"], "confidence": response["confidence"]})
+    
+    @staticmethod
+    def _shareable(outcome: dict) -> bool:
+        # Failures are retried per user and escalations are handled per customer
+        return "result" in outcome and not outcome["result"]["requires_escalation"]
+    
+    @staticmethod
+    def _streamed_state(streamed: List[str], classified: dict) -> dict:
+        """Final state for a stream from the tokens sent and the classification, if any"""
+        return {
+            "response": "".join(streamed),
+            "current_intent": classified.get("current_intent", "unknown"),
+            "confidence": classified.get("confidence", 0.0),
+            "requires_escalation": classified.get("requires_escalation", False)
+        }
+    
+    @staticmethod
+    def _response_metadata(result: AgentState) -> dict:
+        return {
+            "intent": result["current_intent"],
+            "confidence": result["confidence"]
+        }
+    
+    @staticmethod
+    def _response(result: AgentState, metadata: dict = None) -> dict:
         return {
             "response": result["response"],
             "intent": result["current_intent"],
             "confidence": result["confidence"],
-            "requires_escalation": result["requires_escalation"]
-        }
\ No newline at end of file
+            "requires_escalation": result["requires_escalation"],
+            # Per-request timings, token usage and cache results
+            "metadata": metadata or {}
+        }
@@ -0,0 +1,101 @@
+import os
+import threading
+from typing import Any, Callable, Hashable, List
+
+class ComponentRegistry:
+    """Process-wide cache of expensive components (models, retrievers, agents).
+
+    Components are built lazily the first time they are requested and then
+    shared by every caller asking for the same key. Construction failures are
+    not cached, so a component whose dependencies were unavailable is retried
+    on the next request.
+    """
+
+    def __init__(self):
+        self._components = {}
+        # Re-entrant because factories request their own dependencies
+        self._lock = threading.RLock()
+
+    def get_or_create(self, key: Hashable, factory: Callable[[], Any]) -> Any:
+        component = self._components.get(key)
+        if component is not None:
+            return component
+
+        with self._lock:
+            component = self._components.get(key)
+            if component is None:
+                component = factory()
+                self._components[key] = component
+            return component
+
+    def keys(self) -> List[Hashable]:
+        return list(self._components)
+
+    def clear(self):
+        with self._lock:
+            self._components.clear()
+
+registry = ComponentRegistry()
+
+def get_model_gateway():
+    """Shared rate limiter, retry policy, circuit breaker and connection pool for all chat models"""
+    from agents.model_gateway import ModelGateway
+    return registry.get_or_create(("model_gateway",), ModelGateway)
+
+def get_chat_model(model: str = "gpt-4-turbo", temperature: float = 0.1):
+    """Shared ChatOpenAI client for a (model, temperature) configuration, behind the model gateway"""
+    def factory():
+        from langchain_openai import ChatOpenAI
+        gateway = get_model_gateway()
+        # The gateway does the retrying and bounds each attempt; stream_usage
+        # reports token counts on streamed responses too
+        return gateway.wrap(ChatOpenAI(
+            model=model, temperature=temperature, stream_usage=True,
+            max_retries=0, timeout=gateway.attempt_timeout_seconds,
+            http_client=gateway.http_client(), http_async_client=gateway.http_async_client()
+        ))
+    return registry.get_or_create(("chat_model", model, temperature), factory)
+
+def get_embeddings():
+    """Shared OpenAI embeddings client, behind the content-hash embedding cache"""
+    def factory():
+        from langchain_openai import OpenAIEmbeddings
+        from rag.embedding_cache import CachedEmbeddings
+        default_path = os.path.join(os.getenv("CHROMA_PERSIST_DIRECTORY", "./data/chroma"), "embeddings.sqlite")
+        # An empty EMBEDDING_CACHE_PATH keeps the cache in memory only
+        cache_path = os.getenv("EMBEDDING_CACHE_PATH", default_path)
+        return CachedEmbeddings(OpenAIEmbeddings(), cache_path=cache_path or None)
+    return registry.get_or_create(("embeddings",), factory)
+
+def get_retriever(docs_path: str):
+    """Shared knowledge base retriever for a documents directory"""
+    docs_path = os.path.normpath(docs_path)
+    def factory():
+        from rag.retriever import KnowledgeBaseRetriever
+        return KnowledgeBaseRetriever(docs_path)
+    return registry.get_or_create(("retriever", docs_path), factory)
+
+def get_knowledge_base():
+    """Shared retriever over the whole knowledge base; specialists filter it by domain"""
+    return get_retriever(os.getenv("KNOWLEDGE_BASE_PATH", "data/sample_data"))
+
+def get_intent_classifier():
+    from agents.intent_classifier import IntentClassifier
+    return registry.get_or_create(("agent", "intent_classifier"), IntentClassifier)
+
+def get_billing_specialist():
+    from agents.billing_specialist import BillingSpecialist
+    return registry.get_or_create(("agent", "billing_specialist"), BillingSpecialist)
+
+def get_account_specialist():
+    from agents.account_specialist import AccountSpecialist
+    return registry.get_or_create(("agent", "account_specialist"), AccountSpecialist)
+
+def get_escalation_handler():
+    from agents.escalation_handler import EscalationHandler
+    return registry.get_or_create(("agent", "escalation_handler"), EscalationHandler)
+
+def get_orchestrator():
+    """Shared orchestrator (and its conversation memory) for the whole process"""
+    from agents.orchestrator import OrchestratorAgent
+    return registry.get_or_create(("agent", "orchestrator"), OrchestratorAgent)
@@ -0,0 +1,140 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from agents.cache import TTLCache
+from agents.tracing import record_cache
+
+# Model settings that change what a prompt generates, when the model has them
+MODEL_PARAMETERS = ("model_name", "temperature", "max_tokens", "top_p", "seed", "frequency_penalty", "presence_penalty")
+
+class SQLiteResponseStore:
+    """On-disk key -> response text table with expiry times (SQLite in WAL mode)."""
+
+    def __init__(self, path: str, prune_every: int = 256):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, response TEXT, expires_at REAL)"
+        )
+        self._lock = threading.Lock()
+        self.prune_every = prune_every
+        self._writes = 0
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT response FROM responses WHERE key = ? AND expires_at > ?", (key, time.time())
+            ).fetchone()
+        return row[0] if row else None
+
+    def put(self, key: str, response: str, ttl_seconds: float):
+        with self._lock:
+            self._connection.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?)",
+                                     (key, response, time.time() + ttl_seconds))
+            self._writes += 1
+            # Expired rows are only skipped by get; drop them now and then
+            if self._writes % self.prune_every == 0:
+                self._connection.execute("DELETE FROM responses WHERE expires_at <= ?", (time.time(),))
+            self._connection.commit()
+
+class ResponseCache:
+    """Cache of model answers keyed on a hash of the formatted prompt and the model's settings.
+
+    Identical prompts (same query, retrieved context, customer context and
+    conversation) sent to an identically configured model are answered
+    without a model call. Lookups go to an in-memory LRU with a TTL, then to
+    an optional SQLite file that survives restarts and is shared by workers.
+    The async methods (alookup, aset) do the SQLite reads and writes in a
+    worker thread so they never block the event loop.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl_seconds: float = 3600, path: str = None):
+        self.ttl_seconds = ttl_seconds
+        self.memory = TTLCache(max_size=max_size, ttl_seconds=ttl_seconds)
+        self.disk = SQLiteResponseStore(path) if path else None
+        self.disk_hits = 0
+
+    def key(self, model, messages: List[Any]) -> str:
+        settings = {name: getattr(model, name, None) for name in MODEL_PARAMETERS}
+        settings["type"] = getattr(model, "_llm_type", type(model).__name__)
+        prompt = [(getattr(message, "type", ""), message.content) for message in messages]
+        payload = json.dumps([settings, prompt], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def lookup(self, name: str, model, messages: List[Any]) -> Tuple[str, Optional[str]]:
+        """The prompt's key and cached answer (None on a miss), recorded as a name cache event"""
+        key = self.key(model, messages)
+        response = self.get(key)
+        record_cache(name, response is not None)
+        return key, response
+
+    async def alookup(self, name: str, model, messages: List[Any]) -> Tuple[str, Optional[str]]:
+        """Async variant of lookup that reads the disk tier in a worker thread"""
+        key = self.key(model, messages)
+        response = await self.aget(key)
+        record_cache(name, response is not None)
+        return key, response
+
+    def get(self, key: str) -> Optional[str]:
+        response = self.memory.get(key)
+        if response is None and self.disk is not None:
+            response = self._disk_get(key)
+        return response
+
+    async def aget(self, key: str) -> Optional[str]:
+        response = self.memory.get(key)
+        if response is None and self.disk is not None:
+            response = await asyncio.to_thread(self._disk_get, key)
+        return response
+
+    def set(self, key: str, response: str):
+        self.memory.set(key, response)
+        if self.disk is not None:
+            self._disk_put(key, response)
+
+    async def aset(self, key: str, response: str):
+        self.memory.set(key, response)
+        if self.disk is not None:
+            await asyncio.to_thread(self._disk_put, key, response)
+
+    def _disk_get(self, key: str) -> Optional[str]:
+        try:
+            response = self.disk.get(key)
+        except sqlite3.Error as e:
+            print(f"Error reading response cache: {e}")
+            return None
+        if response is not None:
+            self.disk_hits += 1
+            self.memory.set(key, response)
+        return response
+
+    def _disk_put(self, key: str, response: str):
+        try:
+            self.disk.put(key, response, self.ttl_seconds)
+        except sqlite3.Error as e:
+            print(f"Error writing response cache: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {"memory": self.memory.stats(), "disk_hits": self.disk_hits}
+
+def build_response_cache(specialist: str) -> Optional[ResponseCache]:
+    """Response cache for a specialist, if RESPONSE_CACHE_SPECIALISTS opts it in.
+
+    RESPONSE_CACHE_SPECIALISTS is a comma-separated list of knowledge base
+    domains (e.g. "billing,account"); RESPONSE_CACHE_PATH adds the on-disk tier.
+    """
+    enabled = {name.strip() for name in os.getenv("RESPONSE_CACHE_SPECIALISTS", "").split(",")}
+    if specialist not in enabled:
+        return None
+    return ResponseCache(
+        max_size=int(os.getenv("RESPONSE_CACHE_SIZE", "1024")),
+        ttl_seconds=float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "3600")),
+        path=os.getenv("RESPONSE_CACHE_PATH") or None
+    )
@@ -0,0 +1,395 @@
+import json
+import os
+import queue
+import socket
+import sqlite3
+import sys
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Dict, List
+from urllib.parse import unquote, urlparse
+
+def encode_message(message: Dict) -> str:
+    """Compact JSON for a stored message: short keys, epoch timestamp, metadata only if set"""
+    record = {"r": message["role"], "c": message["content"], "t": message["timestamp"].timestamp()}
+    if message.get("metadata"):
+        record["m"] = message["metadata"]
+    return json.dumps(record, separators=(",", ":"), default=str)
+
+def decode_message(payload) -> Dict:
+    record = json.loads(payload)
+    return {
+        "role": record["r"],
+        "content": record["c"],
+        "timestamp": datetime.fromtimestamp(record["t"]),
+        "metadata": record.get("m", {})
+    }
+
+class StripedLock:
+    """A fixed set of locks shared out by key hash.
+
+    Operations on the same key are serialized while different keys rarely
+    contend, without keeping a lock per key alive forever.
+    """
+
+    def __init__(self, stripes: int = 64):
+        self._locks = [threading.RLock() for _ in range(stripes)]
+
+    def lock(self, key: str) -> threading.RLock:
+        return self._locks[hash(key) % len(self._locks)]
+
+class SessionStore(ABC):
+    """Where ConversationMemory keeps each user's recent messages.
+
+    A store keeps at most max_turns messages per session and expires a session
+    ttl_seconds after its last append.
+    """
+
+    # Stores whose backend drops expired sessions on its own need no sweeper
+    expires_itself = False
+    # Stores that wait on a file lock or the network; ConversationMemory's
+    # async methods call them from a worker thread instead of the event loop
+    blocking = True
+
+    @abstractmethod
+    def append(self, user_id: str, message: Dict, max_turns: int, ttl_seconds: float):
+        """Add a message to the session, dropping its oldest beyond max_turns"""
+
+    @abstractmethod
+    def get(self, user_id: str) -> List[Dict]:
+        """The session's messages, oldest first ([] if missing or expired)"""
+
+    def sweep(self) -> int:
+        """Drop expired sessions; returns how many were removed"""
+        return 0
+
+    def stats(self) -> Dict:
+        return {}
+
+    def close(self):
+        pass
+
+class InMemorySessionStore(SessionStore):
+    """Sessions in this process, capped at max_sessions with least-recently-active eviction.
+
+    Sessions are kept in an OrderedDict in order of their last append, so the
+    oldest is evicted first and a sweep stops at the first live session. Each
+    session's messages are a deque holding the last max_turns.
+
+    A short global lock guards the session index; each session's deque is
+    guarded by its user's stripe lock, so appends and copies for different
+    users don't wait on each other and a copy never sees a deque mid-append.
+    """
+
+    blocking = False
+
+    def __init__(self, max_sessions: int = 10000, stripes: int = 64):
+        self.conversations = OrderedDict()
+        self.max_sessions = max_sessions
+        self.evictions = 0
+        self.expirations = 0
+        self._lock = threading.Lock()
+        self._user_locks = StripedLock(stripes)
+
+    def append(self, user_id: str, message: Dict, max_turns: int, ttl_seconds: float):
+        with self._user_locks.lock(user_id):
+            now = time.monotonic()
+            with self._lock:
+                conversation = self.conversations.get(user_id)
+                if conversation is not None and now > conversation["expires_at"]:
+                    self.expirations += 1
+                    conversation = None
+                if conversation is None:
+                    conversation = self.conversations[user_id] = {"messages": deque(maxlen=max_turns)}
+                conversation["expires_at"] = now + ttl_seconds
+                self.conversations.move_to_end(user_id)
+
+                while len(self.conversations) > self.max_sessions:
+                    self.conversations.popitem(last=False)
+                    self.evictions += 1
+            conversation["messages"].append(message)
+
+    def get(self, user_id: str) -> List[Dict]:
+        with self._user_locks.lock(user_id):
+            with self._lock:
+                conversation = self.conversations.get(user_id)
+                if conversation is None:
+                    return []
+                if time.monotonic() > conversation["expires_at"]:
+                    del self.conversations[user_id]
+                    self.expirations += 1
+                    return []
+            return list(conversation["messages"])
+
+    def sweep(self) -> int:
+        now = time.monotonic()
+        removed = 0
+        with self._lock:
+            while self.conversations:
+                user_id, conversation = next(iter(self.conversations.items()))
+                if now <= conversation["expires_at"]:
+                    break
+                del self.conversations[user_id]
+                removed += 1
+            self.expirations += removed
+        return removed
+
+    def stats(self) -> Dict:
+        with self._lock:
+            sessions = list(self.conversations.items())
+            stats = {
+                "sessions": len(sessions),
+                "max_sessions": self.max_sessions,
+                "evictions": self.evictions,
+                "expirations": self.expirations
+            }
+        messages = approx_bytes = 0
+        for user_id, conversation in sessions:
+            with self._user_locks.lock(user_id):
+                session_messages = list(conversation["messages"])
+            messages += len(session_messages)
+            approx_bytes += sum(sys.getsizeof(message) + sys.getsizeof(message["content"])
+                                for message in session_messages)
+        stats["messages"], stats["approx_bytes"] = messages, approx_bytes
+        return stats
+
+class SQLiteSessionStore(SessionStore):
+    """Sessions in a SQLite file (WAL mode), shared by every worker process on the host.
+
+    Each append is one transaction that adds the message, trims the session to
+    max_turns and pushes its expiry forward; reads ignore expired sessions and
+    sweep() deletes them.
+    """
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        # Writers from other processes are waited for rather than failing
+        self._connection = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        with self._connection:
+            self._connection.executescript("""
+                CREATE TABLE IF NOT EXISTS messages (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT NOT NULL, payload TEXT NOT NULL);
+                CREATE INDEX IF NOT EXISTS messages_by_user ON messages (user_id, seq);
+                CREATE TABLE IF NOT EXISTS sessions (user_id TEXT PRIMARY KEY, expires_at REAL NOT NULL);
+                CREATE INDEX IF NOT EXISTS sessions_by_expiry ON sessions (expires_at);
+            """)
+        self._lock = threading.Lock()
+
+    def append(self, user_id: str, message: Dict, max_turns: int, ttl_seconds: float):
+        now = time.time()
+        with self._lock, self._connection:
+            # An expired session starts over
+            self._connection.execute(
+                "DELETE FROM messages WHERE user_id = ? AND user_id IN "
+                "(SELECT user_id FROM sessions WHERE user_id = ? AND expires_at < ?)", (user_id, user_id, now)
+            )
+            self._connection.execute("INSERT INTO messages (user_id, payload) VALUES (?, ?)",
+                                     (user_id, encode_message(message)))
+            self._connection.execute(
+                "INSERT INTO sessions (user_id, expires_at) VALUES (?, ?) "
+                "ON CONFLICT (user_id) DO UPDATE SET expires_at = excluded.expires_at", (user_id, now + ttl_seconds)
+            )
+            self._connection.execute(
+                "DELETE FROM messages WHERE user_id = ? AND seq <= "
+                "(SELECT seq FROM messages WHERE user_id = ? ORDER BY seq DESC LIMIT 1 OFFSET ?)",
+                (user_id, user_id, max_turns)
+            )
+
+    def get(self, user_id: str) -> List[Dict]:
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT payload FROM messages WHERE user_id = ? AND user_id IN "
+                "(SELECT user_id FROM sessions WHERE user_id = ? AND expires_at >= ?) ORDER BY seq",
+                (user_id, user_id, time.time())
+            ).fetchall()
+        return [decode_message(payload) for payload, in rows]
+
+    def sweep(self) -> int:
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.execute(
+                "DELETE FROM messages WHERE user_id IN (SELECT user_id FROM sessions WHERE expires_at < ?)", (now,)
+            )
+            return self._connection.execute("DELETE FROM sessions WHERE expires_at < ?", (now,)).rowcount
+
+    def stats(self) -> Dict:
+        with self._lock:
+            sessions, = self._connection.execute(
+                "SELECT COUNT(*) FROM sessions WHERE expires_at >= ?", (time.time(),)
+            ).fetchone()
+            messages, = self._connection.execute("SELECT COUNT(*) FROM messages").fetchone()
+        return {"sessions": sessions, "messages": messages, "path": self.path}
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+class RedisError(Exception):
+    """Error reply from a Redis server"""
+
+class RedisConnectionLost(ConnectionError):
+    """The connection failed before the server could have run the commands, so they are safe to resend"""
+
+class RedisConnection:
+    """Minimal RESP client for the few list and expiry commands the session store needs.
+
+    pipeline() writes all commands in one send and then reads every reply, so a
+    multi-command update costs a single round trip.
+    """
+
+    def __init__(self, host: str, port: int, password: str = None, db: int = 0, timeout: float = 5.0):
+        self._socket = socket.create_connection((host, port), timeout=timeout)
+        self._reader = self._socket.makefile("rb")
+        if password:
+            self.execute("AUTH", password)
+        if db:
+            self.execute("SELECT", db)
+
+    def execute(self, *args):
+        return self.pipeline(args)[0]
+
+    def pipeline(self, *commands) -> List:
+        try:
+            self._socket.sendall(b"".join(self._encode(command) for command in commands))
+            # A connection the server had already closed fails on the first read, before any reply
+            first = self._reader.readline()
+        except socket.timeout:
+            raise
+        except OSError as e:
+            raise RedisConnectionLost(f"Redis connection lost: {e}") from e
+        if not first:
+            raise RedisConnectionLost("Redis connection closed")
+        replies = [self._read(first)] + [self._read() for _ in commands[1:]]
+        for reply in replies:
+            if isinstance(reply, RedisError):
+                raise reply
+        return replies
+
+    def close(self):
+        try:
+            self._reader.close()
+            self._socket.close()
+        except OSError:
+            pass
+
+    @staticmethod
+    def _encode(command) -> bytes:
+        parts = [str(arg).encode() if not isinstance(arg, bytes) else arg for arg in command]
+        return b"*%d\r\n" % len(parts) + b"".join(b"$%d\r\n%s\r\n" % (len(part), part) for part in parts)
+
+    def _read(self, line: bytes = None):
+        if line is None:
+            line = self._reader.readline()
+        if not line.endswith(b"\r\n"):
+            raise ConnectionError("Redis connection closed")
+        kind, body = line[:1], line[1:-2]
+        if kind == b"+":
+            return body.decode()
+        if kind == b"-":
+            return RedisError(body.decode())
+        if kind == b":":
+            return int(body)
+        if kind == b"$":
+            length = int(body)
+            return None if length < 0 else self._reader.read(length + 2)[:-2]
+        if kind == b"*":
+            length = int(body)
+            return None if length < 0 else [self._read() for _ in range(length)]
+        raise ConnectionError(f"Unexpected Redis reply {line!r}")
+
+class RedisSessionStore(SessionStore):
+    """Sessions in Redis (or anything speaking its protocol), shared by every worker and pod.
+
+    Each session is a list of compact JSON messages. An append is one pipelined
+    RPUSH + LTRIM + PEXPIRE, so trimming and the TTL are enforced by the server.
+    Connections are pooled; a pooled connection the server closed is replaced
+    once. Commands are only resent if they can't have run: a timeout or a
+    failure after a reply started to arrive is raised instead.
+    """
+
+    expires_itself = True
+
+    def __init__(self, url: str = "redis://localhost:6379/0", prefix: str = "session:", max_connections: int = 16,
+                 timeout: float = 5.0):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = unquote(parsed.password) if parsed.password else None
+        self.db = int(parsed.path.strip("/") or 0)
+        self.prefix = prefix
+        self.timeout = timeout
+        self._pool = queue.LifoQueue(maxsize=max_connections)
+
+    def append(self, user_id: str, message: Dict, max_turns: int, ttl_seconds: float):
+        key = self.prefix + user_id
+        self._pipeline(
+            ("RPUSH", key, encode_message(message)),
+            ("LTRIM", key, -max_turns, -1),
+            ("PEXPIRE", key, max(1, int(ttl_seconds * 1000)))
+        )
+
+    def get(self, user_id: str) -> List[Dict]:
+        payloads, = self._pipeline(("LRANGE", self.prefix + user_id, 0, -1))
+        return [decode_message(payload) for payload in payloads or []]
+
+    def stats(self) -> Dict:
+        return {"redis": f"{self.host}:{self.port}/{self.db}", "pooled_connections": self._pool.qsize()}
+
+    def close(self):
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                return
+
+    def _pipeline(self, *commands) -> List:
+        try:
+            connection, pooled = self._pool.get_nowait(), True
+        except queue.Empty:
+            connection, pooled = self._connect(), False
+        try:
+            try:
+                replies = connection.pipeline(*commands)
+            except RedisConnectionLost:
+                if not pooled:
+                    raise
+                # The server closed an idle connection; retry on a fresh one
+                connection.close()
+                connection = self._connect()
+                replies = connection.pipeline(*commands)
+        except Exception:
+            # Unread replies or an error leave the connection unfit for reuse
+            connection.close()
+            raise
+        try:
+            self._pool.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+        return replies
+
+    def _connect(self) -> RedisConnection:
+        return RedisConnection(self.host, self.port, self.password, self.db, self.timeout)
+
+def build_session_store(url: str = None, max_sessions: int = None) -> SessionStore:
+    """Session store configured by SESSION_STORE_URL.
+
+    "memory" (the default) keeps sessions in this process, capped at
+    max_sessions (CONVERSATION_MAX_SESSIONS); "sqlite:///path/to/file.db" and
+    "redis://[:password@]host:port/db" share them between workers.
+    """
+    url = url if url is not None else os.getenv("SESSION_STORE_URL", "memory")
+    if url in ("", "memory", "memory://"):
+        if max_sessions is None:
+            max_sessions = int(os.getenv("CONVERSATION_MAX_SESSIONS", "10000"))
+        return InMemorySessionStore(max_sessions)
+    if url.startswith("sqlite:///"):
+        return SQLiteSessionStore(url[len("sqlite:///"):])
+    if url.startswith("redis://"):
+        return RedisSessionStore(url)
+    raise ValueError(f"Unknown session store '{url}', expected memory, sqlite:///path or redis://host:port/db")
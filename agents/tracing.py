@@ -0,0 +1,220 @@
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _label_text(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _le(bound) -> str:
+    return 'le="%s"' % bound
+
+class Histogram:
+    """Prometheus-style histogram with a fixed label set"""
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series: Dict[Tuple[str, ...], List] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values: str):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_values, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    lines.append(f"{self.name}_bucket{_label_text(self.labels, label_values, _le(bound))} {cumulative}")
+                lines.append(f"{self.name}_bucket{_label_text(self.labels, label_values, _le('+Inf'))} {count}")
+                lines.append(f"{self.name}_sum{_label_text(self.labels, label_values)} {total}")
+                lines.append(f"{self.name}_count{_label_text(self.labels, label_values)} {count}")
+        return lines
+
+class Counter:
+    """Prometheus-style monotonically increasing counter with a fixed label set"""
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, *label_values: str):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_label_text(self.labels, label_values)} {value}")
+        return lines
+
+REQUEST_DURATION = Histogram("agent_request_duration_seconds", "End-to-end orchestrator request latency")
+NODE_DURATION = Histogram("agent_node_duration_seconds", "Orchestrator graph node latency", ["node"])
+MODEL_DURATION = Histogram("agent_model_call_duration_seconds", "Chat model call latency", ["component"])
+MODEL_FIRST_TOKEN = Histogram("agent_model_first_token_seconds", "Time to first streamed token", ["component"])
+RETRIEVAL_DURATION = Histogram("agent_retrieval_duration_seconds", "Knowledge base search latency", ["mode"])
+MODEL_TOKENS = Counter("agent_model_tokens_total", "Tokens used by chat model calls", ["component", "kind"])
+CACHE_EVENTS = Counter("agent_cache_events_total", "Cache lookups by result", ["cache", "result"])
+MODEL_GATEWAY_EVENTS = Counter("agent_model_gateway_events_total",
+                               "Model call retries, circuit breaker short circuits and openings", ["event"])
+METRICS = [REQUEST_DURATION, NODE_DURATION, MODEL_DURATION, MODEL_FIRST_TOKEN, RETRIEVAL_DURATION, MODEL_TOKENS,
+           CACHE_EVENTS, MODEL_GATEWAY_EVENTS]
+
+def render_metrics() -> str:
+    """All metrics in the Prometheus text exposition format"""
+    return "\n".join(line for metric in METRICS for line in metric.render()) + "\n"
+
+class Trace:
+    """Spans, token counts and cache results collected for one request"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans: List[Dict] = []
+        self.tokens = {"prompt": 0, "completion": 0}
+        self.cache: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def add_span(self, span: Dict):
+        with self._lock:
+            self.spans.append(span)
+
+    def summary(self) -> Dict:
+        return {
+            "total_ms": round((time.perf_counter() - self.started) * 1000, 2),
+            "spans": list(self.spans),
+            "tokens": dict(self.tokens),
+            "cache": dict(self.cache)
+        }
+
+# The active request's trace; asyncio tasks inherit it, thread pools need copy_context()
+_current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("agent_trace", default=None)
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+@contextmanager
+def start_trace():
+    """Collect spans from everything called inside the block into a new Trace"""
+    trace = Trace()
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        try:
+            _current_trace.reset(token)
+        except ValueError:
+            # A streaming generator closed from another context (e.g. on disconnect)
+            pass
+        REQUEST_DURATION.observe(time.perf_counter() - trace.started)
+
+@contextmanager
+def span(kind: str, name: str, histogram: Histogram = None, label: str = None, **attributes):
+    """Time a block, observe it in histogram (labelled with label) and add it to the current trace.
+
+    The yielded dict can be filled with attributes (tokens, cache hits) inside the block.
+    """
+    record = {"kind": kind, "name": name, **attributes}
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        duration = time.perf_counter() - start
+        if histogram is not None:
+            histogram.observe(duration, *(() if label is None else (label,)))
+        record["duration_ms"] = round(duration * 1000, 2)
+        trace = current_trace()
+        if trace is not None:
+            trace.add_span(record)
+
+def trace_node(name: str, func):
+    """Wrap a sync graph node so its latency is recorded"""
+    def traced(state):
+        with span("node", name, NODE_DURATION, name):
+            return func(state)
+    return traced
+
+def atrace_node(name: str, func):
+    async def traced(state):
+        with span("node", name, NODE_DURATION, name):
+            return await func(state)
+    return traced
+
+def record_cache(cache: str, hit: bool):
+    CACHE_EVENTS.inc(1.0, cache, "hit" if hit else "miss")
+    trace = current_trace()
+    if trace is not None:
+        trace.cache[cache] = "hit" if hit else "miss"
+
+def _record_usage(component: str, record: Dict, response):
+    """Token counts from the provider's usage metadata, when it reports them"""
+    usage = getattr(response, "usage_metadata", None) or {}
+    prompt_tokens = usage.get("input_tokens")
+    completion_tokens = usage.get("output_tokens")
+    if prompt_tokens is None:
+        token_usage = (getattr(response, "response_metadata", None) or {}).get("token_usage") or {}
+        prompt_tokens = token_usage.get("prompt_tokens")
+        completion_tokens = token_usage.get("completion_tokens")
+    if prompt_tokens is None:
+        return
+    record["prompt_tokens"], record["completion_tokens"] = prompt_tokens, completion_tokens or 0
+    MODEL_TOKENS.inc(prompt_tokens, component, "prompt")
+    MODEL_TOKENS.inc(completion_tokens or 0, component, "completion")
+    trace = current_trace()
+    if trace is not None:
+        with trace._lock:
+            trace.tokens["prompt"] += prompt_tokens
+            trace.tokens["completion"] += completion_tokens or 0
+
+def traced_invoke(component: str, model, messages):
+    """model.invoke(messages), timed and with its token usage recorded"""
+    with span("model", component, MODEL_DURATION, component) as record:
+        response = model.invoke(messages)
+        _record_usage(component, record, response)
+        return response
+
+async def atraced_invoke(component: str, model, messages):
+    with span("model", component, MODEL_DURATION, component) as record:
+        response = await model.ainvoke(messages)
+        _record_usage(component, record, response)
+        return response
+
+async def atraced_stream(component: str, model, messages):
+    """Yield the text of model.astream(messages) as it arrives, timed like atraced_invoke plus time to first token"""
+    with span("model", component, MODEL_DURATION, component, streamed=True) as record:
+        start = time.perf_counter()
+        response = None
+        async for chunk in model.astream(messages):
+            if response is None:
+                first_token = time.perf_counter() - start
+                MODEL_FIRST_TOKEN.observe(first_token, component)
+                record["first_token_ms"] = round(first_token * 1000, 2)
+            response = chunk if response is None else response + chunk
+            if chunk.content:
+                yield chunk.content
+        if response is not None:
+            _record_usage(component, record, response)
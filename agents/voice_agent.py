@@ -2,12 +2,12 @@ import asyncio
 import json
 import websockets
 from typing import Dict, Callable
-from agents.orchestrator import OrchestratorAgent
+from agents.registry import get_orchestrator
 
 class VoiceAgent:
     def __init__(self, api_key: str):
         self.api_key = api_key
-        self.orchestrator = OrchestratorAgent()
+        self.orchestrator = get_orchestrator()
         self.websocket = None
         self.session_config = {
             "modalities": ["text", "audio"],
@@ -1,8 +1,16 @@
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
-from typing import List, Dict, Optional
-from agents.orchestrator import OrchestratorAgent
+from fastapi import FastAPI, Header, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from langchain_core.documents import Document
+from pydantic import BaseModel, ValidationError
+from typing import List, Dict, Optional, Union
+from agents.registry import registry, get_knowledge_base, get_model_gateway, get_orchestrator
+from agents.tracing import render_metrics
 from evaluation.eval_runner import ComprehensiveEvaluator
+import json
+import os
+import re
+import secrets
 import uvicorn
 
 app = FastAPI(
@@ -11,9 +19,12 @@ app = FastAPI(
     version="1.0.0"
 )
 
-# Initialize agents
-orchestrator = OrchestratorAgent()
-evaluator = ComprehensiveEvaluator()
+# Initialize agents (shared with the evaluator through the component registry)
+orchestrator = get_orchestrator()
+
+def get_evaluator() -> ComprehensiveEvaluator:
+    """Build the evaluator on first use; most processes never call /evaluate"""
+    return registry.get_or_create(("evaluator",), ComprehensiveEvaluator)
 
 class CustomerQuery(BaseModel):
     user_id: str
@@ -21,56 +32,197 @@ class CustomerQuery(BaseModel):
     conversation_history: List[Dict] = []
     customer_context: Optional[Dict] = None
 
+class KnowledgeDocument(BaseModel):
+    content: str
+    source: Optional[str] = None
+    metadata: Dict[str, Union[str, int, float, bool]] = {}
+
+class KnowledgeUpload(BaseModel):
+    documents: List[KnowledgeDocument]
+
+# Knowledge base domains are plain directory-style names such as "billing"
+DOMAIN_NAME = re.compile(r"^[a-z0-9_-]{1,64}$")
+
 class AgentResponse(BaseModel):
     response: str
     intent: str
     confidence: float
     requires_escalation: bool
     agent_used: str
+    # Request trace: total_ms, per-node/model/retrieval spans, tokens, cache results
+    metadata: Optional[Dict] = None
+
+# Specialist that answers each intent
+AGENT_MAPPING = {
+    "billing_inquiry": "billing_specialist",
+    "account_management": "account_specialist", 
+    "escalation": "escalation_handler",
+    "complaint": "escalation_handler",
+    "general_info": "account_specialist",
+    "technical_support": "escalation_handler"
+}
+
+def to_agent_response(result: dict) -> AgentResponse:
+    """API response for an orchestrator result"""
+    return AgentResponse(
+        response=result["response"],
+        intent=result["intent"],
+        confidence=result["confidence"],
+        requires_escalation=result["requires_escalation"],
+        agent_used=AGENT_MAPPING.get(result["intent"], "escalation_handler"),
+        metadata=result.get("metadata")
+    )
+
+class BatchChatRequest(BaseModel):
+    queries: List[CustomerQuery]
+
+class BatchChatItem(BaseModel):
+    index: int
+    result: Optional[AgentResponse] = None
+    error: Optional[str] = None
+    # Answered by an identical query in this batch: an earlier one from the same
+    # user, or another new session's first message with the same customer context
+    coalesced: bool = False
+
+class BatchChatResponse(BaseModel):
+    results: List[BatchChatItem]
+    succeeded: int
+    failed: int
+
+# Largest batch /chat/batch accepts
+BATCH_MAX_QUERIES = int(os.getenv("BATCH_MAX_QUERIES", "1000"))
+
+async def stream_events(query: CustomerQuery):
+    """Orchestrator stream events for a query, with the final one shaped like the /chat response"""
+    async for event in orchestrator.astream_query(
+        query.message,
+        user_id=query.user_id,
+        customer_context=query.customer_context or {}
+    ):
+        if event["event"] == "done":
+            event = {"event": "done", **to_agent_response(event).model_dump()}
+        yield event
 
 @app.post("/chat", response_model=AgentResponse)
 async def chat_endpoint(query: CustomerQuery):
     """Main chat endpoint that routes queries through the orchestrator"""
     try:
-        # Process query through orchestrator with user ID for conversation memory
-        result = orchestrator.process_query(
+        # Process query through the async orchestrator path so slow model calls
+        # don't block the event loop for other requests
+        result = await orchestrator.aprocess_query(
             query.message, 
             user_id=query.user_id,
             customer_context=query.customer_context or {}
         )
-        
-        # Determine which agent was used based on intent
-        agent_mapping = {
-            "billing_inquiry": "billing_specialist",
-            "account_management": "account_specialist", 
-            "escalation": "escalation_handler",
-            "complaint": "escalation_handler",
-            "general_info": "account_specialist",
-            "technical_support": "escalation_handler"
-        }
-        
-        agent_used = agent_mapping.get(result["intent"], "escalation_handler")
-        
-        return AgentResponse(
-            response=result["response"],
-            intent=result["intent"],
-            confidence=result["confidence"],
-            requires_escalation=result["requires_escalation"],
-            agent_used=agent_used
-        )
+        return to_agent_response(result)
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing query: {str(e)}")
 
+@app.post("/chat/batch", response_model=BatchChatResponse)
+async def chat_batch_endpoint(batch: BatchChatRequest):
+    """Answer many queries at once (concurrently, bounded by BATCH_CONCURRENCY); results are in request order"""
+    if len(batch.queries) > BATCH_MAX_QUERIES:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_QUERIES} queries per batch")
+    
+    outcomes = await orchestrator.aprocess_batch([
+        {"message": query.message, "user_id": query.user_id, "customer_context": query.customer_context or {}}
+        for query in batch.queries
+    ])
+    results = [
+        BatchChatItem(index=index, error=outcome["error"]) if "error" in outcome else
+        BatchChatItem(index=index, result=to_agent_response(outcome["result"]), coalesced=outcome.get("coalesced", False))
+        for index, outcome in enumerate(outcomes)
+    ]
+    failed = sum(1 for item in results if item.error is not None)
+    return BatchChatResponse(results=results, succeeded=len(results) - failed, failed=failed)
+
+@app.post("/chat/stream")
+async def chat_stream_endpoint(query: CustomerQuery):
+    """Server-sent events: intent, then token events as the answer is generated, then done with the /chat response"""
+    async def sse():
+        try:
+            async for event in stream_events(query):
+                yield f"event: {event.pop('event')}\ndata: {json.dumps(event)}\n\n"
+        except Exception as e:
+            yield f"event: error\ndata: {json.dumps({'detail': f'Error processing query: {str(e)}'})}\n\n"
+    
+    # Ask proxies not to buffer the stream
+    return StreamingResponse(sse(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.websocket("/chat/ws")
+async def chat_websocket(websocket: WebSocket):
+    """WebSocket variant of /chat/stream: send CustomerQuery JSON messages, receive the same events as JSON"""
+    await websocket.accept()
+    try:
+        while True:
+            try:
+                query = CustomerQuery(**await websocket.receive_json())
+            except (ValidationError, TypeError, ValueError) as e:
+                await websocket.send_json({"event": "error", "detail": f"Invalid query: {str(e)}"})
+                continue
+            try:
+                async for event in stream_events(query):
+                    await websocket.send_json(event)
+            except WebSocketDisconnect:
+                raise
+            except Exception as e:
+                await websocket.send_json({"event": "error", "detail": f"Error processing query: {str(e)}"})
+    except WebSocketDisconnect:
+        pass
+
 @app.post("/evaluate")
 async def evaluate_system():
     """Run comprehensive evaluation metrics on the system"""
     try:
-        results = evaluator.run_full_evaluation()
+        results = get_evaluator().run_full_evaluation()
         return results
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error running evaluation: {str(e)}")
 
+@app.post("/knowledge-base/{domain}/documents")
+async def add_knowledge_documents(domain: str, upload: KnowledgeUpload, x_api_key: Optional[str] = Header(None)):
+    """Add documents to a knowledge base domain, new or existing (requires the KB_ADMIN_API_KEY as X-API-Key)"""
+    admin_key = os.getenv("KB_ADMIN_API_KEY")
+    if not admin_key:
+        raise HTTPException(status_code=503, detail="Knowledge base updates are disabled (KB_ADMIN_API_KEY not set)")
+    if not x_api_key or not secrets.compare_digest(x_api_key, admin_key):
+        raise HTTPException(status_code=401, detail="Invalid API key")
+    if not DOMAIN_NAME.match(domain):
+        raise HTTPException(status_code=400, detail=f"Invalid knowledge base domain '{domain}'")
+    
+    documents = [
+        Document(page_content=doc.content, metadata={**doc.metadata, "source": doc.source or "api"})
+        for doc in upload.documents
+    ]
+    try:
+        # Splitting and embedding run off the event loop; searches continue on the old index meanwhile
+        result = await run_in_threadpool(get_knowledge_base().add_documents, documents, domain)
+        return {"domain": domain, **result}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error adding documents: {str(e)}")
+
+@app.get("/stats")
+async def cache_stats():
+    """Cache hit/miss counters for the shared agents and conversation memory usage"""
+    return {
+        "intent_cache": orchestrator.intent_classifier.cache_stats(),
+        # SQLite and Redis session stores count their sessions with a blocking query
+        "conversation_memory": await run_in_threadpool(orchestrator.memory.stats),
+        "model_gateway": get_model_gateway().stats(),
+        "response_cache": {
+            agent.domain: agent.response_cache.stats()
+            for agent in (orchestrator.billing_agent, orchestrator.account_agent)
+            if getattr(agent, "response_cache", None) is not None
+        }
+    }
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Latency histograms, token counters and cache events in the Prometheus text format"""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
@@ -84,8 +236,13 @@ async def root():
         "description": "Intent-driven AI system inspired by T-Mobile's IntentCX",
         "endpoints": {
             "chat": "/chat - Main customer service endpoint",
+            "chat_batch": "/chat/batch - Many queries in one request, answered concurrently",
+            "chat_stream": "/chat/stream - Streaming chat (server-sent events); WebSocket at /chat/ws",
             "evaluate": "/evaluate - Run system evaluation",
             "health": "/health - Health check",
+            "stats": "/stats - Cache statistics",
+            "metrics": "/metrics - Prometheus metrics",
+            "knowledge_base": "/knowledge-base/{domain}/documents - Add documents (admin API key)",
             "docs": "/docs - API documentation"
         }
     }
@@ -94,7 +251,7 @@ async def root():
 async def get_conversation_history(user_id: str):
     """Get conversation history for a user"""
     try:
-        history = orchestrator.memory.get_conversation(user_id)
+        history = await orchestrator.memory.aget_conversation(user_id)
         return {"user_id": user_id, "conversation_history": history}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error retrieving conversation: {str(e)}")
@@ -0,0 +1,528 @@
+"""
+Performance benchmarks for the multi-agent system.
+
+All benchmarks run against StubChatModel, so they need no API key and
+measure our own overhead plus a simulated, fixed model latency.
+
+Usage:
+    python -m evaluation.benchmarks load --latency 0.2 --concurrency 1 10 100 200
+    python -m evaluation.benchmarks classifier --folds 5 --margin 0.5
+    python -m evaluation.benchmarks keywords --queries 100000
+    python -m evaluation.benchmarks retrieval --k 3
+    python -m evaluation.benchmarks startup --files 2000
+    python -m evaluation.benchmarks prefetch --latency 0.3 --retrieval-latency 0.15
+    python -m evaluation.benchmarks batch --messages 500 --concurrency 8 32 128
+    python -m evaluation.benchmarks intents --queries 1000 --batch-size 20
+    python -m evaluation.benchmarks gateway --latency 0.2 --error-rate 0.3
+    python -m evaluation.benchmarks responses --queries 200 --distinct 20
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import statistics
+import time
+from typing import Dict, List
+from agents.account_specialist import AccountSpecialist
+from agents.billing_specialist import BillingSpecialist
+from agents.cache import QueryCache, TTLCache
+from agents.escalation_handler import EscalationHandler
+from agents.fast_intent import FastIntentModel, load_examples
+from agents.intent_classifier import IntentClassifier, classify_by_keywords
+from agents.keyword_matcher import KeywordMatcher
+from agents.model_gateway import ModelGateway
+from agents.orchestrator import OrchestratorAgent
+from agents.response_cache import ResponseCache
+from agents.tracing import start_trace
+from evaluation.stub_llm import StubChatModel, StubEmbeddings, StubOpenAIServer
+from rag.retriever import RETRIEVAL_MODES, KnowledgeBaseRetriever
+
+SAMPLE_QUERIES = [
+    "My bill is higher than usual this month",
+    "I forgot my password and can't log in",
+    "How do I upgrade my plan?",
+    "I want to speak to a manager",
+    "Why was I charged a late fee?",
+]
+
+def build_stub_orchestrator(latency: float) -> OrchestratorAgent:
+    """Orchestrator whose classifier and specialists all call a local stub model"""
+    stub = StubChatModel(latency=latency)
+    return OrchestratorAgent(
+        intent_classifier=IntentClassifier(model=stub),
+        billing_agent=BillingSpecialist(model=stub),
+        account_agent=AccountSpecialist(model=stub),
+        escalation_agent=EscalationHandler(model=stub),
+    )
+
+def _summarize(latencies: List[float], wall: float) -> Dict[str, float]:
+    ordered = sorted(latencies)
+    return {
+        "requests": len(ordered),
+        "wall_s": wall,
+        "throughput_rps": len(ordered) / wall if wall else 0.0,
+        "p50_ms": statistics.median(ordered) * 1000,
+        "p95_ms": ordered[int(0.95 * (len(ordered) - 1))] * 1000,
+    }
+
+def run_sync_baseline(orchestrator: OrchestratorAgent, requests: int) -> Dict[str, float]:
+    """Serve requests one after another through the blocking process_query path"""
+    latencies = []
+    start = time.perf_counter()
+    for i in range(requests):
+        t0 = time.perf_counter()
+        orchestrator.process_query(SAMPLE_QUERIES[i % len(SAMPLE_QUERIES)], user_id=f"sync_{i}")
+        latencies.append(time.perf_counter() - t0)
+    return _summarize(latencies, time.perf_counter() - start)
+
+async def run_async_load(orchestrator: OrchestratorAgent, concurrency: int) -> Dict[str, float]:
+    """Fire `concurrency` simultaneous requests through aprocess_query"""
+    async def one(i: int) -> float:
+        t0 = time.perf_counter()
+        await orchestrator.aprocess_query(SAMPLE_QUERIES[i % len(SAMPLE_QUERIES)], user_id=f"async_{i}")
+        return time.perf_counter() - t0
+
+    start = time.perf_counter()
+    latencies = await asyncio.gather(*(one(i) for i in range(concurrency)))
+    return _summarize(list(latencies), time.perf_counter() - start)
+
+def bench_load(args) -> None:
+    orchestrator = build_stub_orchestrator(args.latency)
+    print(f"Stub model latency: {args.latency * 1000:.0f}ms per call (2 calls per query)\n")
+    print(f"{'mode':<12}{'conc':>6}{'reqs':>6}{'wall s':>9}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}")
+
+    baseline = run_sync_baseline(orchestrator, args.sync_requests)
+    _print_row("sync", 1, baseline)
+
+    for concurrency in args.concurrency:
+        result = asyncio.run(run_async_load(orchestrator, concurrency))
+        _print_row("async", concurrency, result)
+
+def _print_row(mode: str, concurrency: int, result: Dict[str, float]) -> None:
+    print(f"{mode:<12}{concurrency:>6}{result['requests']:>6}{result['wall_s']:>9.2f}"
+          f"{result['throughput_rps']:>9.1f}{result['p50_ms']:>9.0f}{result['p95_ms']:>9.0f}")
+
+def bench_classifier(args) -> None:
+    """K-fold comparison of the tiered (local model first) classifier against LLM-only"""
+    examples = load_examples(args.data, args.traffic)
+    if args.live:
+        from agents.registry import get_chat_model
+        model = get_chat_model("gpt-4-turbo", temperature=0.1)
+    else:
+        model = StubChatModel(latency=args.latency)
+    # Caches are cleared before every query so both paths pay for each classification
+    llm_only = IntentClassifier(model=model, cache=QueryCache(), fast_model=None, traffic_log=None)
+
+    totals = {"llm": [0, 0.0], "tiered": [0, 0.0]}
+    fast_answered = fast_correct = 0
+    folds = max(2, min(args.folds, len(examples)))
+
+    for fold in range(folds):
+        train = [example for i, example in enumerate(examples) if i % folds != fold]
+        held_out = [example for i, example in enumerate(examples) if i % folds == fold]
+        fast_model = FastIntentModel.train(train)
+        tiered = IntentClassifier(model=model, cache=QueryCache(), fast_model=fast_model,
+                                  fast_path_margin=args.margin, traffic_log=None)
+
+        for query, expected in held_out:
+            for name, classifier in (("llm", llm_only), ("tiered", tiered)):
+                classifier.cache.clear()
+                t0 = time.perf_counter()
+                result = classifier.classify(query)
+                totals[name][1] += time.perf_counter() - t0
+                totals[name][0] += result["intent"] == expected
+
+            fast_result = tiered._fast_classify(query)
+            if fast_result is not None:
+                fast_answered += 1
+                fast_correct += fast_result["intent"] == expected
+
+    count = len(examples)
+    print(f"{count} labeled queries, {folds}-fold cross-validation, margin {args.margin}, "
+          f"{'live LLM' if args.live else f'stub LLM at {args.latency * 1000:.0f}ms'}\n")
+    print(f"{'path':<10}{'accuracy':>10}{'mean ms':>10}")
+    for name in ("llm", "tiered"):
+        correct, seconds = totals[name]
+        print(f"{name:<10}{correct / count:>10.1%}{seconds / count * 1000:>10.1f}")
+    print(f"\nFast path answered {fast_answered / count:.1%} of queries locally "
+          f"with {fast_correct / max(fast_answered, 1):.1%} accuracy")
+
+def _legacy_keyword_classify(query: str) -> dict:
+    """The substring-scan cascade the fallback classifier used before the compiled matcher"""
+    query_lower = query.lower().strip()
+    if query_lower in ['hello', 'hi', 'hey', 'good morning', 'good afternoon', 'good evening']:
+        return {"intent": "general_info", "confidence": 0.9}
+    elif any(word in query_lower for word in ['bill', 'charge', 'payment', 'cost', 'fee', 'invoice']):
+        return {"intent": "billing_inquiry", "confidence": 0.8}
+    elif any(word in query_lower for word in ['password', 'account', 'login', 'upgrade', 'plan', 'change']):
+        return {"intent": "account_management", "confidence": 0.8}
+    elif any(word in query_lower for word in ['network', 'signal', 'speed', 'connection', 'outage', 'technical']):
+        return {"intent": "technical_support", "confidence": 0.8}
+    elif any(word in query_lower for word in ['complaint', 'angry', 'frustrated', 'terrible', 'awful']):
+        return {"intent": "complaint", "confidence": 0.8}
+    elif any(word in query_lower for word in ['manager', 'supervisor', 'human', 'agent', 'cancel']):
+        return {"intent": "escalation", "confidence": 0.9}
+    return {"intent": "general_info", "confidence": 0.6}
+
+def bench_keywords(args) -> None:
+    """Throughput and golden-set accuracy of the keyword fallback, legacy vs compiled"""
+    examples = load_examples(args.data)
+    base = [query for query, _ in examples] + SAMPLE_QUERIES
+    queries = [f"{base[i % len(base)]} (ref {i})" for i in range(args.queries)]
+
+    print(f"{'matcher':<10}{'queries/s':>12}{'us/query':>10}{'accuracy':>10}")
+    for name, classify in (("legacy", _legacy_keyword_classify), ("compiled", classify_by_keywords)):
+        start = time.perf_counter()
+        for query in queries:
+            classify(query)
+        elapsed = time.perf_counter() - start
+        correct = sum(classify(query)["intent"] == expected for query, expected in examples)
+        print(f"{name:<10}{len(queries) / elapsed:>12,.0f}{elapsed / len(queries) * 1e6:>10.1f}"
+              f"{correct / len(examples):>10.1%}")
+
+    # Scaling with table size: the substring scan is linear in keyword count,
+    # the compiled matcher is roughly flat
+    sample = queries[:max(1, args.queries // 10)]
+    print(f"\n{'keywords':<10}{'scan us/q':>12}{'compiled us/q':>15}")
+    for size in (50, 500, 5000):
+        vocabulary = [f"kw{i}word" for i in range(size)]
+        matcher = KeywordMatcher({"label": {keyword: 1.0 for keyword in vocabulary}})
+        timings = []
+        for scan in (lambda q: [k for k in vocabulary if k in q.lower()], matcher.matches):
+            start = time.perf_counter()
+            for query in sample:
+                scan(query)
+            timings.append((time.perf_counter() - start) / len(sample) * 1e6)
+        print(f"{size:<10}{timings[0]:>12.1f}{timings[1]:>15.1f}")
+
+def bench_retrieval(args) -> None:
+    """Hit rate, MRR and latency of vector, lexical and hybrid retrieval on a labeled query set"""
+    with open(args.cases, "r") as f:
+        cases = json.load(f)
+
+    if args.live:
+        from agents.registry import get_embeddings
+        # Bypass the embedding cache so every mode pays for its own query embeddings
+        embeddings = get_embeddings().embeddings
+    else:
+        embeddings = StubEmbeddings(latency=args.latency)
+    # Build throwaway vector stores so benchmark embeddings never touch data/chroma
+    os.environ["CHROMA_PERSIST_DIRECTORY"] = tempfile.mkdtemp(prefix="bench_chroma_")
+    retriever = KnowledgeBaseRetriever(args.docs_path, embeddings=embeddings)
+
+    print(f"{len(cases)} labeled queries, k={args.k}, "
+          f"{'OpenAI embeddings' if args.live else f'stub embeddings at {args.latency * 1000:.0f}ms'}\n")
+    print(f"{'mode':<10}{'hit@k':>8}{'MRR':>8}{'mean ms':>10}")
+    for mode in RETRIEVAL_MODES:
+        hits, reciprocal_ranks, seconds = 0, 0.0, 0.0
+        for case in cases:
+            start = time.perf_counter()
+            results = retriever.retrieve(case["query"], k=args.k, mode=mode, domain=case["domain"])
+            seconds += time.perf_counter() - start
+            relevant = case["relevant"].lower()
+            for rank, doc in enumerate(results, start=1):
+                if relevant in doc.page_content.lower():
+                    hits += 1
+                    reciprocal_ranks += 1 / rank
+                    break
+        print(f"{mode:<10}{hits / len(cases):>8.1%}{reciprocal_ranks / len(cases):>8.3f}"
+              f"{seconds / len(cases) * 1000:>10.2f}")
+
+def bench_startup(args) -> None:
+    """Retriever construction time on a synthetic KB: cold build vs warm start vs first keyword query"""
+    root = tempfile.mkdtemp(prefix="bench_kb_")
+    os.environ["CHROMA_PERSIST_DIRECTORY"] = os.path.join(root, "chroma")
+    docs_path = os.path.join(root, "kb")
+    os.makedirs(docs_path)
+    rng = random.Random(0)
+    vocabulary = " ".join(SAMPLE_QUERIES).lower().replace("?", "").split()
+    for i in range(args.files):
+        paragraphs = [" ".join(rng.choices(vocabulary, k=60)) for _ in range(args.paragraphs)]
+        with open(os.path.join(docs_path, f"article_{i}.md"), "w") as f:
+            f.write(f"# Article {i}\n\n" + "\n\n".join(paragraphs))
+
+    def timed(label, build):
+        start = time.perf_counter()
+        result = build()
+        print(f"{label:<44}{(time.perf_counter() - start) * 1000:>10.1f} ms")
+        return result
+
+    print(f"{args.files} files x {args.paragraphs} paragraphs, stub embeddings\n")
+    embeddings = StubEmbeddings()
+    def build_index():
+        retriever = KnowledgeBaseRetriever(docs_path, embeddings=embeddings)
+        retriever.lexical_index
+        return retriever
+    cold = timed("cold start (split, embed, build BM25)", build_index)
+    warm = timed("warm start (stat files, check manifest)",
+                 lambda: KnowledgeBaseRetriever(docs_path, embeddings=embeddings))
+    timed("first keyword query (chunk cache + BM25 load)", lambda: warm.retrieve("late fee", mode="lexical"))
+    os.remove(f"{cold.persist_directory}.chunks.json")
+    timed("read + split every file (old per-startup cost)", lambda: len(cold._load_documents()))
+
+def bench_prefetch(args) -> None:
+    """End-to-end latency with and without speculative retrieval during classification"""
+    os.environ["CHROMA_PERSIST_DIRECTORY"] = tempfile.mkdtemp(prefix="bench_chroma_")
+    retriever = KnowledgeBaseRetriever(args.docs_path, embeddings=StubEmbeddings())
+    # Index with instant embeddings, then make each query embedding cost a round trip
+    retriever.embeddings.latency = args.retrieval_latency
+    stub = StubChatModel(latency=args.latency)
+
+    print(f"Stub model {args.latency * 1000:.0f}ms per call, query embedding "
+          f"{args.retrieval_latency * 1000:.0f}ms, {args.queries} sequential queries\n")
+    print(f"{'mode':<14}{'mean ms':>9}{'p50 ms':>9}{'p95 ms':>9}{'searches':>10}")
+    for speculative in (False, True):
+        orchestrator = OrchestratorAgent(
+            # A zero-size cache so every repeated sample query is classified again
+            intent_classifier=IntentClassifier(model=stub, cache=QueryCache(exact=TTLCache(max_size=0))),
+            billing_agent=BillingSpecialist(model=stub, retriever=retriever),
+            account_agent=AccountSpecialist(model=stub, retriever=retriever),
+            escalation_agent=EscalationHandler(model=stub),
+            speculative_retrieval=speculative,
+        )
+        calls_before = retriever.embeddings.calls
+        latencies = []
+        for i in range(args.queries):
+            start = time.perf_counter()
+            asyncio.run(orchestrator.aprocess_query(SAMPLE_QUERIES[i % len(SAMPLE_QUERIES)], user_id=f"prefetch_{i}"))
+            latencies.append(time.perf_counter() - start)
+        result = _summarize(latencies, sum(latencies))
+        print(f"{'speculative' if speculative else 'sequential':<14}{statistics.mean(latencies) * 1000:>9.0f}"
+              f"{result['p50_ms']:>9.0f}{result['p95_ms']:>9.0f}{retriever.embeddings.calls - calls_before:>10}")
+
+def bench_batch(args) -> None:
+    """Bulk throughput: one-at-a-time aprocess_query calls vs aprocess_batch fan-out"""
+    orchestrator = build_stub_orchestrator(args.latency)
+    messages = [{"message": SAMPLE_QUERIES[i % len(SAMPLE_QUERIES)], "user_id": f"bulk_{i}"}
+                for i in range(args.messages)]
+    # A share of the batch repeats an earlier message from the same user (e.g. resubmitted by a retrying client)
+    for i in range(0, args.messages, max(1, int(1 / args.duplicates)) if args.duplicates else args.messages + 1):
+        if i:
+            messages[i] = dict(messages[i - 1])
+
+    print(f"Stub model latency: {args.latency * 1000:.0f}ms per call (2 calls per query), "
+          f"{args.messages} messages\n")
+    print(f"{'mode':<12}{'conc':>6}{'msgs':>6}{'wall s':>9}{'msgs/s':>9}{'errors':>8}")
+
+    async def sequential():
+        for message in messages[:args.sequential]:
+            await orchestrator.aprocess_query(message["message"], user_id=message["user_id"])
+
+    start = time.perf_counter()
+    asyncio.run(sequential())
+    wall = time.perf_counter() - start
+    print(f"{'sequential':<12}{1:>6}{args.sequential:>6}{wall:>9.2f}{args.sequential / wall:>9.1f}{0:>8}")
+
+    for concurrency in args.concurrency:
+        start = time.perf_counter()
+        outcomes = asyncio.run(orchestrator.aprocess_batch(messages, concurrency=concurrency))
+        wall = time.perf_counter() - start
+        errors = sum(1 for outcome in outcomes if "error" in outcome)
+        print(f"{'batch':<12}{concurrency:>6}{len(messages):>6}{wall:>9.2f}{len(messages) / wall:>9.1f}{errors:>8}")
+
+def bench_intents(args) -> None:
+    """Bulk intent classification: one prompt per query vs batched prompts"""
+    with open(args.data) as f:
+        cases = json.load(f)
+    # Numbered so every query is distinct and nothing is answered from the cache
+    queries = [f"{cases[i % len(cases)]['query']} (ticket {i})" for i in range(args.queries)]
+
+    def classifier():
+        return IntentClassifier(model=StubChatModel(latency=args.latency), cache=QueryCache(),
+                                fast_path_margin=1.01, batch_size=args.batch_size,
+                                batch_concurrency=args.concurrency)
+
+    def serial():
+        return [one.classify(query) for query in queries]
+
+    async def concurrent():
+        semaphore = asyncio.Semaphore(args.concurrency)
+        async def classify(query):
+            async with semaphore:
+                return await one.aclassify(query)
+        return await asyncio.gather(*(classify(query) for query in queries))
+
+    print(f"Stub model latency: {args.latency * 1000:.0f}ms per call, {args.queries} queries, "
+          f"batch size {args.batch_size}, concurrency {args.concurrency}\n")
+    print(f"{'mode':<22}{'calls':>7}{'wall s':>9}{'queries/s':>11}{'prompt tok/q':>14}")
+    modes = [
+        ("classify (serial)", lambda: serial()),
+        ("aclassify (conc)", lambda: asyncio.run(concurrent())),
+        ("classify_batch", lambda: one.classify_batch(queries)),
+        ("aclassify_batch", lambda: asyncio.run(one.aclassify_batch(queries))),
+    ]
+    for name, run in modes:
+        one = classifier()
+        with start_trace() as trace:
+            start = time.perf_counter()
+            run()
+            wall = time.perf_counter() - start
+        calls = sum(1 for span in trace.spans if span["kind"] == "model")
+        print(f"{name:<22}{calls:>7}{wall:>9.2f}{len(queries) / wall:>11.1f}"
+              f"{trace.tokens['prompt'] / len(queries):>14.1f}")
+
+class EmptyKnowledgeBase:
+    """Retriever stand-in with no documents, so only model calls are measured"""
+
+    def retrieve(self, query, k=3, domain=None):
+        return []
+
+    async def aretrieve(self, query, k=3, domain=None):
+        return []
+
+def bench_responses(args) -> None:
+    """FAQ-style specialist traffic with and without the response cache"""
+    rng = random.Random(0)
+    faqs = [f"{SAMPLE_QUERIES[i % len(SAMPLE_QUERIES)]} (topic {i})" for i in range(args.distinct)]
+    # Zipf-like popularity: a few questions make up most of the traffic
+    weights = [1 / (rank + 1) for rank in range(len(faqs))]
+    queries = rng.choices(faqs, weights=weights, k=args.queries)
+
+    print(f"Stub model latency: {args.latency * 1000:.0f}ms, {args.queries} first-turn queries "
+          f"over {args.distinct} distinct questions\n")
+    print(f"{'cache':<10}{'model calls':>12}{'wall s':>9}{'mean ms':>9}{'hit rate':>10}")
+    for name, cache in (("off", None), ("memory", ResponseCache())):
+        stub = StubChatModel(latency=args.latency)
+        specialist = BillingSpecialist(model=stub, retriever=EmptyKnowledgeBase(), response_cache=cache)
+        latencies = []
+
+        async def one(query):
+            start = time.perf_counter()
+            await specialist.ahandle_query(query, {"account_id": "FAQ"})
+            latencies.append(time.perf_counter() - start)
+
+        async def run():
+            semaphore = asyncio.Semaphore(args.concurrency)
+            async def bounded(query):
+                async with semaphore:
+                    await one(query)
+            await asyncio.gather(*(bounded(query) for query in queries))
+
+        with start_trace() as trace:
+            start = time.perf_counter()
+            asyncio.run(run())
+            wall = time.perf_counter() - start
+        calls = sum(1 for span in trace.spans if span["kind"] == "model")
+        hit_rate = cache.stats()["memory"]["hit_rate"] if cache else 0.0
+        print(f"{name:<10}{calls:>12}{wall:>9.2f}{statistics.mean(latencies) * 1000:>9.1f}{hit_rate:>10.1%}")
+
+def bench_gateway(args) -> None:
+    """Specialist answers through the model gateway against a flaky and then a dead local stub provider"""
+    from langchain_openai import ChatOpenAI
+
+    def run(error_rate: float, gateway: ModelGateway):
+        server = StubOpenAIServer(latency=args.latency, error_rate=error_rate, error_status=args.status).start()
+        try:
+            model = gateway.wrap(ChatOpenAI(model="gpt-4-turbo", api_key="stub", base_url=server.base_url, max_retries=0,
+                                            http_client=gateway.http_client()))
+            specialist = BillingSpecialist(model=model, retriever=EmptyKnowledgeBase())
+            latencies, answered = [], 0
+            for query in (SAMPLE_QUERIES * args.queries)[:args.queries]:
+                start = time.perf_counter()
+                answered += "Thanks for reaching out" in specialist.handle_query(query, {})
+                latencies.append(time.perf_counter() - start)
+            return answered, latencies, server.requests
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    # Without the gateway's policies: one attempt per call and a breaker that never opens
+    plain = dict(max_retries=0, failure_threshold=10 ** 9)
+    scenarios = [
+        (f"{args.error_rate:.0%} {args.status}s", args.error_rate, "single attempt", plain),
+        (f"{args.error_rate:.0%} {args.status}s", args.error_rate, "retries", dict(backoff_seconds=0.05)),
+        ("outage", 1.0, "single attempt", plain),
+        ("outage", 1.0, "retries", dict(backoff_seconds=0.05, failure_threshold=10 ** 9)),
+        ("outage", 1.0, "retries+breaker", dict(backoff_seconds=0.05)),
+    ]
+    print(f"Stub provider latency: {args.latency * 1000:.0f}ms per request, {args.queries} specialist queries\n")
+    print(f"{'provider':<12}{'gateway':<18}{'model answers':>14}{'mean ms':>9}{'p95 ms':>9}{'requests':>10}")
+    for provider, error_rate, name, options in scenarios:
+        answered, latencies, requests = run(error_rate, ModelGateway(**options))
+        ordered = sorted(latencies)
+        print(f"{provider:<12}{name:<18}{answered / len(latencies):>14.0%}"
+              f"{statistics.mean(latencies) * 1000:>9.0f}{ordered[int(0.95 * (len(ordered) - 1))] * 1000:>9.0f}"
+              f"{requests:>10}")
+
+def main(argv: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(description="Multi-agent system benchmarks")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    load = subparsers.add_parser("load", help="Concurrent /chat load against a stub LLM")
+    load.add_argument("--latency", type=float, default=0.2, help="Simulated model latency in seconds")
+    load.add_argument("--sync-requests", type=int, default=10, help="Requests for the sequential baseline")
+    load.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 100, 200])
+    load.set_defaults(func=bench_load)
+
+    classifier = subparsers.add_parser("classifier", help="Local fast-path model vs LLM-only classification")
+    classifier.add_argument("--data", nargs="*", default=["evaluation/test_cases.json"])
+    classifier.add_argument("--traffic", nargs="*", default=[], help="Logged classification JSONL files")
+    classifier.add_argument("--folds", type=int, default=5)
+    classifier.add_argument("--margin", type=float, default=0.5, help="Fast-path confidence margin")
+    classifier.add_argument("--latency", type=float, default=0.5, help="Stub LLM latency in seconds")
+    classifier.add_argument("--live", action="store_true", help="Use the real OpenAI model instead of the stub")
+    classifier.set_defaults(func=bench_classifier)
+
+    keywords = subparsers.add_parser("keywords", help="Keyword fallback classifier microbenchmark")
+    keywords.add_argument("--data", nargs="*", default=["evaluation/test_cases.json"])
+    keywords.add_argument("--queries", type=int, default=100000)
+    keywords.set_defaults(func=bench_keywords)
+
+    retrieval = subparsers.add_parser("retrieval", help="Vector vs lexical vs hybrid retrieval quality and latency")
+    retrieval.add_argument("--cases", default="evaluation/retrieval_cases.json")
+    retrieval.add_argument("--docs-path", default="data/sample_data", help="Knowledge base root; cases name a domain in it")
+    retrieval.add_argument("--k", type=int, default=3)
+    retrieval.add_argument("--latency", type=float, default=0.05, help="Stub embedding latency in seconds")
+    retrieval.add_argument("--live", action="store_true", help="Use OpenAI embeddings instead of the stub")
+    retrieval.set_defaults(func=bench_retrieval)
+
+    startup = subparsers.add_parser("startup", help="Retriever startup time with a persisted index")
+    startup.add_argument("--files", type=int, default=2000)
+    startup.add_argument("--paragraphs", type=int, default=8)
+    startup.set_defaults(func=bench_startup)
+
+    prefetch = subparsers.add_parser("prefetch", help="Speculative retrieval during classification vs sequential")
+    prefetch.add_argument("--docs-path", default="data/sample_data")
+    prefetch.add_argument("--latency", type=float, default=0.3, help="Stub model latency in seconds")
+    prefetch.add_argument("--retrieval-latency", type=float, default=0.15, help="Stub query embedding latency")
+    prefetch.add_argument("--queries", type=int, default=20)
+    prefetch.set_defaults(func=bench_prefetch)
+
+    batch = subparsers.add_parser("batch", help="Bulk /chat/batch throughput vs sequential calls")
+    batch.add_argument("--latency", type=float, default=0.1, help="Stub model latency in seconds")
+    batch.add_argument("--messages", type=int, default=500)
+    batch.add_argument("--sequential", type=int, default=20, help="Messages for the one-at-a-time baseline")
+    batch.add_argument("--duplicates", type=float, default=0.1, help="Share of messages repeating the previous one")
+    batch.add_argument("--concurrency", type=int, nargs="+", default=[8, 32, 128])
+    batch.set_defaults(func=bench_batch)
+
+    intents = subparsers.add_parser("intents", help="Batched vs one-prompt-per-query intent classification")
+    intents.add_argument("--data", default="evaluation/test_cases.json")
+    intents.add_argument("--latency", type=float, default=0.05, help="Stub model latency in seconds")
+    intents.add_argument("--queries", type=int, default=1000)
+    intents.add_argument("--batch-size", type=int, default=20)
+    intents.add_argument("--concurrency", type=int, default=4)
+    intents.set_defaults(func=bench_intents)
+
+    gateway = subparsers.add_parser("gateway", help="Model gateway retries and circuit breaker vs a flaky stub provider")
+    gateway.add_argument("--latency", type=float, default=0.2, help="Stub provider latency in seconds")
+    gateway.add_argument("--error-rate", type=float, default=0.3, help="Share of requests the flaky provider fails")
+    gateway.add_argument("--status", type=int, default=429, help="HTTP status of the failures")
+    gateway.add_argument("--queries", type=int, default=50)
+    gateway.set_defaults(func=bench_gateway)
+
+    responses = subparsers.add_parser("responses", help="Specialist response cache on FAQ-style traffic")
+    responses.add_argument("--latency", type=float, default=0.3, help="Stub model latency in seconds")
+    responses.add_argument("--queries", type=int, default=200)
+    responses.add_argument("--distinct", type=int, default=20, help="Distinct questions in the traffic")
+    responses.add_argument("--concurrency", type=int, default=1)
+    responses.set_defaults(func=bench_responses)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
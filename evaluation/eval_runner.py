@@ -1,14 +1,15 @@
 from evaluation.metrics import EvaluationMetrics
 from evaluation.llm_judge import LLMJudge
-from agents.orchestrator import OrchestratorAgent
+from agents.registry import get_orchestrator
 import json
+import uuid
 from datetime import datetime
 
 class ComprehensiveEvaluator:
     def __init__(self):
         self.metrics_evaluator = EvaluationMetrics()
         self.llm_judge = LLMJudge()
-        self.orchestrator = OrchestratorAgent()
+        self.orchestrator = get_orchestrator()
     
     def run_full_evaluation(self) -> dict:
         """Run complete evaluation suite with all metrics"""
@@ -58,13 +59,15 @@ class ComprehensiveEvaluator:
     def _evaluate_response_quality(self) -> dict:
         """Evaluate response quality using LLM judge"""
         test_cases = []
+        # Sessions are unique to this run, apart from earlier runs and live users
+        run_id = uuid.uuid4().hex
         
         # Generate responses for test cases
-        for test_case in self.metrics_evaluator.test_cases:
+        for index, test_case in enumerate(self.metrics_evaluator.test_cases):
             try:
                 result = self.orchestrator.process_query(
                     test_case["query"],
-                    user_id=f"eval_{hash(test_case['query'])}",
+                    user_id=f"eval_{run_id}_{index}",
                     customer_context={"account_id": "EVAL123"}
                 )
                 
@@ -107,8 +110,9 @@ class ComprehensiveEvaluator:
             "conversation_details": []
         }
         
+        run_id = uuid.uuid4().hex
         for i, scenario in enumerate(conversation_scenarios):
-            user_id = f"conv_test_{i}"
+            user_id = f"conv_test_{run_id}_{i}"
             conversation_quality = []
             
             for turn_idx, query in enumerate(scenario["turns"]):
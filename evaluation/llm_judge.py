@@ -1,11 +1,11 @@
-from langchain_openai import ChatOpenAI
 from langchain.prompts import ChatPromptTemplate
+from agents.registry import get_chat_model
 import json
 from typing import Dict, List
 
 class LLMJudge:
-    def __init__(self):
-        self.model = ChatOpenAI(model="gpt-4-turbo", temperature=0.1)
+    def __init__(self, model=None):
+        self.model = model or get_chat_model("gpt-4-turbo", temperature=0.1)
         self.evaluation_prompt = ChatPromptTemplate.from_template("""
 You are an expert evaluator for customer service AI responses.
 
@@ -1,12 +1,15 @@
 from typing import List, Dict
 import json
+import uuid
 from agents.intent_classifier import IntentClassifier
-from agents.orchestrator import OrchestratorAgent
+from agents.registry import get_orchestrator
 
 class EvaluationMetrics:
     def __init__(self):
-        self.intent_classifier = IntentClassifier()
-        self.orchestrator = OrchestratorAgent()
+        # Scored with its own classifier: the shared one answers from its cache
+        # and from a fast-path model trained on these same test cases
+        self.intent_classifier = IntentClassifier(cache=None, fast_model=None, traffic_log=None)
+        self.orchestrator = get_orchestrator()
         self.test_cases = self._load_test_cases()
     
     def evaluate_intent_accuracy(self) -> Dict[str, float]:
@@ -15,11 +18,11 @@ class EvaluationMetrics:
         total = len(self.test_cases)
         intent_breakdown = {}
         
-        for test_case in self.test_cases:
-            query = test_case["query"]
+        # All test queries are classified together, in batched prompts
+        results = self.intent_classifier.classify_batch([test_case["query"] for test_case in self.test_cases])
+        
+        for test_case, result in zip(self.test_cases, results):
             expected_intent = test_case["expected_intent"]
-            
-            result = self.intent_classifier.classify(query)
             predicted_intent = result["intent"]
             
             # Track per-intent accuracy
@@ -51,11 +54,10 @@ class EvaluationMetrics:
         low_conf_correct = 0
         low_conf_total = 0
         
-        for test_case in self.test_cases:
-            query = test_case["query"]
+        results = self.intent_classifier.classify_batch([test_case["query"] for test_case in self.test_cases])
+        
+        for test_case, result in zip(self.test_cases, results):
             expected_intent = test_case["expected_intent"]
-            
-            result = self.intent_classifier.classify(query)
             predicted_intent = result["intent"]
             confidence = result["confidence"]
             
@@ -82,8 +84,10 @@ class EvaluationMetrics:
         successful_routes = 0
         appropriate_escalations = 0
         total_cases = len(self.test_cases)
+        # Each case runs in a fresh session of its own, apart from live users' memory
+        run_id = uuid.uuid4().hex
         
-        for test_case in self.test_cases:
+        for index, test_case in enumerate(self.test_cases):
             query = test_case["query"]
             expected_intent = test_case["expected_intent"]
             should_escalate = test_case.get("should_escalate", False)
@@ -91,6 +95,7 @@ class EvaluationMetrics:
             try:
                 result = self.orchestrator.process_query(
                     query, 
+                    user_id=f"eval_{run_id}_{index}",
                     customer_context={"account_id": "TEST123"}
                 )
                 
@@ -0,0 +1,227 @@
+import asyncio
+import json
+import math
+import random
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, AsyncIterator, Callable, List, Optional
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+class StubChatModel(BaseChatModel):
+    """Local stand-in for ChatOpenAI with a fixed, simulated network latency.
+
+    Used by the benchmarks and tests so the agents can exercise their real
+    model-calling code paths without an API key. Streamed responses arrive
+    word by word: latency before the first word, token_latency between words.
+    """
+    latency: float = 0.05
+    token_latency: float = 0.0
+    responder: Optional[Callable[[str], str]] = None
+
+    @property
+    def _llm_type(self) -> str:
+        return "stub"
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        time.sleep(self.latency)
+        return self._result(messages)
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(self.latency)
+        return self._result(messages)
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Any = None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        await asyncio.sleep(self.latency)
+        prompt, content = self._respond(messages)
+        words = content.split(" ")
+        for index, word in enumerate(words):
+            if index:
+                await asyncio.sleep(self.token_latency)
+            text = word if index == len(words) - 1 else word + " "
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=text))
+            if run_manager:
+                await run_manager.on_llm_new_token(text, chunk=chunk)
+            yield chunk
+        yield ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata=_usage(prompt, content)))
+
+    def _result(self, messages: List[BaseMessage]) -> ChatResult:
+        prompt, content = self._respond(messages)
+        message = AIMessage(content=content, usage_metadata=_usage(prompt, content))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _respond(self, messages: List[BaseMessage]):
+        prompt = "\n".join(str(message.content) for message in messages)
+        responder = self.responder or default_responder
+        return prompt, responder(prompt)
+
+def _usage(prompt: str, content: str) -> dict:
+    # Whitespace-delimited words stand in for tokens in the usage report
+    input_tokens, output_tokens = len(prompt.split()), len(content.split())
+    return {"input_tokens": input_tokens, "output_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens}
+
+def default_responder(prompt: str) -> str:
+    """Answer classification prompts with keyword-rule JSON, everything else with canned text"""
+    query = _extract_query(prompt)
+
+    if "Customer Queries:" in prompt:
+        from agents.intent_classifier import classify_by_keywords
+        return json.dumps([{"id": number, **classify_by_keywords(query)}
+                           for number, query in enumerate(_extract_queries(prompt), 1)])
+
+    if "intent classifier" in prompt:
+        from agents.intent_classifier import classify_by_keywords
+        return json.dumps(classify_by_keywords(query))
+
+    return f"Thanks for reaching out about: {query}. Here is how we can help."
+
+def _extract_query(prompt: str) -> str:
+    for line in prompt.splitlines():
+        if line.startswith("Customer Query:"):
+            return line[len("Customer Query:"):].strip()
+    return prompt.strip()
+
+def _extract_queries(prompt: str) -> List[str]:
+    """The JSON-quoted queries of a numbered batch prompt ("1. \"...\"")"""
+    queries = []
+    for line in prompt.split("Customer Queries:", 1)[1].strip().splitlines():
+        number, _, quoted = line.partition(". ")
+        if not number.isdigit():
+            break
+        queries.append(json.loads(quoted))
+    return queries
+
+class StubEmbeddings(Embeddings):
+    """Deterministic local embeddings (hashed character trigrams) with simulated latency.
+
+    Not semantically strong, but stable across runs, so vector and hybrid
+    retrieval can be exercised and benchmarked without an API key.
+    """
+
+    def __init__(self, dimensions: int = 256, latency: float = 0.0):
+        self.dimensions = dimensions
+        self.latency = latency
+        self.calls = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls += 1
+        time.sleep(self.latency)
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        self.calls += 1
+        time.sleep(self.latency)
+        return self._embed(text)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        return [self._embed(text) for text in texts]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        return self._embed(text)
+
+    def _embed(self, text: str) -> List[float]:
+        vector = [0.0] * self.dimensions
+        padded = f" {' '.join(text.lower().split())} "
+        for start in range(len(padded) - 2):
+            vector[zlib.crc32(padded[start:start + 3].encode("utf-8")) % self.dimensions] += 1.0
+        norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+        return [value / norm for value in vector]
+
+class StubOpenAIServer(ThreadingHTTPServer):
+    """Local HTTP server speaking enough of the OpenAI chat completions API for ChatOpenAI.
+
+    Lets the model gateway's retries, timeouts and circuit breaker be
+    exercised over real HTTP. Each request waits latency seconds, then gets
+    the next status from script (once the script is used up, error_rate of
+    requests fail with error_status); 200 answers come from responder, as
+    JSON or as a server-sent event stream when the client asks to stream.
+    Point ChatOpenAI at base_url with any API key.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, latency: float = 0.0, script: List[int] = None, error_rate: float = 0.0,
+                 error_status: int = 500, responder: Callable[[str], str] = None, seed: int = 0):
+        super().__init__(("127.0.0.1", 0), StubOpenAIHandler)
+        self.latency = latency
+        self.script = list(script or [])
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.responder = responder or default_responder
+        self.requests = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+    def start(self) -> "StubOpenAIServer":
+        threading.Thread(target=self.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True).start()
+        return self
+
+    def next_status(self) -> int:
+        with self._lock:
+            self.requests += 1
+            if self.script:
+                return self.script.pop(0)
+            return self.error_status if self._random.random() < self.error_rate else 200
+
+class StubOpenAIHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        server = self.server
+        time.sleep(server.latency)
+        status = server.next_status()
+        if status != 200:
+            return self._send_json(status, {"error": {"message": f"stub error {status}", "type": "server_error"}})
+
+        prompt = "\n".join(str(message.get("content", "")) for message in body.get("messages", []))
+        content = server.responder(prompt)
+        usage = _usage(prompt, content)
+        usage = {"prompt_tokens": usage["input_tokens"], "completion_tokens": usage["output_tokens"],
+                 "total_tokens": usage["total_tokens"]}
+        base = {"id": "chatcmpl-stub", "created": int(time.time()), "model": body.get("model", "stub")}
+        if not body.get("stream"):
+            return self._send_json(200, {**base, "object": "chat.completion", "usage": usage, "choices": [
+                {"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}]})
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        words = content.split(" ")
+        for index, word in enumerate(words):
+            text = word if index == len(words) - 1 else word + " "
+            self._send_event({**base, "object": "chat.completion.chunk", "choices": [
+                {"index": 0, "delta": {"role": "assistant", "content": text}, "finish_reason": None}]})
+        self._send_event({**base, "object": "chat.completion.chunk", "choices": [
+            {"index": 0, "delta": {}, "finish_reason": "stop"}]})
+        if body.get("stream_options", {}).get("include_usage"):
+            self._send_event({**base, "object": "chat.completion.chunk", "choices": [], "usage": usage})
+        self.wfile.write(b"data: [DONE]\n\n")
+
+    def _send_json(self, status: int, payload: dict):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_event(self, payload: dict):
+        self.wfile.write(f"data: {json.dumps(payload)}\n\n".encode("utf-8"))
+
+    def log_message(self, format, *args):
+        pass
@@ -0,0 +1,192 @@
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from agents.cache import TTLCache
+
+class SQLiteVectorStore:
+    """On-disk key -> float32 vector table (SQLite in WAL mode)."""
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB)")
+        self._lock = threading.Lock()
+
+    def get_many(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        if not keys:
+            return {}
+        placeholders = ",".join("?" * len(keys))
+        with self._lock:
+            rows = self._connection.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", keys
+            ).fetchall()
+        return {key: np.frombuffer(blob, dtype=np.float32) for key, blob in rows}
+
+    def put_many(self, items: Dict[str, np.ndarray]):
+        rows = [(key, np.asarray(vector, dtype=np.float32).tobytes()) for key, vector in items.items()]
+        with self._lock:
+            self._connection.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?)", rows)
+            self._connection.commit()
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper with a content-hash keyed cache and miss batching.
+
+    Lookups go to an in-memory LRU, then to an optional SQLite store. Misses
+    from concurrent callers that arrive within `batch_window` seconds are
+    coalesced into one embed_documents request, and a text already being
+    embedded is never requested twice. Queries and documents share one
+    keyspace, which assumes a symmetric embedding model (true for OpenAI).
+
+    Vectors are held as float32 arrays and only turned into lists on the way
+    out. The memory tier only keeps query vectors; document batches (ingestion)
+    are looked up in it but written only to the disk tier, so a bulk ingest
+    neither fills memory with vectors read once nor evicts the hot queries.
+    """
+
+    def __init__(self, embeddings: Embeddings, cache_path: Optional[str] = None, max_size: int = 10000,
+                 batch_window: float = 0.005, max_batch_size: int = 256):
+        self.embeddings = embeddings
+        self.model_name = getattr(embeddings, "model", type(embeddings).__name__)
+        self.memory = TTLCache(max_size=max_size, ttl_seconds=float("inf"))
+        self.disk = SQLiteVectorStore(cache_path) if cache_path else None
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        self._pending_lock = threading.Lock()
+        self._in_flight: Dict[str, Future] = {}
+        self._queue: List[str] = []
+        self._batch_scheduled = False
+        self.disk_hits = 0
+        self.requests = 0
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed([text], remember=True)[0].tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [vector.tolist() for vector in self._embed(texts, remember=False)]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        key = self._key(text)
+        vector = self.memory.get(key)
+        if vector is None:
+            # Memory was just checked; the worker thread goes on to the disk tier and the model
+            vectors = await asyncio.get_running_loop().run_in_executor(None, self._embed_uncached, [key], [text], True)
+            vector = vectors[0]
+        return vector.tolist()
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await asyncio.get_running_loop().run_in_executor(None, self.embed_documents, texts)
+
+    def _embed(self, texts: List[str], remember: bool) -> List[np.ndarray]:
+        """Vectors for texts from the cache tiers or the model; remember keeps them in memory"""
+        keys = [self._key(text) for text in texts]
+        vectors: Dict[str, np.ndarray] = {}
+        # Each distinct text is looked up once, so repeats don't skew the hit rate
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key in vectors or key in missing:
+                continue
+            vector = self.memory.get(key)
+            if vector is None:
+                missing[key] = text
+            else:
+                vectors[key] = vector
+
+        if missing:
+            vectors.update(zip(missing, self._embed_uncached(list(missing), list(missing.values()), remember)))
+        return [vectors[key] for key in keys]
+
+    def _embed_uncached(self, keys: List[str], texts: List[str], remember: bool) -> List[np.ndarray]:
+        """Vectors for distinct keys not in memory, from the disk tier or the model"""
+        vectors: Dict[str, np.ndarray] = {}
+        if self.disk is not None:
+            try:
+                vectors = self.disk.get_many(keys)
+            except sqlite3.Error as e:
+                # Treat an unreadable cache as a miss rather than failing the request
+                print(f"Error reading embedding cache: {e}")
+            self.disk_hits += len(vectors)
+
+        unresolved = {key: text for key, text in zip(keys, texts) if key not in vectors}
+        if unresolved:
+            vectors.update(zip(unresolved, self._embed_missing(list(unresolved), list(unresolved.values()))))
+
+        if remember:
+            for key in keys:
+                self.memory.set(key, vectors[key])
+        return [vectors[key] for key in keys]
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def _embed_missing(self, keys: List[str], texts: List[str]) -> List[np.ndarray]:
+        """Join (or lead) the current batch and wait for these keys' vectors"""
+        futures = []
+        leader = False
+        with self._pending_lock:
+            for key, text in zip(keys, texts):
+                future = self._in_flight.get(key)
+                if future is None:
+                    future = Future()
+                    future.text = text
+                    self._in_flight[key] = future
+                    self._queue.append(key)
+                futures.append(future)
+            if self._queue and not self._batch_scheduled:
+                self._batch_scheduled = True
+                leader = True
+
+        if leader:
+            # Give concurrent callers a moment to add their misses to this batch
+            time.sleep(self.batch_window)
+            self._flush()
+        return [future.result() for future in futures]
+
+    def _flush(self):
+        with self._pending_lock:
+            batch, self._queue = self._queue, []
+            self._batch_scheduled = False
+            futures = [self._in_flight[key] for key in batch]
+
+        for start in range(0, len(batch), self.max_batch_size):
+            keys = batch[start:start + self.max_batch_size]
+            chunk = futures[start:start + self.max_batch_size]
+            try:
+                self.requests += 1
+                vectors = self.embeddings.embed_documents([future.text for future in chunk])
+            except Exception as e:
+                self._resolve(keys, chunk, error=e)
+                continue
+
+            vectors = [np.asarray(vector, dtype=np.float32) for vector in vectors]
+            if self.disk is not None:
+                try:
+                    self.disk.put_many(dict(zip(keys, vectors)))
+                except sqlite3.Error as e:
+                    print(f"Error writing embedding cache: {e}")
+            self._resolve(keys, chunk, vectors=vectors)
+
+    def _resolve(self, keys: List[str], futures: List[Future], vectors=None, error: Exception = None):
+        with self._pending_lock:
+            for key in keys:
+                self._in_flight.pop(key, None)
+        for index, future in enumerate(futures):
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(vectors[index])
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "memory": self.memory.stats(),
+            "disk_hits": self.disk_hits,
+            "embedding_requests": self.requests
+        }
@@ -0,0 +1,142 @@
+import argparse
+import hashlib
+import json
+import os
+import time
+from typing import Dict, Iterable, List, Set
+
+DEFAULT_DOCS_PATHS = ["data/sample_data"]
+
+# Domain of files placed directly in the knowledge base root
+DEFAULT_DOMAIN = "general"
+
+def domain_for(source_path: str) -> str:
+    """A file's domain is its top-level directory under the knowledge base root"""
+    parts = source_path.split(os.sep)
+    return parts[0] if len(parts) > 1 else DEFAULT_DOMAIN
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def chunk_ids(source: str, texts: Iterable[str]) -> List[str]:
+    """Stable vector store ids for a file's chunks, derived from their content.
+
+    Unchanged chunks keep their id when other parts of the file are edited,
+    so only new or modified chunks need to be embedded.
+    """
+    ids, seen = [], {}
+    for text in texts:
+        chunk_id = content_hash(f"{source}\0{text}")
+        occurrence = seen.get(chunk_id, 0)
+        seen[chunk_id] = occurrence + 1
+        ids.append(chunk_id if occurrence == 0 else f"{chunk_id}-{occurrence}")
+    return ids
+
+class IndexManifest:
+    """What a vector store was built from: per-file content hashes and chunk ids.
+
+    files maps each path (relative to the docs directory) to
+    {"hash": sha256 of the file text, "size", "mtime_ns", "chunks": [chunk ids]};
+    size and mtime let unchanged files skip re-hashing on the next startup.
+    """
+
+    def __init__(self, files: Dict[str, Dict] = None):
+        self.files = files or {}
+
+    @classmethod
+    def from_chunks(cls, file_states: Dict[str, Dict], chunks: List) -> "IndexManifest":
+        files = {source: {**state, "chunks": []} for source, state in file_states.items()}
+        for chunk in chunks:
+            # Chunks added through the live-update API belong to no file
+            if chunk.metadata.get("source_path") in files:
+                files[chunk.metadata["source_path"]]["chunks"].append(chunk.metadata["chunk_id"])
+        return cls(files)
+
+    def diff(self, current: "IndexManifest") -> Dict[str, List[str]]:
+        """Files added, changed and deleted in current relative to this manifest"""
+        return {
+            "added": sorted(set(current.files) - set(self.files)),
+            "changed": sorted(source for source, entry in current.files.items()
+                              if source in self.files and self.files[source]["hash"] != entry["hash"]),
+            "deleted": sorted(set(self.files) - set(current.files))
+        }
+
+    def chunk_ids(self, sources: Iterable[str] = None) -> Set[str]:
+        sources = self.files if sources is None else sources
+        return {chunk_id for source in sources if source in self.files
+                for chunk_id in self.files[source]["chunks"]}
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"files": self.files}, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "IndexManifest":
+        """Load a manifest, or None if there is none (or it cannot be read)"""
+        try:
+            with open(path, "r") as f:
+                return cls(json.load(f)["files"])
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Error loading index manifest {path}: {e}")
+            return None
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description="Knowledge base index maintenance")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    reindex = subparsers.add_parser("reindex", help="Re-embed only the files that changed since the last run")
+    reindex.add_argument("docs_paths", nargs="*", default=DEFAULT_DOCS_PATHS)
+
+    ingest = subparsers.add_parser("ingest", help="Stream a (large) corpus through the parallel ingestion pipeline")
+    ingest.add_argument("docs_paths", nargs="*", default=DEFAULT_DOCS_PATHS)
+    ingest.add_argument("--workers", type=int, default=None, help="Splitting processes (default INGEST_WORKERS or CPU count)")
+    ingest.add_argument("--batch-size", type=int, default=256, help="Chunks per embeddings request")
+    ingest.add_argument("--max-in-flight", type=int, default=4, help="Concurrent embedding batches")
+    ingest.add_argument("--retries", type=int, default=3)
+    ingest.add_argument("--rebuild", action="store_true",
+                        help="Ignore the manifest and chunk cache and re-split every file (stored chunks are kept)")
+
+    args = parser.parse_args(argv)
+
+    from rag.ingest import IngestionPipeline
+    from rag.retriever import KnowledgeBaseRetriever
+    pipeline = None
+    if args.command == "ingest":
+        def progress(stats):
+            print(f"  {stats.summary()}", flush=True)
+        pipeline = IngestionPipeline(workers=args.workers, batch_size=args.batch_size, max_in_flight=args.max_in_flight,
+                                     retries=args.retries, min_parallel_files=1, progress=progress)
+
+    for docs_path in args.docs_paths:
+        start = time.perf_counter()
+        if args.command == "ingest" and args.rebuild:
+            persist_directory = KnowledgeBaseRetriever.persist_directory_for(docs_path)
+            for suffix in (".manifest.json", ".chunks.json"):
+                if os.path.exists(persist_directory + suffix):
+                    os.remove(persist_directory + suffix)
+        retriever = KnowledgeBaseRetriever(docs_path, pipeline=pipeline)
+        # Also refresh the chunk cache and BM25 index so workers start without splitting
+        retriever.lexical_index
+        report = retriever.index_report
+        if report is None:
+            print(f"{docs_path}: embeddings unavailable, only the chunk cache and keyword index were refreshed "
+                  f"({time.perf_counter() - start:.2f}s)")
+            continue
+        print(f"{docs_path}: {len(report['added'])} added, {len(report['changed'])} changed, "
+              f"{len(report['deleted'])} deleted files; {report['chunks_added']} chunks embedded, "
+              f"{report['chunks_deleted']} removed in {report['seconds']:.2f}s "
+              f"(startup total {time.perf_counter() - start:.2f}s)")
+        if pipeline is not None:
+            print(f"  {pipeline.stats.summary()}")
+            continue
+        for status in ("added", "changed", "deleted"):
+            for source in report[status]:
+                print(f"  {status:<8}{source}")
+
+if __name__ == "__main__":
+    main()
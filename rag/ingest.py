@@ -0,0 +1,161 @@
+import os
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from rag.indexing import chunk_ids, content_hash
+
+def iter_markdown_files(docs_path: str) -> Iterator[Tuple[str, str]]:
+    """Yield (path relative to docs_path, full path) for every markdown file, in sorted order.
+
+    Hidden files and directories are skipped, as DirectoryLoader did.
+    """
+    for root, dirs, files in os.walk(docs_path):
+        dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+        for name in sorted(files):
+            if name.endswith(".md") and not name.startswith("."):
+                path = os.path.join(root, name)
+                yield os.path.relpath(path, docs_path), path
+
+def make_text_splitter() -> RecursiveCharacterTextSplitter:
+    return RecursiveCharacterTextSplitter(
+        chunk_size=500,
+        chunk_overlap=50,
+        separators=["\n\n", "\n", " ", ""]
+    )
+
+_splitter = None
+
+def split_markdown(source_path: str, path: str) -> Optional[Dict]:
+    """Read and split one file into {"hash", "chunks": [[chunk_id, text], ...]} (None if unreadable).
+
+    Module-level so it can run in worker processes.
+    """
+    global _splitter
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            text = f.read()
+    except (OSError, UnicodeDecodeError) as e:
+        print(f"Error loading {path}: {e}")
+        return None
+    _splitter = _splitter or make_text_splitter()
+    texts = _splitter.split_text(text)
+    return {"hash": content_hash(text), "chunks": [[chunk_id, chunk] for chunk_id, chunk in zip(chunk_ids(source_path, texts), texts)]}
+
+class IngestStats:
+    """Running counters for one ingestion pass"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.files_split = 0
+        self.chunks_embedded = 0
+        self.batches = 0
+        self.retries = 0
+
+    @property
+    def seconds(self) -> float:
+        return time.perf_counter() - self.started
+
+    def summary(self) -> str:
+        rate = self.chunks_embedded / self.seconds if self.seconds else 0.0
+        return (f"{self.files_split} files split, {self.chunks_embedded} chunks embedded in "
+                f"{self.batches} batches ({self.retries} retries), {self.seconds:.1f}s, {rate:.0f} chunks/s")
+
+class IngestionPipeline:
+    """Streaming split -> embed -> upsert with bounded memory.
+
+    Files are split in a process pool (only when at least min_parallel_files
+    need splitting; below that the pool costs more than it saves). At most
+    workers * 4 files are in flight, so a large corpus is never held in
+    memory unsplit. Chunks are upserted in batches of batch_size on a thread
+    pool with at most max_in_flight batches outstanding; when the limit is
+    reached the producer blocks, which also pauses splitting. Failed batches
+    are retried with exponential backoff before the error is raised.
+    """
+
+    def __init__(self, workers: int = None, batch_size: int = 256, max_in_flight: int = 4,
+                 retries: int = 3, backoff: float = 1.0, min_parallel_files: int = 64,
+                 progress: Callable[[IngestStats], None] = None):
+        self.workers = workers or int(os.getenv("INGEST_WORKERS", os.cpu_count() or 1))
+        self.batch_size = batch_size
+        self.max_in_flight = max_in_flight
+        self.retries = retries
+        self.backoff = backoff
+        self.min_parallel_files = min_parallel_files
+        self.progress = progress
+        self.stats = IngestStats()
+
+    def begin(self) -> IngestStats:
+        """Reset the counters at the start of a pass"""
+        self.stats = IngestStats()
+        return self.stats
+
+    def split(self, jobs: List[Tuple[str, str, Optional[Dict]]]) -> Iterator[Tuple[str, Optional[Dict]]]:
+        """Yield (source_path, entry) per (source_path, path, cached_entry) job, in job order.
+
+        Jobs with a cached entry pass straight through; the rest are split.
+        """
+        pending = sum(1 for _, _, cached in jobs if cached is None)
+        if self.workers <= 1 or pending < self.min_parallel_files:
+            for source_path, path, cached in jobs:
+                yield source_path, self._count(cached or split_markdown(source_path, path), cached)
+            return
+
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            window = deque()
+            for source_path, path, cached in jobs:
+                window.append((source_path, cached, None if cached else pool.submit(split_markdown, source_path, path)))
+                while len(window) > self.workers * 4:
+                    yield self._resolve(window.popleft())
+            while window:
+                yield self._resolve(window.popleft())
+
+    def _resolve(self, item) -> Tuple[str, Optional[Dict]]:
+        source_path, cached, future = item
+        return source_path, self._count(cached or future.result(), cached)
+
+    def _count(self, entry, cached):
+        if cached is None and entry is not None:
+            self.stats.files_split += 1
+        return entry
+
+    def upsert(self, vectorstore, documents: Iterable) -> IngestStats:
+        """Embed and upsert documents (keyed by their chunk_id metadata) in bounded batches"""
+        in_flight: deque = deque()
+        with ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix="ingest") as pool:
+            for batch in self._batches(documents):
+                if len(in_flight) >= self.max_in_flight:
+                    self._finish(in_flight.popleft())
+                in_flight.append(pool.submit(self._upsert_batch, vectorstore, batch))
+            while in_flight:
+                self._finish(in_flight.popleft())
+        return self.stats
+
+    def _batches(self, documents: Iterable) -> Iterator[List]:
+        batch = []
+        for document in documents:
+            batch.append(document)
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def _upsert_batch(self, vectorstore, batch: List) -> int:
+        for attempt in range(self.retries + 1):
+            try:
+                vectorstore.add_documents(batch, ids=[doc.metadata["chunk_id"] for doc in batch])
+                return len(batch)
+            except Exception as e:
+                if attempt == self.retries:
+                    raise
+                self.stats.retries += 1
+                print(f"Embedding batch failed ({e}), retrying")
+                time.sleep(self.backoff * 2 ** attempt)
+
+    def _finish(self, future: Future):
+        self.stats.chunks_embedded += future.result()
+        self.stats.batches += 1
+        if self.progress:
+            self.progress(self.stats)
@@ -0,0 +1,120 @@
+import hashlib
+import heapq
+import json
+import math
+import os
+import re
+from collections import Counter
+from typing import Container, Dict, Iterable, List, Optional, Tuple
+
+STOPWORDS = frozenset("""
+a about above after again against all am an and any are as at be because been before being
+below between both but by can could did do does doing down during each few for from further
+had has have having he her here hers herself him himself his how i if in into is it its itself
+just me more most my myself no nor not now of off on once only or other our ours ourselves out
+over own same she should so some such than that the their theirs them themselves then there
+these they this those through to too under until up very was we were what when where which
+while who whom why will with would you your yours yourself yourselves
+""".split())
+
+_TOKEN = re.compile(r"[a-z0-9]+(?:\.[0-9]+)?")
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased word tokens with stopwords removed"""
+    return [token for token in _TOKEN.findall(text.lower()) if token not in STOPWORDS]
+
+def corpus_fingerprint(texts: Iterable[str]) -> str:
+    """Content hash used to tell whether a persisted index matches the corpus"""
+    digest = hashlib.sha256()
+    for text in texts:
+        digest.update(text.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+class BM25Index:
+    """Inverted index over a list of texts with Okapi BM25 scoring.
+
+    Documents are referred to by their position in the list the index was
+    built from; search returns (position, score) pairs, best first.
+    """
+
+    def __init__(self, postings: Dict[str, List[Tuple[int, int]]], doc_lengths: List[int],
+                 k1: float = 1.5, b: float = 0.75, fingerprint: str = ""):
+        self.postings = postings
+        self.doc_lengths = doc_lengths
+        self.k1 = k1
+        self.b = b
+        self.fingerprint = fingerprint
+        avg_doc_length = sum(doc_lengths) / len(doc_lengths) if doc_lengths else 0.0
+        # Per-document denominator term k1 * (1 - b + b * |d| / avgdl), computed once
+        self._length_norms = [
+            k1 * (1 - b + b * length / avg_doc_length) if avg_doc_length else k1
+            for length in doc_lengths
+        ]
+
+    @classmethod
+    def build(cls, texts: List[str], k1: float = 1.5, b: float = 0.75) -> "BM25Index":
+        postings: Dict[str, List[Tuple[int, int]]] = {}
+        doc_lengths = []
+        for doc_id, text in enumerate(texts):
+            tokens = tokenize(text)
+            doc_lengths.append(len(tokens))
+            for term, frequency in Counter(tokens).items():
+                postings.setdefault(term, []).append((doc_id, frequency))
+        return cls(postings, doc_lengths, k1, b, corpus_fingerprint(texts))
+
+    def extended(self, texts: List[str], all_texts: List[str]) -> "BM25Index":
+        """New index with texts appended as the next document ids; this index is left untouched.
+
+        all_texts is the full corpus after the append, used for the fingerprint.
+        """
+        postings = dict(self.postings)
+        doc_lengths = list(self.doc_lengths)
+        for doc_id, text in enumerate(texts, start=len(doc_lengths)):
+            tokens = tokenize(text)
+            doc_lengths.append(len(tokens))
+            for term, frequency in Counter(tokens).items():
+                # Copy a term's postings before the first append so readers of this index never see it change
+                if postings.get(term) is self.postings.get(term):
+                    postings[term] = list(postings.get(term, ()))
+                postings[term].append((doc_id, frequency))
+        return BM25Index(postings, doc_lengths, self.k1, self.b, corpus_fingerprint(all_texts))
+
+    def search(self, query: str, k: int = 3, doc_filter: Optional[Container[int]] = None) -> List[Tuple[int, float]]:
+        """Top-k (doc id, score) pairs, optionally restricted to the ids in doc_filter"""
+        total = len(self.doc_lengths)
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+            boost = idf * (self.k1 + 1)
+            for doc_id, frequency in postings:
+                scores[doc_id] = scores.get(doc_id, 0.0) + boost * frequency / (
+                    frequency + self._length_norms[doc_id]
+                )
+        items = scores.items()
+        if doc_filter is not None:
+            items = [(doc_id, score) for doc_id, score in items if doc_id in doc_filter]
+        return heapq.nlargest(k, items, key=lambda item: item[1])
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({
+                "fingerprint": self.fingerprint,
+                "k1": self.k1,
+                "b": self.b,
+                "doc_lengths": self.doc_lengths,
+                "postings": self.postings
+            }, f, separators=(",", ":"))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        with open(path, "r") as f:
+            data = json.load(f)
+        postings = {term: [tuple(posting) for posting in entries] for term, entries in data["postings"].items()}
+        return cls(postings, data["doc_lengths"], data["k1"], data["b"], data["fingerprint"])
@@ -1,105 +1,471 @@
 from langchain_community.vectorstores import Chroma
-from langchain_community.document_loaders import DirectoryLoader, TextLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_core.documents import Document
+from agents.tracing import RETRIEVAL_DURATION, span
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Sequence
+from rag.indexing import DEFAULT_DOMAIN, IndexManifest, content_hash, domain_for
+from rag.ingest import IngestionPipeline, iter_markdown_files, make_text_splitter
+from rag.lexical_index import BM25Index, corpus_fingerprint
+import asyncio
+import heapq
+import json
 import os
+import threading
+import time
+
+RETRIEVAL_MODES = ("vector", "lexical", "hybrid")
+
+# Chroma deletes per call, kept well under its max batch size
+DELETE_BATCH_SIZE = 500
+
+# Runs the vector half of sync hybrid searches alongside the in-thread lexical half
+_search_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="hybrid-search")
+
+def reciprocal_rank_fusion(rankings: Sequence[List], k: int = 3, weights: Sequence[float] = None,
+                           rrf_k: int = 60) -> List:
+    """Fuse ranked document lists: score(d) = sum_i weight_i / (rrf_k + rank_i(d))"""
+    weights = weights or [1.0] * len(rankings)
+    scores, documents = {}, {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, doc in enumerate(ranking, start=1):
+            key = (doc.metadata.get("source"), doc.page_content)
+            documents.setdefault(key, doc)
+            scores[key] = scores.get(key, 0.0) + weight / (rrf_k + rank)
+    return [documents[key] for key in heapq.nlargest(k, scores, key=scores.get)]
 
 class KnowledgeBaseRetriever:
-    def __init__(self, docs_path: str):
+    """Hybrid search over one knowledge base directory, held in one vector collection.
+    
+    Every chunk carries a "domain" metadata field (its file's top-level
+    directory, e.g. billing/ or account/), and searches can be restricted to
+    a domain, so all specialists share one index and adding a domain only
+    takes a new directory.
+    """
+    
+    def __init__(self, docs_path: str, embeddings=None, mode: str = None,
+                 fusion_weights: Sequence[float] = (1.0, 1.0), pipeline: IngestionPipeline = None):
         self.docs_path = docs_path
+        self.persist_directory = self.persist_directory_for(docs_path)
+        # Default search mode; callers can override per call with retrieve(..., mode=)
+        self.mode = mode or os.getenv("RETRIEVAL_MODE", "hybrid")
+        # (vector, lexical) weights for reciprocal-rank fusion in hybrid mode
+        self.fusion_weights = fusion_weights
+        # Splits changed files and embeds new chunks during the vector store sync
+        self.pipeline = pipeline or IngestionPipeline()
         try:
-            from langchain_openai import OpenAIEmbeddings
-            self.embeddings = OpenAIEmbeddings()
+            from agents.registry import get_embeddings
+            self.embeddings = embeddings or get_embeddings()
             self.use_embeddings = True
         except Exception:
             self.embeddings = None
             self.use_embeddings = False
         
-        self.documents = self._load_documents()
+        # Chunks and the BM25 index are loaded on first use (see the documents
+        # and lexical_index properties); startup only stats and hashes files
+        self._documents = None
+        self._lexical_index = None
+        self._load_lock = threading.Lock()
+        # Serializes add_documents calls; searches never take it
+        self._update_lock = threading.Lock()
+        self._known_texts = None
+        self._domain_ids = None
+        self._text_splitter = make_text_splitter()
+        self.manifest = IndexManifest.load(f"{self.persist_directory}.manifest.json")
+        self.file_states = self._scan_files()
+        # Files and chunks changed by the last vector store sync (None without embeddings)
+        self.index_report = None
         if self.use_embeddings:
             self.vectorstore = self._initialize_vectorstore()
         else:
             self.vectorstore = None
     
+    @staticmethod
+    def persist_directory_for(docs_path: str) -> str:
+        chroma_root = os.getenv("CHROMA_PERSIST_DIRECTORY", "./data/chroma")
+        return os.path.join(chroma_root, os.path.basename(os.path.normpath(docs_path)))
+    
     def _initialize_vectorstore(self):
         if not self.use_embeddings:
             return None
-            
-        persist_directory = f"./data/chroma/{os.path.basename(self.docs_path)}"
-        
-        # Check if vectorstore already exists
-        if os.path.exists(persist_directory):
-            return Chroma(
-                persist_directory=persist_directory,
-                embedding_function=self.embeddings
-            )
-        
-        # Create new vectorstore
-        if self.documents:
-            vectorstore = Chroma.from_documents(
-                self.documents,
-                self.embeddings,
-                persist_directory=persist_directory
-            )
-            return vectorstore
-        
-        # Return empty vectorstore if no documents
-        return Chroma(
-            persist_directory=persist_directory,
+        
+        # A manifest without its store (directory deleted) describes nothing
+        if not os.path.exists(self.persist_directory):
+            self.manifest = None
+        vectorstore = Chroma(
+            persist_directory=self.persist_directory,
             embedding_function=self.embeddings
         )
+        try:
+            self.index_report = self._sync_vectorstore(vectorstore)
+        except Exception as e:
+            print(f"Error syncing vector store {self.persist_directory}: {e}")
+        return vectorstore
+    
+    def _sync_vectorstore(self, vectorstore):
+        """Bring the persisted collection in line with the files on disk.
+        
+        The manifest next to the store records each file's content hash and
+        chunk ids. Only chunks of added or changed files that are not already
+        stored get embedded, and chunks of changed or deleted files that no
+        longer exist are removed. Without a manifest (first run, or a store
+        built before manifests existed) the diff is against the stored ids.
+        """
+        start = time.perf_counter()
+        manifest_path = f"{self.persist_directory}.manifest.json"
+        previous = self.manifest
+        
+        if previous is not None:
+            changes = previous.diff(IndexManifest(self.file_states))
+            if not any(changes.values()):
+                # Nothing to embed, so the chunks are not needed; just refresh file stats
+                if any(previous.files[source]["mtime_ns"] != state["mtime_ns"]
+                       for source, state in self.file_states.items()):
+                    for source, state in self.file_states.items():
+                        previous.files[source].update(state)
+                    previous.save(manifest_path)
+                return {**changes, "chunks_added": 0, "chunks_deleted": 0,
+                        "seconds": time.perf_counter() - start}
+        
+        self.pipeline.begin()
+        if previous is None:
+            old_ids = set(vectorstore.get(include=[])["ids"])
+            candidates = set(self.file_states)
+        else:
+            old_ids = previous.chunk_ids(changes["changed"] + changes["deleted"])
+            candidates = set(changes["added"] + changes["changed"])
+        
+        # Stream chunks into the embedder as files are split, keeping all of them for later use
+        documents = []
+        def new_chunks():
+            for file_documents in self._iter_chunks():
+                documents.extend(file_documents)
+                for doc in file_documents:
+                    if doc.metadata.get("source_path") in candidates and doc.metadata["chunk_id"] not in old_ids:
+                        yield doc
+        stats = self.pipeline.upsert(vectorstore, new_chunks())
+        self._documents = documents
+        
+        current = IndexManifest.from_chunks(self.file_states, documents)
+        if previous is None:
+            changes = IndexManifest().diff(current)
+        live_ids = {doc.metadata["chunk_id"] for doc in documents if doc.metadata.get("live")}
+        stale_ids = sorted(old_ids - current.chunk_ids(candidates) - live_ids)
+        for i in range(0, len(stale_ids), DELETE_BATCH_SIZE):
+            vectorstore.delete(ids=stale_ids[i:i + DELETE_BATCH_SIZE])
+        
+        current.save(manifest_path)
+        self.manifest = current
+        return {
+            **changes,
+            "chunks_added": stats.chunks_embedded,
+            "chunks_deleted": len(stale_ids),
+            "seconds": time.perf_counter() - start
+        }
+    
+    @property
+    def documents(self):
+        """All chunks, in file order; loaded on first access"""
+        if self._documents is None:
+            with self._load_lock:
+                if self._documents is None:
+                    self._documents = self._load_documents()
+        return self._documents
+    
+    @property
+    def lexical_index(self) -> BM25Index:
+        if self._lexical_index is None:
+            documents = self.documents
+            with self._load_lock:
+                if self._lexical_index is None:
+                    self._lexical_index = self._load_lexical_index(documents)
+        return self._lexical_index
+    
+    def _scan_files(self):
+        """Content hash, size and mtime of every markdown file, keyed by relative path.
+        
+        Files whose size and mtime match the manifest reuse its hash unread.
+        """
+        known = self.manifest.files if self.manifest else {}
+        states = {}
+        for source_path, path in iter_markdown_files(self.docs_path):
+            try:
+                stat = os.stat(path)
+                entry = known.get(source_path)
+                if entry and entry.get("size") == stat.st_size and entry.get("mtime_ns") == stat.st_mtime_ns:
+                    file_hash = entry["hash"]
+                else:
+                    with open(path, "r", encoding="utf-8") as f:
+                        file_hash = content_hash(f.read())
+            except (OSError, UnicodeDecodeError) as e:
+                print(f"Error reading {path}: {e}")
+                continue
+            states[source_path] = {"hash": file_hash, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+        return states
     
     def _load_documents(self):
+        return [doc for file_documents in self._iter_chunks() for doc in file_documents]
+    
+    def _iter_chunks(self) -> Iterator[List[Document]]:
+        """Chunks of each scanned file in order, from the pre-split chunk cache where the file is unchanged.
+        
+        Changed files are split by the ingestion pipeline; the cache is
+        rewritten once every file has been produced.
+        """
+        cache_path = f"{self.persist_directory}.chunks.json"
         try:
-            loader = DirectoryLoader(
-                self.docs_path,
-                glob="**/*.md",
-                loader_cls=TextLoader
-            )
-            documents = loader.load()
-            
-            # Split documents into chunks
-            text_splitter = RecursiveCharacterTextSplitter(
-                chunk_size=500,
-                chunk_overlap=50,
-                separators=["\n\n", "\n", " ", ""]
-            )
-            
-            return text_splitter.split_documents(documents)
-        except Exception as e:
-            print(f"Error loading documents from {self.docs_path}: {e}")
-            return []
+            with open(cache_path, "r") as f:
+                cache = json.load(f)
+        except FileNotFoundError:
+            cache = {}
+        except (OSError, ValueError) as e:
+            print(f"Error loading chunk cache {cache_path}: {e}")
+            cache = {}
+        
+        jobs = []
+        for source_path, state in self.file_states.items():
+            entry = cache.get(source_path)
+            cached = entry if entry is not None and entry["hash"] == state["hash"] else None
+            jobs.append((source_path, os.path.join(self.docs_path, source_path), cached))
+        
+        updated: Dict[str, Dict] = {}
+        for source_path, entry in self.pipeline.split(jobs):
+            if entry is None:
+                continue
+            updated[source_path] = entry
+            path = os.path.join(self.docs_path, source_path)
+            domain = domain_for(source_path)
+            yield [Document(page_content=chunk_text, metadata={
+                "source": path, "source_path": source_path, "chunk_id": chunk_id, "domain": domain
+            }) for chunk_id, chunk_text in entry["chunks"]]
+        
+        live = self._load_live_chunks()
+        if live:
+            yield live
+        
+        if updated != cache:
+            try:
+                os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+                with open(f"{cache_path}.tmp", "w") as f:
+                    json.dump(updated, f, separators=(",", ":"))
+                os.replace(f"{cache_path}.tmp", cache_path)
+            except OSError as e:
+                print(f"Error saving chunk cache {cache_path}: {e}")
     
-    def retrieve(self, query: str, k: int = 3):
-        """Retrieve top-k relevant documents for the query"""
-        if self.use_embeddings and self.vectorstore:
+    def _load_live_chunks(self) -> List[Document]:
+        """Chunks added through add_documents, which have no file of their own"""
+        live_path = f"{self.persist_directory}.live.jsonl"
+        documents = []
+        try:
+            with open(live_path, "r") as f:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        documents.append(Document(page_content=record["text"], metadata=record["metadata"]))
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Error loading live chunks {live_path}: {e}")
+        return documents
+    
+    def _load_lexical_index(self, documents) -> BM25Index:
+        """Load the persisted BM25 index if it matches the current chunks, else rebuild it"""
+        index_path = f"{self.persist_directory}.bm25.json"
+        texts = [doc.page_content for doc in documents]
+        fingerprint = corpus_fingerprint(texts)
+        
+        if os.path.exists(index_path):
+            try:
+                index = BM25Index.load(index_path)
+                if index.fingerprint == fingerprint:
+                    return index
+            except Exception as e:
+                print(f"Error loading lexical index {index_path}: {e}")
+        
+        index = BM25Index.build(texts)
+        if texts:
+            try:
+                index.save(index_path)
+            except OSError as e:
+                print(f"Error saving lexical index {index_path}: {e}")
+        return index
+    
+    def retrieve(self, query: str, k: int = 3, mode: str = None, domain: str = None):
+        """Retrieve top-k relevant documents for the query.
+        
+        mode is "vector" (embeddings), "lexical" (BM25) or "hybrid" (both run
+        concurrently, fused with reciprocal-rank fusion). Without embeddings
+        every mode falls back to lexical search. domain restricts results to
+        chunks of that domain; None searches the whole knowledge base.
+        """
+        mode = self._resolve_mode(mode)
+        with span("retrieval", domain or "all", RETRIEVAL_DURATION, mode, mode=mode) as record:
+            results = self._retrieve(query, k, mode, domain)
+            record["results"] = len(results)
+            return results
+    
+    def _retrieve(self, query: str, k: int, mode: str, domain: str = None):
+        if mode == "lexical":
+            return self._lexical_search(query, k, domain)
+        
+        if mode == "vector":
+            try:
+                return self.vectorstore.similarity_search(query, k=k, filter=self._vector_filter(domain))
+            except Exception:
+                return self._lexical_search(query, k, domain)
+        
+        # Hybrid: vector search in a worker thread while BM25 runs here
+        fetch_k = self._fusion_fetch_k(k, domain)
+        dense_future = _search_pool.submit(self.vectorstore.similarity_search, query, fetch_k,
+                                           filter=self._vector_filter(domain))
+        sparse = self._lexical_search(query, fetch_k, domain)
+        try:
+            dense = dense_future.result()
+        except Exception:
+            return sparse[:k]
+        return reciprocal_rank_fusion([dense, sparse], k=k, weights=self.fusion_weights)
+    
+    async def aretrieve(self, query: str, k: int = 3, mode: str = None, domain: str = None):
+        """Async variant of retrieve; awaits the vector store instead of blocking"""
+        mode = self._resolve_mode(mode)
+        with span("retrieval", domain or "all", RETRIEVAL_DURATION, mode, mode=mode) as record:
+            results = await self._aretrieve(query, k, mode, domain)
+            record["results"] = len(results)
+            return results
+    
+    async def _aretrieve(self, query: str, k: int, mode: str, domain: str = None):
+        # The first search reads every chunk and the BM25 index (possibly in a
+        # process pool); do that in a worker thread, not on the event loop
+        if mode != "vector" and (self._lexical_index is None or self._domain_ids is None):
+            await asyncio.to_thread(self._load_search_data)
+        if mode == "lexical":
+            return await asyncio.to_thread(self._lexical_search, query, k, domain)
+        
+        if mode == "vector":
             try:
-                return self.vectorstore.similarity_search(query, k=k)
+                return await self.vectorstore.asimilarity_search(query, k=k, filter=self._vector_filter(domain))
             except Exception:
-                pass
-        
-        # Fallback to simple text matching
-        return self._simple_text_search(query, k)
-    
-    def _simple_text_search(self, query: str, k: int = 3):
-        """Simple keyword-based search when embeddings unavailable"""
-        query_words = query.lower().split()
-        scored_docs = []
-        
-        for doc in self.documents:
-            content_lower = doc.page_content.lower()
-            score = sum(1 for word in query_words if word in content_lower)
-            if score > 0:
-                scored_docs.append((score, doc))
-        
-        # Sort by score and return top k
-        scored_docs.sort(key=lambda x: x[0], reverse=True)
-        return [doc for _, doc in scored_docs[:k]]
-    
-    def add_documents(self, documents):
-        """Add new documents to the vectorstore"""
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=500,
-            chunk_overlap=50
+                return await asyncio.to_thread(self._lexical_search, query, k, domain)
+        
+        # Hybrid: vector search awaited while BM25 scores in a worker thread
+        fetch_k = self._fusion_fetch_k(k, domain)
+        dense_task = asyncio.ensure_future(
+            self.vectorstore.asimilarity_search(query, k=fetch_k, filter=self._vector_filter(domain))
         )
-        chunks = text_splitter.split_documents(documents)
-        self.vectorstore.add_documents(chunks)
\ No newline at end of file
+        try:
+            sparse = await asyncio.to_thread(self._lexical_search, query, fetch_k, domain)
+        except BaseException:
+            # Stop the vector query and collect its outcome so no task is left behind
+            dense_task.cancel()
+            await asyncio.gather(dense_task, return_exceptions=True)
+            raise
+        try:
+            dense = await dense_task
+        except Exception:
+            return sparse[:k]
+        return reciprocal_rank_fusion([dense, sparse], k=k, weights=self.fusion_weights)
+    
+    def _vector_filter(self, domain: str = None):
+        return {"domain": domain} if domain else None
+    
+    def _fusion_fetch_k(self, k: int, domain: str = None) -> int:
+        """Candidates per ranking for fusion: 2k, capped at the corpus (or domain) size"""
+        size = len(self.documents) if domain is None else len(self.domain_ids().get(domain, ()))
+        return max(k, min(k * 2, size))
+    
+    def _load_search_data(self):
+        """Load the chunks, BM25 index and domain map that keyword search needs"""
+        self.lexical_index
+        self.domain_ids()
+    
+    def domain_ids(self) -> Dict[str, set]:
+        """Chunk positions per domain, for filtering keyword search"""
+        if self._domain_ids is None:
+            domain_ids: Dict[str, set] = {}
+            for doc_id, doc in enumerate(self.documents):
+                domain_ids.setdefault(doc.metadata.get("domain", DEFAULT_DOMAIN), set()).add(doc_id)
+            self._domain_ids = domain_ids
+        return self._domain_ids
+    
+    def _resolve_mode(self, mode: str = None) -> str:
+        mode = mode or self.mode
+        if mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode '{mode}', expected one of {RETRIEVAL_MODES}")
+        if not (self.use_embeddings and self.vectorstore):
+            return "lexical"
+        return mode
+    
+    def _lexical_search(self, query: str, k: int = 3, domain: str = None):
+        """BM25 keyword search over the prebuilt inverted index when embeddings are unavailable"""
+        # Read the index and domain filter before the documents: add_documents
+        # only appends, so ids from those snapshots are valid in a later document list
+        index = self.lexical_index
+        doc_filter = None if domain is None else self.domain_ids().get(domain, frozenset())
+        documents = self.documents
+        return [documents[doc_id] for doc_id, _ in index.search(query, k, doc_filter)]
+    
+    def add_documents(self, documents: List[Document], domain: str = None) -> Dict[str, int]:
+        """Split and index new documents while searches keep running.
+        
+        Chunks are tagged with domain (or the document's own "domain" metadata,
+        else the default domain); a new domain needs no new store.
+        
+        Chunks whose text is already in the knowledge base (or repeated in the
+        batch) are skipped. New chunks are embedded and upserted in bounded
+        batches first; only then are the chunk list and an extended BM25 index
+        published together, so a search sees either the old corpus or the new
+        one. Live chunks are appended to <persist_dir>.live.jsonl and survive
+        restarts. Concurrent calls are applied one at a time.
+        """
+        with self._update_lock:
+            known = self._text_hashes()
+            chunks, duplicates = [], 0
+            for document in documents:
+                source = document.metadata.get("source", "live")
+                chunk_domain = domain or document.metadata.get("domain") or DEFAULT_DOMAIN
+                for text in self._text_splitter.split_text(document.page_content):
+                    text_hash = content_hash(text)
+                    if text_hash in known:
+                        duplicates += 1
+                        continue
+                    known.add(text_hash)
+                    chunks.append(Document(page_content=text, metadata={
+                        **document.metadata, "source": source, "chunk_id": f"live-{text_hash}",
+                        "domain": chunk_domain, "live": True
+                    }))
+            
+            if chunks:
+                if self.vectorstore is not None:
+                    self.pipeline.begin()
+                    self.pipeline.upsert(self.vectorstore, chunks)
+                self._append_live_chunks(chunks)
+                
+                current = self.documents
+                updated = current + chunks
+                index = self.lexical_index.extended([doc.page_content for doc in chunks],
+                                                    [doc.page_content for doc in updated])
+                domain_ids = {name: set(ids) for name, ids in self.domain_ids().items()}
+                for doc_id, chunk in enumerate(chunks, start=len(current)):
+                    domain_ids.setdefault(chunk.metadata["domain"], set()).add(doc_id)
+                # Documents are published first because searches read them last
+                with self._load_lock:
+                    self._documents, self._lexical_index = updated, index
+                    self._domain_ids = domain_ids
+                    self._known_texts = known
+                try:
+                    index.save(f"{self.persist_directory}.bm25.json")
+                except OSError as e:
+                    print(f"Error saving lexical index: {e}")
+            
+            return {"chunks_added": len(chunks), "duplicates_skipped": duplicates}
+    
+    def _text_hashes(self):
+        """Content hashes of every chunk text (a copy, for add_documents to extend)"""
+        if self._known_texts is None:
+            self._known_texts = {content_hash(doc.page_content) for doc in self.documents}
+        return set(self._known_texts)
+    
+    def _append_live_chunks(self, chunks: List[Document]):
+        os.makedirs(os.path.dirname(self.persist_directory) or ".", exist_ok=True)
+        with open(f"{self.persist_directory}.live.jsonl", "a") as f:
+            for chunk in chunks:
+                f.write(json.dumps({"text": chunk.page_content, "metadata": chunk.metadata}) + "\n")
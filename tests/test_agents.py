@@ -1,7 +1,33 @@
 import pytest
+import asyncio
+import socket
+import socketserver
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from agents import intent_classifier
 from agents.intent_classifier import IntentClassifier
 from agents.orchestrator import OrchestratorAgent
+from agents.account_specialist import AccountSpecialist
+from agents.billing_specialist import BillingSpecialist
+from agents.cache import QueryCache, SemanticCache, TTLCache
+from agents.context_builder import ContextBuilder, count_tokens, extractive_summary
 from agents.conversation_memory import ConversationMemory
+from agents.escalation_handler import EscalationHandler
+from agents.fast_intent import FastIntentModel
+from agents.keyword_matcher import KeywordMatcher
+from agents.model_gateway import CircuitOpenError, ModelGateway
+from agents.session_store import (InMemorySessionStore, RedisError, RedisSessionStore, SessionStore, SQLiteSessionStore,
+                                  build_session_store)
+from agents.registry import ComponentRegistry, get_knowledge_base, get_orchestrator
+from agents.response_cache import ResponseCache
+from agents.tracing import render_metrics
+from evaluation import eval_runner
+from evaluation.metrics import EvaluationMetrics
+from evaluation.stub_llm import StubChatModel, StubEmbeddings, StubOpenAIServer, default_responder
+from langchain_core.documents import Document
+from langchain_openai import ChatOpenAI
 
 class TestIntentClassifier:
     def setup_method(self):
@@ -21,6 +47,251 @@ class TestIntentClassifier:
         result = self.classifier.classify("I want to speak to a manager")
         assert result["intent"] == "escalation"
         assert result["confidence"] > 0.5
+    
+    def test_aclassify_matches_classify(self):
+        result = asyncio.run(self.classifier.aclassify("My bill is too high"))
+        assert result == self.classifier.classify("My bill is too high")
+    
+    def test_aclassify_uses_async_model(self):
+        classifier = IntentClassifier(model=StubChatModel(
+            latency=0, responder=lambda prompt: '{"intent": "complaint", "confidence": 0.9}'
+        ))
+        result = asyncio.run(classifier.aclassify("This is terrible"))
+        assert result == {"intent": "complaint", "confidence": 0.9}
+
+class LetterEmbeddings:
+    """Deterministic bag-of-letters embeddings for cache tests"""
+    def __init__(self):
+        self.calls = 0
+    
+    def embed_query(self, text):
+        self.calls += 1
+        return [text.count(letter) for letter in "abcdefghijklmnopqrstuvwxyz"]
+
+class TestIntentCache:
+    def test_exact_hit_skips_model(self):
+        calls = []
+        
+        def responder(prompt):
+            calls.append(prompt)
+            return '{"intent": "billing_inquiry", "confidence": 0.95}'
+        
+        classifier = IntentClassifier(model=StubChatModel(latency=0, responder=responder))
+        first = classifier.classify("My bill is too high")
+        second = classifier.classify("  my BILL is too high? ")
+        assert first == second == {"intent": "billing_inquiry", "confidence": 0.95}
+        assert len(calls) == 1
+        assert classifier.cache_stats()["exact"]["hits"] == 1
+    
+    def test_fallback_results_not_cached(self):
+        classifier = IntentClassifier(model=StubChatModel(latency=0, responder=lambda prompt: "not json"))
+        classifier.classify("My bill is too high")
+        assert classifier.cache_stats()["exact"]["size"] == 0
+    
+    def test_ttl_expiry_and_lru_eviction(self):
+        cache = TTLCache(max_size=2, ttl_seconds=0.05)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        assert cache.get("b") is None
+        assert cache.get("a") == 1
+        time.sleep(0.06)
+        assert cache.get("a") is None
+    
+    def test_semantic_tier_matches_near_duplicates(self):
+        embeddings = LetterEmbeddings()
+        cache = QueryCache(semantic=SemanticCache(embeddings, threshold=0.95))
+        assert cache.get("my bill is too high") is None
+        cache.set("my bill is too high", {"intent": "billing_inquiry", "confidence": 0.9})
+        assert embeddings.calls == 1
+        
+        assert cache.get("my bill is way too high")["intent"] == "billing_inquiry"
+        assert cache.get("i forgot my password") is None
+        assert cache.stats()["semantic"]["hits"] == 1
+    
+    def test_semantic_tier_evicts_oldest_in_place(self):
+        cache = SemanticCache(StubEmbeddings(), threshold=0.99, max_size=3, ttl_seconds=0.2)
+        for query in ["late fee", "roaming rates", "reset password", "autopay discount"]:
+            cache.set(query, query)
+        matrix = cache._matrix
+        assert matrix.shape[0] == 3 and cache.stats()["size"] == 3
+        assert cache.get("late fee") is None
+        assert cache.get("autopay discount") == "autopay discount"
+        assert cache.get("roaming rates") == "roaming rates"
+        
+        time.sleep(0.25)
+        assert cache.get("roaming rates") is None
+        cache.set("late fee", "late fee")
+        assert cache.get("late fee") == "late fee"
+        assert cache.stats()["size"] == 1 and cache._matrix is matrix
+
+class TestBatchClassification:
+    def classifier(self, responder=None, **kwargs):
+        self.prompts = []
+        
+        def recording(prompt):
+            self.prompts.append(prompt)
+            return (responder or default_responder)(prompt)
+        
+        return IntentClassifier(model=StubChatModel(latency=0, responder=recording), cache=QueryCache(),
+                                fast_path_margin=1.01, **kwargs)
+    
+    def test_matches_single_classification_in_few_prompts(self):
+        queries = ["My bill is too high", "I forgot my password", "I want to speak to a manager",
+                   "Why was I charged a late fee?", "My bill is too high", 'Slow "5G"\nsignal']
+        classifier = self.classifier(batch_size=2)
+        results = classifier.classify_batch(queries)
+        assert results == [IntentClassifier(cache=QueryCache(), fast_path_margin=1.01).classify(q) for q in queries]
+        # Five distinct queries, two to a prompt
+        assert len(self.prompts) == 3
+        assert all("Customer Queries:" in prompt for prompt in self.prompts[:2])
+        assert classifier.classify("I forgot my password") == results[1]
+        assert len(self.prompts) == 3
+    
+    def test_async_batches_run_concurrently(self):
+        classifier = self.classifier(batch_size=2)
+        classifier.model.latency = 0.05
+        queries = [f"Question about my bill number {i}" for i in range(8)]
+        start = time.perf_counter()
+        results = asyncio.run(classifier.aclassify_batch(queries, concurrency=4))
+        assert time.perf_counter() - start < 0.15
+        assert [result["intent"] for result in results] == ["billing_inquiry"] * 8
+        assert len(self.prompts) == 4
+    
+    def test_async_batch_stores_results_without_blocking_calls(self, tmp_path):
+        class AsyncOnlyEmbeddings(LetterEmbeddings):
+            def embed_query(self, text):
+                raise AssertionError("blocking embedding call on the event loop")
+            
+            async def aembed_query(self, text):
+                return LetterEmbeddings.embed_query(self, text)
+        
+        semantic = SemanticCache(AsyncOnlyEmbeddings())
+        # Too small to keep the lookup vectors of the whole batch
+        semantic._pending = TTLCache(max_size=1, ttl_seconds=60)
+        log = tmp_path / "traffic.jsonl"
+        classifier = IntentClassifier(model=StubChatModel(latency=0), cache=QueryCache(semantic=semantic),
+                                      fast_path_margin=1.01, traffic_log=str(log))
+        queries = ["My bill is too high", "I forgot my password", "I want to speak to a manager"]
+        asyncio.run(classifier.aclassify_batch(queries))
+        assert semantic.stats()["size"] == 3
+        assert len(log.read_text().splitlines()) == 3
+    
+    def test_partial_replies_are_completed_per_query(self):
+        def responder(prompt):
+            if "Customer Queries:" in prompt:
+                # Fenced, reordered, one item missing and one malformed
+                return ('```json\n[{"id": 3, "intent": "escalation", "confidence": 0.9}, '
+                        '{"id": 1, "intent": "billing_inquiry", "confidence": "high"}]\n```')
+            return '{"intent": "account_management", "confidence": 0.7}'
+        
+        classifier = self.classifier(responder)
+        results = classifier.classify_batch(["bill", "password", "manager"])
+        assert results == [{"intent": "account_management", "confidence": 0.7},
+                           {"intent": "account_management", "confidence": 0.7},
+                           {"intent": "escalation", "confidence": 0.9}]
+        # One batch prompt plus a single prompt for each query it didn't answer
+        assert len(self.prompts) == 3
+    
+    def test_unparseable_array_salvages_objects(self):
+        from agents.intent_classifier import parse_json_items
+        content = '[{"id": 1, "intent": "complaint", "confidence": 0.8}, {"id": 2, "intent": oops}]'
+        assert parse_json_items(content) == [{"id": 1, "intent": "complaint", "confidence": 0.8}]
+    
+    def test_failed_batch_call_falls_back_to_keywords(self):
+        def responder(prompt):
+            raise RuntimeError("model down")
+        
+        results = self.classifier(responder).classify_batch(["My bill is too high", "I want a supervisor"])
+        assert [result["intent"] for result in results] == ["billing_inquiry", "escalation"]
+        assert len(self.prompts) == 1
+    
+    def test_bulk_endpoint_preclassifies(self):
+        classifier = self.classifier()
+        orchestrator = OrchestratorAgent(
+            intent_classifier=classifier,
+            billing_agent=BillingSpecialist(model=StubChatModel(latency=0.0), retriever=RecordingRetriever()),
+            memory=ConversationMemory(sweep_seconds=0),
+        )
+        queries = [{"message": f"Why is bill {i} so high?", "user_id": f"bulk{i}"} for i in range(5)]
+        outcomes = asyncio.run(orchestrator.aprocess_batch(queries))
+        assert all(outcome["result"]["intent"] == "billing_inquiry" for outcome in outcomes)
+        assert len([prompt for prompt in self.prompts if "intent classifier" in prompt]) == 1
+
+class TestKeywordMatcher:
+    def setup_method(self):
+        self.matcher = KeywordMatcher({
+            "billing": {"bill": 1.0, "billing": 1.0, "fee": 1.0},
+            "escalation": {"agent": 1.0, "talk to a human": 2.0},
+        })
+    
+    def test_matches_whole_words_only(self):
+        assert self.matcher.matches("a billion agents") == []
+        assert self.matcher.matches("Billing agent!") == ["billing", "agent"]
+    
+    def test_phrases_and_scoring(self):
+        assert self.matcher.score("bill fee, let me talk to a human") == {"billing": 2.0, "escalation": 2.0}
+        # Ties go to the label listed first
+        assert self.matcher.best("bill fee, let me talk to a human") == ("billing", 2.0)
+        assert self.matcher.best("my bill, talk to a human agent") == ("escalation", 3.0)
+        assert self.matcher.best("nothing relevant") == (None, 0.0)
+    
+    def test_fallback_classifier_scores_all_intents(self):
+        classifier = IntentClassifier()
+        # The old first-hit cascade returned billing_inquiry for any query mentioning a bill
+        assert classifier._fallback_classify("Cancel my service, the bill is wrong")["intent"] == "escalation"
+        assert classifier._fallback_classify("Our agents sent a billion texts")["intent"] == "general_info"
+    
+    def test_escalation_complexity_reason(self):
+        handler = EscalationHandler()
+        assert handler._determine_complexity("I will call my attorney") == "Legal matter requires specialized handling"
+        assert handler._determine_complexity("Please cancel my line") == "Account cancellation requires human verification"
+        assert handler._determine_complexity("Something odd") == "Complex issue requiring human expertise"
+
+FAST_PATH_EXAMPLES = [
+    ("my bill is too high", "billing_inquiry"),
+    ("why is my bill so high this month", "billing_inquiry"),
+    ("I was charged twice on my bill", "billing_inquiry"),
+    ("I forgot my password", "account_management"),
+    ("reset my account password", "account_management"),
+    ("I can't log in to my account", "account_management"),
+    ("let me speak to a manager", "escalation"),
+    ("I want a supervisor now", "escalation"),
+]
+
+class TestFastIntentModel:
+    def setup_method(self):
+        self.model = FastIntentModel.train(FAST_PATH_EXAMPLES)
+    
+    def test_predicts_training_intents(self):
+        assert self.model.predict("my bill is high")["intent"] == "billing_inquiry"
+        assert self.model.predict("forgot password")["intent"] == "account_management"
+    
+    def test_save_load_roundtrip(self, tmp_path):
+        path = str(tmp_path / "model.npz")
+        self.model.save(path)
+        loaded = FastIntentModel.load(path)
+        original = self.model.predict("let me talk to a manager")
+        restored = loaded.predict("let me talk to a manager")
+        assert restored["intent"] == original["intent"]
+        assert abs(restored["confidence"] - original["confidence"]) < 1e-2
+    
+    def test_confident_queries_skip_llm(self):
+        calls = []
+        
+        def responder(prompt):
+            calls.append(prompt)
+            return '{"intent": "general_info", "confidence": 0.9}'
+        
+        classifier = IntentClassifier(model=StubChatModel(latency=0, responder=responder),
+                                      cache=QueryCache(), fast_model=self.model, fast_path_margin=0.0)
+        assert classifier.classify("my bill is too high")["intent"] == "billing_inquiry"
+        assert calls == []
+        
+        classifier.fast_path_margin = 1.01
+        assert classifier.classify("my bill is too high")["intent"] == "general_info"
+        assert len(calls) == 1
 
 class TestConversationMemory:
     def setup_method(self):
@@ -43,6 +314,553 @@ class TestConversationMemory:
             self.memory.add_message("user1", "user", f"Message {i}")
         messages = self.memory.get_conversation("user1")
         assert len(messages) == 5  # max_turns limit
+        assert messages[-1]["content"] == "Message 9"
+    
+    def test_max_sessions_evicts_least_recently_active(self):
+        memory = ConversationMemory(max_sessions=3, sweep_seconds=0)
+        for user_id in ["a", "b", "c"]:
+            memory.add_message(user_id, "user", "Hello")
+        memory.add_message("a", "user", "Still here")
+        memory.add_message("d", "user", "Hello")
+        assert memory.get_conversation("b") == []
+        assert len(memory.get_conversation("a")) == 2
+        assert memory.stats()["sessions"] == 3
+        assert memory.stats()["evictions"] == 1
+    
+    def test_sweep_drops_expired_sessions(self):
+        memory = ConversationMemory(ttl_minutes=0, sweep_seconds=0)
+        for i in range(5):
+            memory.add_message(f"user{i}", "user", "Hello")
+        time.sleep(0.01)
+        assert memory.sweep() == 5
+        assert memory.stats()["sessions"] == 0
+        assert memory.stats()["expirations"] == 5
+    
+    def test_background_sweeper(self):
+        memory = ConversationMemory(ttl_minutes=0, sweep_seconds=0.01)
+        memory.add_message("user1", "user", "Hello")
+        deadline = time.monotonic() + 2
+        while memory.store.conversations and time.monotonic() < deadline:
+            time.sleep(0.01)
+        memory.close()
+        assert not memory.store.conversations
+    
+    def test_stats(self):
+        self.memory.add_message("user1", "user", "Hello")
+        self.memory.add_message("user2", "user", "Hi")
+        stats = self.memory.stats()
+        assert stats["sessions"] == 2 and stats["messages"] == 2
+        assert stats["approx_bytes"] > 0
+
+class StandInRedis(socketserver.ThreadingTCPServer):
+    """Local stand-in for a Redis server: the RESP commands the session store uses, with key expiry"""
+    
+    daemon_threads = True
+    allow_reuse_address = True
+    
+    def __init__(self):
+        self.lists, self.expiry, self.commands = {}, {}, []
+        self.lock = threading.Lock()
+        # Open client sockets, and a delay before each reply (after the command has run)
+        self.connections, self.reply_delay = set(), 0.0
+        super().__init__(("127.0.0.1", 0), StandInRedisHandler)
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+    
+    @property
+    def url(self):
+        return f"redis://127.0.0.1:{self.server_address[1]}/0"
+    
+    def hang_up(self):
+        """Close every client connection, as Redis does with idle ones"""
+        for connection in list(self.connections):
+            connection.shutdown(socket.SHUT_RDWR)
+    
+    def run(self, name, *args):
+        with self.lock:
+            self.commands.append(name)
+            for key, expires_at in list(self.expiry.items()):
+                if time.monotonic() > expires_at:
+                    self.lists.pop(key, None)
+                    del self.expiry[key]
+            if name == b"RPUSH":
+                self.lists.setdefault(args[0], []).extend(args[1:])
+                return b":%d\r\n" % len(self.lists[args[0]])
+            if name == b"LTRIM":
+                values = self.lists.get(args[0], [])
+                start, stop = int(args[1]), int(args[2])
+                self.lists[args[0]] = values[start:stop + 1 if stop != -1 else None]
+                return b"+OK\r\n"
+            if name == b"PEXPIRE":
+                self.expiry[args[0]] = time.monotonic() + int(args[1]) / 1000
+                return b":1\r\n"
+            if name == b"LRANGE":
+                values = self.lists.get(args[0], [])
+                return b"*%d\r\n" % len(values) + b"".join(b"$%d\r\n%s\r\n" % (len(v), v) for v in values)
+            return b"-ERR unknown command\r\n"
+
+class StandInRedisHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        self.server.connections.add(self.connection)
+        try:
+            while True:
+                header = self.rfile.readline()
+                if not header:
+                    return
+                args = []
+                for _ in range(int(header[1:])):
+                    length = int(self.rfile.readline()[1:])
+                    args.append(self.rfile.read(length + 2)[:-2])
+                reply = self.server.run(*args)
+                time.sleep(self.server.reply_delay)
+                self.wfile.write(reply)
+        except OSError:
+            return
+        finally:
+            self.server.connections.discard(self.connection)
+
+class TestSessionStores:
+    def message_flow(self, make_memory):
+        """Two memories on one store behave like two workers sharing sessions"""
+        first, second = make_memory(), make_memory()
+        for i in range(7):
+            (first if i % 2 else second).add_message("shared", "user", f"Message {i}", {"turn": i} if i == 6 else None)
+        history = first.get_conversation("shared")
+        assert [message["content"] for message in history] == [f"Message {i}" for i in range(2, 7)]
+        assert second.get_conversation("shared") == history
+        assert history[-1]["metadata"] == {"turn": 6}
+        assert history[0]["metadata"] == {}
+        assert isinstance(history[0]["timestamp"], datetime)
+        assert first.get_conversation("nobody") == []
+    
+    def test_incomplete_store_fails_at_construction(self):
+        class AppendOnlyStore(SessionStore):
+            def append(self, user_id, message, max_turns, ttl_seconds):
+                pass
+        
+        with pytest.raises(TypeError):
+            AppendOnlyStore()
+    
+    def test_sqlite_store_is_shared(self, tmp_path):
+        path = str(tmp_path / "sessions.db")
+        self.message_flow(lambda: ConversationMemory(max_turns=5, sweep_seconds=0, store=SQLiteSessionStore(path)))
+    
+    def test_sqlite_store_expires_sessions(self, tmp_path):
+        memory = ConversationMemory(ttl_minutes=0, sweep_seconds=0, store=SQLiteSessionStore(str(tmp_path / "s.db")))
+        memory.add_message("user1", "user", "Hello")
+        time.sleep(0.01)
+        assert memory.get_conversation("user1") == []
+        # An expired session starts over rather than resurrecting old messages
+        memory.ttl = timedelta(minutes=30)
+        memory.add_message("user1", "user", "Back again")
+        assert [m["content"] for m in memory.get_conversation("user1")] == ["Back again"]
+        
+        memory.ttl = timedelta(0)
+        memory.add_message("user2", "user", "Hello")
+        time.sleep(0.01)
+        assert memory.sweep() == 1
+        assert memory.stats()["sessions"] == 1
+    
+    def test_redis_store_against_stand_in(self):
+        server = StandInRedis()
+        try:
+            self.message_flow(lambda: ConversationMemory(max_turns=5, sweep_seconds=0, store=RedisSessionStore(server.url)))
+            # Every append is one pipelined push + trim + expire
+            assert server.commands.count(b"RPUSH") == server.commands.count(b"PEXPIRE") == 7
+            
+            memory = ConversationMemory(ttl_minutes=0, store=RedisSessionStore(server.url))
+            memory.add_message("brief", "user", "Hello")
+            time.sleep(0.01)
+            assert memory.get_conversation("brief") == []
+            # The server expires sessions, so no sweeper thread is started
+            assert memory._sweeper is None
+        finally:
+            server.shutdown()
+            server.server_close()
+    
+    def test_redis_store_resends_only_when_nothing_ran(self):
+        server = StandInRedis()
+        try:
+            store = RedisSessionStore(server.url, timeout=0.2)
+            message = {"role": "user", "content": "Hello", "timestamp": datetime.now(), "metadata": {}}
+            store.append("idle", message, 10, 60)
+            # A pooled connection the server closed is replaced and the append resent
+            server.hang_up()
+            time.sleep(0.05)
+            store.append("idle", message, 10, 60)
+            assert len(store.get("idle")) == 2
+            
+            # A reply that times out after the push ran must not be pushed again
+            server.reply_delay = 0.3
+            with pytest.raises(OSError):
+                store.append("slow", message, 10, 60)
+            server.reply_delay = 0.0
+            time.sleep(0.7)
+            assert len(store.get("slow")) == 1
+            
+            # Error replies close the connection instead of leaking it
+            store.close()
+            time.sleep(0.05)
+            with pytest.raises(RedisError):
+                store._pipeline(("BOGUS",))
+            time.sleep(0.05)
+            assert store.stats()["pooled_connections"] == 0
+            assert server.connections == set()
+        finally:
+            server.shutdown()
+            server.server_close()
+    
+    def test_build_session_store(self, tmp_path):
+        assert isinstance(build_session_store("memory", max_sessions=5), InMemorySessionStore)
+        assert isinstance(build_session_store(f"sqlite:///{tmp_path}/s.db"), SQLiteSessionStore)
+        assert isinstance(build_session_store("redis://localhost:6379/2"), RedisSessionStore)
+        with pytest.raises(ValueError):
+            build_session_store("mongodb://localhost")
+
+class TestConcurrentMemory:
+    @pytest.fixture(params=["memory", "sqlite"])
+    def memory(self, request, tmp_path):
+        store = InMemorySessionStore() if request.param == "memory" else SQLiteSessionStore(str(tmp_path / "s.db"))
+        return ConversationMemory(max_turns=1000, sweep_seconds=0, store=store)
+    
+    def test_threads_keep_every_message_in_order(self, memory):
+        writers, per_writer, users = 16, 100, 8
+        errors, done = [], threading.Event()
+        
+        def write(writer):
+            for i in range(per_writer):
+                memory.add_message(f"user{writer % users}", "user", f"{writer}:{i}")
+        
+        def read():
+            while not done.is_set():
+                try:
+                    for user in range(users):
+                        memory.get_conversation(f"user{user}")
+                        memory.get_context_summary(f"user{user}")
+                    memory.stats()
+                except Exception as e:
+                    errors.append(e)
+                    return
+        
+        readers = [threading.Thread(target=read) for _ in range(4)]
+        threads = [threading.Thread(target=write, args=(writer,)) for writer in range(writers)]
+        for thread in readers + threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        done.set()
+        for thread in readers:
+            thread.join()
+        
+        assert errors == []
+        for user in range(users):
+            history = memory.get_conversation(f"user{user}")
+            assert len(history) == per_writer * writers // users
+            # Each writer's messages are stored in the order it sent them
+            sequences = {}
+            for message in history:
+                writer, i = map(int, message["content"].split(":"))
+                sequences.setdefault(writer, []).append(i)
+            assert all(sequence == list(range(per_writer)) for sequence in sequences.values())
+    
+    def test_same_user_turns_are_serialized(self, memory):
+        turns = 50
+        with ThreadPoolExecutor(max_workers=16) as pool:
+            results = list(pool.map(lambda i: memory.start_turn("busy", f"Turn {i}"), range(turns)))
+        # Every turn saw a distinct, complete snapshot: the turns before it and none after
+        assert sorted(len(history) for history in results) == list(range(turns))
+        assert len(memory.get_conversation("busy")) == turns
+    
+    def test_threads_and_async_tasks_through_orchestrator(self):
+        stub = StubChatModel(latency=0.0)
+        orchestrator = OrchestratorAgent(
+            intent_classifier=IntentClassifier(model=stub, cache=QueryCache(), fast_path_margin=1.01),
+            billing_agent=BillingSpecialist(model=stub, retriever=RecordingRetriever()),
+            memory=ConversationMemory(max_turns=1000, sweep_seconds=0),
+        )
+        users, turns = 4, 20
+        
+        def threaded():
+            with ThreadPoolExecutor(max_workers=8) as pool:
+                list(pool.map(lambda i: orchestrator.process_query("My bill is too high", user_id=f"u{i % users}"),
+                              range(users * turns)))
+        
+        async def run_all():
+            thread = asyncio.get_running_loop().run_in_executor(None, threaded)
+            await asyncio.gather(*(
+                orchestrator.aprocess_query("My bill is too high", user_id=f"u{i % users}")
+                for i in range(users * turns)
+            ))
+            await thread
+        
+        asyncio.run(run_all())
+        for user in range(users):
+            history = orchestrator.memory.get_conversation(f"u{user}")
+            roles = [message["role"] for message in history]
+            # Two turns per user per path, each recording a query and an answer
+            assert roles.count("user") == roles.count("assistant") == 2 * turns
+
+class SlowSessionStore(InMemorySessionStore):
+    """In-process store that takes as long as a network round trip, and says it blocks"""
+    
+    blocking = True
+    
+    def append(self, user_id, message, max_turns, ttl_seconds):
+        time.sleep(0.1)
+        super().append(user_id, message, max_turns, ttl_seconds)
+    
+    def get(self, user_id):
+        time.sleep(0.1)
+        return super().get(user_id)
+
+class TestAsyncSessionStore:
+    def test_blocking_store_stays_off_the_event_loop(self):
+        memory = ConversationMemory(sweep_seconds=0, store=SlowSessionStore())
+        orchestrator = OrchestratorAgent(
+            intent_classifier=IntentClassifier(model=StubChatModel(latency=0), cache=QueryCache(), fast_path_margin=1.01),
+            billing_agent=BillingSpecialist(model=StubChatModel(latency=0), retriever=RecordingRetriever()),
+            memory=memory,
+        )
+        
+        async def run():
+            gaps, done = [], asyncio.Event()
+            async def ticker():
+                last = time.perf_counter()
+                while not done.is_set():
+                    await asyncio.sleep(0.01)
+                    now = time.perf_counter()
+                    gaps.append(now - last)
+                    last = now
+            tick = asyncio.ensure_future(ticker())
+            start = time.perf_counter()
+            await asyncio.gather(*(orchestrator.aprocess_query("Why is my bill high?", user_id=f"slow{user}")
+                                   for user in range(5)))
+            wall = time.perf_counter() - start
+            done.set()
+            await tick
+            return wall, max(gaps)
+        
+        wall, longest_gap = asyncio.run(run())
+        # Three store calls per request, the five requests overlapping
+        assert wall < 0.6
+        assert longest_gap < 0.08
+        assert [m["role"] for m in memory.get_conversation("slow0")] == ["user", "assistant"]
+    
+    def test_in_process_store_is_used_inline(self):
+        assert InMemorySessionStore.blocking is False
+        assert SQLiteSessionStore.blocking and RedisSessionStore.blocking
+
+class CountingClassifier:
+    """Classifier stand-in that tracks how many classifications run at once"""
+    
+    def __init__(self):
+        self.active = self.peak = 0
+        self.queries = []
+    
+    async def aclassify(self, query):
+        if "explode" in query:
+            raise RuntimeError("classifier down")
+        self.queries.append(query)
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        await asyncio.sleep(0.01)
+        self.active -= 1
+        return {"intent": "billing_inquiry", "confidence": 0.9}
+
+class TestBatchProcessing:
+    def setup_method(self):
+        self.classifier = CountingClassifier()
+        self.orchestrator = OrchestratorAgent(
+            intent_classifier=self.classifier,
+            billing_agent=BillingSpecialist(model=StubChatModel(latency=0.0), retriever=RecordingRetriever()),
+            memory=ConversationMemory(max_turns=100, sweep_seconds=0),
+        )
+    
+    def test_results_in_order_with_per_item_errors(self):
+        queries = [{"message": f"Bill question {i}", "user_id": f"batch{i}"} for i in range(10)]
+        queries[4]["message"] = "Please explode"
+        outcomes = asyncio.run(self.orchestrator.aprocess_batch(queries, concurrency=4))
+        assert len(outcomes) == 10
+        assert "classifier down" in outcomes[4]["error"]
+        for i, outcome in enumerate(outcomes):
+            if i != 4:
+                assert f"Bill question {i}" in outcome["result"]["response"]
+        assert self.classifier.peak <= 4
+    
+    def test_identical_queries_are_coalesced(self):
+        queries = [{"message": "Why is my bill high?", "user_id": "same"} for _ in range(5)]
+        queries.append({"message": "Why is my bill high?", "user_id": "other"})
+        outcomes = asyncio.run(self.orchestrator.aprocess_batch(queries))
+        assert len(self.classifier.queries) == 1
+        assert [outcome.get("coalesced", False) for outcome in outcomes] == [False, True, True, True, True, True]
+        assert outcomes[1]["result"] == outcomes[0]["result"]
+    
+    def test_first_turns_are_coalesced_across_users(self):
+        self.orchestrator.memory.add_message("returning", "user", "Hello")
+        queries = [{"message": "Why is my bill high?", "user_id": f"new{i}"} for i in range(3)]
+        queries.append({"message": "Why is my bill high?", "user_id": "returning"})
+        queries.append({"message": "Why is my bill high?", "user_id": "new0",
+                        "customer_context": {"account_id": "A1"}})
+        outcomes = asyncio.run(self.orchestrator.aprocess_batch(queries))
+        assert [outcome.get("coalesced", False) for outcome in outcomes] == [False, True, True, False, False]
+        assert len(self.classifier.queries) == 3
+        # Users answered with a shared response still have the turn in their history
+        history = self.orchestrator.memory.get_conversation("new2")
+        assert [m["role"] for m in history] == ["user", "assistant"]
+        assert history[1]["content"] == outcomes[0]["result"]["response"]
+    
+    def test_session_store_errors_fail_only_their_queries(self):
+        class BrokenSessionStore(InMemorySessionStore):
+            def get(self, user_id):
+                if user_id.startswith("broken"):
+                    raise OSError("session store unavailable")
+                return super().get(user_id)
+        
+        self.orchestrator.memory = ConversationMemory(sweep_seconds=0, store=BrokenSessionStore())
+        queries = [{"message": "Why is my bill high?", "user_id": user_id} for user_id in ("broken1", "new1", "new2")]
+        outcomes = asyncio.run(asyncio.wait_for(self.orchestrator.aprocess_batch(queries), timeout=5))
+        assert "session store unavailable" in outcomes[0]["error"]
+        assert "result" in outcomes[1] and outcomes[2].get("coalesced")
+    
+    def test_a_users_queries_run_in_order(self):
+        queries = [{"message": f"Turn {i}", "user_id": "ordered"} for i in range(6)]
+        asyncio.run(self.orchestrator.aprocess_batch(queries, concurrency=6))
+        history = self.orchestrator.memory.get_conversation("ordered")
+        assert [m["content"] for m in history if m["role"] == "user"] == [f"Turn {i}" for i in range(6)]
+        assert self.classifier.peak == 1
+
+class TestContextBuilder:
+    def history(self, turns):
+        memory = ConversationMemory(max_turns=1000, sweep_seconds=0)
+        for i in range(turns):
+            memory.add_message("user1", "user", f"Question {i} about my bill and the roaming charges on it")
+            memory.add_message("user1", "assistant", f"Answer {i}: the roaming charge was applied on day {i}",
+                               {"intent": "billing_inquiry"})
+        return memory.get_conversation("user1")
+    
+    def test_short_history_is_quoted_in_full(self):
+        context = ContextBuilder(budget_tokens=400).build("user1", self.history(2))
+        assert context.splitlines() == [
+            "Customer: Question 0 about my bill and the roaming charges on it",
+            "Agent: Answer 0: the roaming charge was applied on day 0",
+            "Customer: Question 1 about my bill and the roaming charges on it",
+            "Agent: Answer 1: the roaming charge was applied on day 1",
+        ]
+    
+    def test_long_history_stays_within_budget(self):
+        builder = ContextBuilder(budget_tokens=120)
+        sizes = []
+        for turns in range(1, 40):
+            context = builder.build("user1", self.history(turns))
+            sizes.append(count_tokens(context))
+        # Prompt size levels off at the budget instead of growing with the conversation
+        assert max(sizes) <= 120
+        assert sizes[-1] == pytest.approx(sizes[20], abs=10)
+        assert context.startswith("Earlier in the conversation: ")
+        assert context.endswith("Answer 38: the roaming charge was applied on day 38")
+        assert "Question 38" in context
+    
+    def test_summary_is_extended_not_recomputed(self):
+        summarized = []
+        def summarizer(previous, messages):
+            summarized.extend(message["content"] for message in messages)
+            return extractive_summary(previous, messages)
+        builder = ContextBuilder(budget_tokens=120, summarizer=summarizer)
+        
+        history = self.history(30)
+        for end in range(2, len(history) + 1):
+            builder.build("user1", history[:end])
+        # Every message that aged out was summarized exactly once
+        assert len(summarized) == len(set(summarized))
+        
+        calls = len(summarized)
+        builder.build("user1", history)
+        assert len(summarized) == calls
+    
+    def test_model_summary_does_not_block_the_event_loop(self):
+        from agents.context_builder import LLMSummarizer
+        memory = ConversationMemory(max_turns=1000, sweep_seconds=0)
+        for user in range(5):
+            for message in self.history(10):
+                memory.add_message(f"long{user}", message["role"], message["content"], message["metadata"])
+        orchestrator = OrchestratorAgent(
+            intent_classifier=IntentClassifier(model=StubChatModel(latency=0), cache=QueryCache(), fast_path_margin=1.01),
+            billing_agent=BillingSpecialist(model=StubChatModel(latency=0), retriever=RecordingRetriever()),
+            memory=memory,
+            context_builder=ContextBuilder(budget_tokens=120, summarizer=LLMSummarizer(StubChatModel(latency=0.2))),
+        )
+        
+        async def run():
+            gaps, done = [], asyncio.Event()
+            async def ticker():
+                last = time.perf_counter()
+                while not done.is_set():
+                    await asyncio.sleep(0.01)
+                    now = time.perf_counter()
+                    gaps.append(now - last)
+                    last = now
+            tick = asyncio.ensure_future(ticker())
+            start = time.perf_counter()
+            results = await asyncio.gather(*(orchestrator.aprocess_query("Why is my bill high?", user_id=f"long{user}")
+                                             for user in range(5)))
+            wall = time.perf_counter() - start
+            done.set()
+            await tick
+            return results, wall, max(gaps)
+        
+        results, wall, longest_gap = asyncio.run(run())
+        assert all("error" not in result for result in results)
+        assert len(orchestrator.context_builder.summaries) == 5
+        # The five summaries are written concurrently while the loop keeps running
+        assert wall < 0.6
+        assert longest_gap < 0.1
+    
+    def test_specialist_prompt_includes_conversation(self):
+        prompts = []
+        def responder(prompt):
+            prompts.append(prompt)
+            return default_responder(prompt)
+        stub = StubChatModel(latency=0.0, responder=responder)
+        orchestrator = OrchestratorAgent(
+            intent_classifier=IntentClassifier(model=stub, cache=QueryCache(), fast_path_margin=1.01),
+            billing_agent=BillingSpecialist(model=stub, retriever=RecordingRetriever()),
+            memory=ConversationMemory(sweep_seconds=0),
+        )
+        orchestrator.process_query("Why is my bill $100 this month?", user_id="followup")
+        orchestrator.process_query("Can you explain that charge on my bill?", user_id="followup")
+        assert "Customer: Why is my bill $100 this month?" in prompts[-1]
+        assert "Conversation So Far:\nNo previous messages." in prompts[1]
+
+class TestComponentRegistry:
+    def test_get_or_create_builds_once(self):
+        registry = ComponentRegistry()
+        calls = []
+        
+        def factory():
+            calls.append(1)
+            return object()
+        
+        first = registry.get_or_create("key", factory)
+        assert registry.get_or_create("key", factory) is first
+        assert len(calls) == 1
+    
+    def test_failed_construction_is_retried(self):
+        registry = ComponentRegistry()
+        
+        def failing():
+            raise RuntimeError("no api key")
+        
+        with pytest.raises(RuntimeError):
+            registry.get_or_create("key", failing)
+        assert registry.get_or_create("key", lambda: "ok") == "ok"
+    
+    def test_orchestrators_share_specialists(self):
+        first = OrchestratorAgent()
+        second = OrchestratorAgent()
+        assert first.billing_agent is second.billing_agent
+        assert first.billing_agent.retriever is get_knowledge_base()
+        assert first.account_agent.retriever is first.billing_agent.retriever
+        assert first.memory is not second.memory
+        assert get_orchestrator() is get_orchestrator()
 
 class TestOrchestrator:
     def setup_method(self):
@@ -58,4 +876,466 @@ class TestOrchestrator:
         self.orchestrator.process_query("My bill is high", user_id="test2")
         # Second query should have context
         result = self.orchestrator.process_query("Why is that?", user_id="test2")
-        assert len(result["response"]) > 0
\ No newline at end of file
+        assert len(result["response"]) > 0
+    
+    def test_async_billing_routing(self):
+        result = asyncio.run(self.orchestrator.aprocess_query("Why is my bill $100?", user_id="test3"))
+        assert result["intent"] == "billing_inquiry"
+        assert len(result["response"]) > 0
+        assert len(self.orchestrator.memory.get_conversation("test3")) == 2
+    
+    def test_concurrent_async_queries(self):
+        stub = StubChatModel(latency=0.05)
+        orchestrator = OrchestratorAgent(
+            intent_classifier=IntentClassifier(model=stub),
+            billing_agent=BillingSpecialist(model=stub),
+        )
+        
+        async def run_all():
+            return await asyncio.gather(*(
+                orchestrator.aprocess_query("My bill is too high", user_id=f"load{i}")
+                for i in range(20)
+            ))
+        
+        start = time.perf_counter()
+        results = asyncio.run(run_all())
+        # 20 queries x 2 model calls x 50ms would take 2s if they were serialized
+        assert time.perf_counter() - start < 1.0
+        assert all(result["intent"] == "billing_inquiry" for result in results)
+
+class RecordingRetriever:
+    """Retriever stand-in that records which domains were searched"""
+    
+    def __init__(self):
+        self.domains = []
+    
+    def retrieve(self, query, k=3, mode=None, domain=None):
+        self.domains.append(domain)
+        return [Document(page_content=f"{domain} policy text")]
+    
+    async def aretrieve(self, query, k=3, mode=None, domain=None):
+        await asyncio.sleep(0.01)
+        return self.retrieve(query, k, mode, domain)
+
+class TestSpeculativeRetrieval:
+    def setup_method(self):
+        self.prompts = []
+        def responder(prompt):
+            self.prompts.append(prompt)
+            return default_responder(prompt)
+        stub = StubChatModel(latency=0.01, responder=responder)
+        self.retriever = RecordingRetriever()
+        self.build = lambda speculative: OrchestratorAgent(
+            intent_classifier=IntentClassifier(model=stub, cache=QueryCache()),
+            billing_agent=BillingSpecialist(model=stub, retriever=self.retriever),
+            account_agent=AccountSpecialist(model=stub, retriever=self.retriever),
+            speculative_retrieval=speculative,
+        )
+    
+    def test_routed_specialist_uses_prefetched_docs(self):
+        result = self.build(True).process_query("Why is my bill so high?", user_id="spec1")
+        assert result["intent"] == "billing_inquiry"
+        # Both domains were fetched up front and the specialist did not search again
+        assert sorted(self.retriever.domains) == ["account", "billing"]
+        assert "billing policy text" in self.prompts[-1]
+    
+    def test_async_prefetch(self):
+        result = asyncio.run(self.build(True).aprocess_query("I forgot my password", user_id="spec2"))
+        assert result["intent"] == "account_management"
+        assert sorted(self.retriever.domains) == ["account", "billing"]
+        assert "account policy text" in self.prompts[-1]
+    
+    def test_disabled_by_default(self):
+        self.build(None).process_query("Why is my bill so high?", user_id="spec3")
+        assert self.retriever.domains == ["billing"]
+
+class TestModelGateway:
+    def setup_method(self):
+        self.server = StubOpenAIServer().start()
+    
+    def teardown_method(self):
+        self.server.shutdown()
+        self.server.server_close()
+    
+    def model(self, gateway):
+        return gateway.wrap(ChatOpenAI(model="gpt-4-turbo", api_key="test", base_url=self.server.base_url,
+                                       max_retries=0, http_client=gateway.http_client(),
+                                       http_async_client=gateway.http_async_client()))
+    
+    def specialist(self, gateway):
+        return BillingSpecialist(model=self.model(gateway), retriever=RecordingRetriever())
+    
+    def test_transient_errors_are_retried(self):
+        self.server.script = [429, 503]
+        gateway = ModelGateway(backoff_seconds=0.01)
+        response = self.specialist(gateway).handle_query("Why is my bill high?", {})
+        assert "Thanks for reaching out" in response
+        assert self.server.requests == 3
+        assert gateway.stats()["retries"] == 2
+    
+    def test_bad_requests_are_not_retried(self):
+        self.server.script = [400]
+        gateway = ModelGateway(backoff_seconds=0.01)
+        with pytest.raises(Exception):
+            self.model(gateway).invoke("hello")
+        assert self.server.requests == 1
+        assert gateway.stats()["circuit"] == "closed"
+    
+    def test_only_rejected_requests_reset_the_breaker(self):
+        self.server.script = [503, 401, 503]
+        gateway = ModelGateway(max_retries=0, failure_threshold=2, cooldown_seconds=30)
+        model = self.model(gateway)
+        with pytest.raises(Exception):
+            model.invoke("hello")
+        
+        def bug():
+            raise KeyError("local bug")
+        with pytest.raises(KeyError):
+            gateway.call(bug)
+        with pytest.raises(Exception):
+            model.invoke("hello")
+        assert gateway.stats()["consecutive_failures"] == 1
+        
+        with pytest.raises(Exception):
+            model.invoke("hello")
+        assert gateway.stats()["circuit"] == "open"
+    
+    def test_open_circuit_short_circuits_to_fallback(self):
+        self.server.error_rate = 1.0
+        gateway = ModelGateway(max_retries=0, failure_threshold=2, cooldown_seconds=0.3)
+        specialist = self.specialist(gateway)
+        for _ in range(2):
+            assert "Thanks for reaching out" not in specialist.handle_query("Why is my bill high?", {})
+        assert gateway.stats()["circuit"] == "open"
+        
+        start = time.perf_counter()
+        assert "Thanks for reaching out" not in asyncio.run(specialist.ahandle_query("Why is my bill high?", {}))
+        assert time.perf_counter() - start < 0.1
+        assert self.server.requests == 2
+        with pytest.raises(CircuitOpenError):
+            self.model(gateway).invoke("hello")
+        
+        # After the cooldown one probe goes through and closes the circuit
+        self.server.error_rate = 0.0
+        time.sleep(0.3)
+        assert "Thanks for reaching out" in specialist.handle_query("Why is my bill high?", {})
+        assert gateway.stats()["circuit"] == "closed"
+    
+    def test_deadline_bounds_slow_calls(self):
+        self.server.latency = 1.0
+        gateway = ModelGateway(deadline_seconds=0.2, backoff_seconds=0.01)
+        start = time.perf_counter()
+        with pytest.raises(TimeoutError):
+            asyncio.run(self.model(gateway).ainvoke("hello"))
+        assert time.perf_counter() - start < 0.8
+    
+    def test_token_bucket_paces_calls(self):
+        gateway = ModelGateway(rate_per_second=20, burst=2)
+        model = gateway.wrap(StubChatModel(latency=0))
+        start = time.perf_counter()
+        for _ in range(6):
+            model.invoke("hello")
+        # Two calls from the burst, then one every 50ms
+        assert time.perf_counter() - start >= 0.18
+        assert gateway.stats()["throttled_seconds"] > 0
+    
+    def test_stream_retried_before_first_token(self):
+        self.server.script = [503]
+        gateway = ModelGateway(backoff_seconds=0.01)
+        
+        async def collect():
+            return "".join([chunk.content async for chunk in self.model(gateway).astream("hello")])
+        
+        assert asyncio.run(collect()) == default_responder("hello")
+        assert self.server.requests == 2
+
+class TestResponseCache:
+    def specialist(self, cache=None, responder=None):
+        self.calls = []
+        
+        def counting(prompt):
+            self.calls.append(prompt)
+            return (responder or default_responder)(prompt)
+        
+        return BillingSpecialist(model=StubChatModel(latency=0, responder=counting), retriever=RecordingRetriever(),
+                                 response_cache=cache if cache is not None else ResponseCache())
+    
+    def test_identical_prompts_skip_the_model(self):
+        specialist = self.specialist()
+        first = specialist.handle_query("How do I pay my bill?", {"account_id": "A1"})
+        assert specialist.handle_query("How do I pay my bill?", {"account_id": "A1"}) == first
+        assert asyncio.run(specialist.ahandle_query("How do I pay my bill?", {"account_id": "A1"})) == first
+        assert len(self.calls) == 1
+        # A different customer context is a different prompt
+        specialist.handle_query("How do I pay my bill?", {"account_id": "B2"})
+        assert len(self.calls) == 2
+        assert specialist.response_cache.stats()["memory"]["hits"] == 2
+    
+    def test_key_covers_model_settings(self):
+        from types import SimpleNamespace
+        from langchain_core.messages import HumanMessage
+        cache, messages = ResponseCache(), [HumanMessage(content="How do I pay my bill?")]
+        cooler = SimpleNamespace(model_name="gpt-4-turbo", temperature=0.1)
+        warmer = SimpleNamespace(model_name="gpt-4-turbo", temperature=0.3)
+        assert cache.key(cooler, messages) == cache.key(cooler, list(messages))
+        assert cache.key(cooler, messages) != cache.key(warmer, messages)
+    
+    def test_fallback_answers_are_not_cached(self):
+        def failing(prompt):
+            raise RuntimeError("model down")
+        
+        specialist = self.specialist(responder=failing)
+        specialist.handle_query("How do I pay my bill?", {})
+        assert len(specialist.response_cache.memory) == 0
+    
+    def test_disk_tier_and_ttl(self, tmp_path):
+        path = str(tmp_path / "responses.sqlite")
+        self.specialist(ResponseCache(path=path)).handle_query("How do I pay my bill?", {})
+        # A new process with an empty memory tier reads the answer from disk
+        restarted = self.specialist(ResponseCache(path=path))
+        restarted.handle_query("How do I pay my bill?", {})
+        assert self.calls == [] and restarted.response_cache.disk_hits == 1
+        
+        cache = ResponseCache(ttl_seconds=0.05, path=str(tmp_path / "short.sqlite"))
+        cache.set("key", "answer")
+        time.sleep(0.06)
+        assert cache.get("key") is None
+    
+    def test_async_disk_tier_does_not_block_the_event_loop(self, tmp_path):
+        cache = ResponseCache(path=str(tmp_path / "responses.sqlite"))
+        get, put = cache.disk.get, cache.disk.put
+        
+        def slow_get(key):
+            time.sleep(0.1)
+            return get(key)
+        
+        def slow_put(key, response, ttl_seconds):
+            time.sleep(0.1)
+            put(key, response, ttl_seconds)
+        cache.disk.get, cache.disk.put = slow_get, slow_put
+        specialist = self.specialist(cache)
+        
+        async def run():
+            gaps = []
+            done = asyncio.Event()
+            
+            async def ticker():
+                last = time.perf_counter()
+                while not done.is_set():
+                    await asyncio.sleep(0.01)
+                    now = time.perf_counter()
+                    gaps.append(now - last)
+                    last = now
+            
+            ticking = asyncio.create_task(ticker())
+            response = await specialist.ahandle_query("How do I pay my bill?", {})
+            streamed = [token async for token in specialist.astream_query("Can I pay by card?", {})]
+            done.set()
+            await ticking
+            return response, streamed, max(gaps)
+        
+        response, streamed, longest_gap = asyncio.run(run())
+        assert "Thanks for reaching out" in response and streamed
+        assert len(self.calls) == 2 and len(cache.memory) == 2
+        assert longest_gap < 0.08
+    
+    def test_opt_in_per_specialist(self, monkeypatch):
+        monkeypatch.setenv("RESPONSE_CACHE_SPECIALISTS", "billing")
+        stub = StubChatModel(latency=0)
+        assert BillingSpecialist(model=stub, retriever=RecordingRetriever()).response_cache is not None
+        assert AccountSpecialist(model=stub, retriever=RecordingRetriever()).response_cache is None
+    
+    def test_hits_reported_in_metadata(self):
+        orchestrator = OrchestratorAgent(
+            intent_classifier=IntentClassifier(model=StubChatModel(latency=0), cache=QueryCache(), fast_path_margin=1.01),
+            billing_agent=self.specialist(),
+            memory=ConversationMemory(sweep_seconds=0),
+        )
+        # First turns of different customers share the same prompt
+        first = asyncio.run(orchestrator.aprocess_query("How do I pay my bill?", user_id="faq1"))
+        second = asyncio.run(orchestrator.aprocess_query("How do I pay my bill?", user_id="faq2"))
+        assert first["metadata"]["cache"]["billing_response"] == "miss"
+        assert second["metadata"]["cache"]["billing_response"] == "hit"
+        assert second["response"] == first["response"]
+        assert ("model", "billing_specialist") not in [(span["kind"], span["name"]) for span in second["metadata"]["spans"]]
+        
+        async def stream():
+            return [event async for event in orchestrator.astream_query("How do I pay my bill?", user_id="faq3")]
+        
+        events = asyncio.run(stream())
+        assert "".join(event["content"] for event in events if event["event"] == "token") == first["response"]
+        assert len(self.calls) == 1
+
+class TestEvaluationMetrics:
+    def test_intent_accuracy_bypasses_cache_and_fast_path(self, monkeypatch):
+        shared = get_orchestrator().intent_classifier
+        
+        def no_default_model():
+            raise AssertionError("default fast model loaded")
+        monkeypatch.setattr(intent_classifier, "load_default_fast_model", no_default_model)
+        monkeypatch.setattr(intent_classifier, "build_intent_cache", no_default_model)
+        metrics = EvaluationMetrics()
+        classifier = metrics.intent_classifier
+        assert classifier is not shared
+        assert classifier.cache is None and classifier.fast_model is None
+        
+        report = metrics.evaluate_intent_accuracy()
+        assert report["total_cases"] == len(metrics.test_cases)
+        assert classifier.cache_stats() == {}
+    
+    def test_routing_cases_run_in_separate_sessions(self, monkeypatch):
+        metrics = EvaluationMetrics()
+        metrics.test_cases = metrics.test_cases[:3]
+        users = []
+        process_query = metrics.orchestrator.process_query
+        
+        def recording(query, user_id="default", **kwargs):
+            users.append(user_id)
+            return process_query(query, user_id=user_id, **kwargs)
+        monkeypatch.setattr(metrics.orchestrator, "process_query", recording)
+        
+        metrics.evaluate_end_to_end_system()
+        assert len(set(users)) == 3 and "default" not in users
+    
+    def test_conversation_runs_do_not_share_sessions(self, monkeypatch):
+        # The judge needs an API key and isn't used here
+        monkeypatch.setattr(eval_runner, "LLMJudge", lambda: None)
+        evaluator = eval_runner.ComprehensiveEvaluator()
+        users = []
+        process_query = evaluator.orchestrator.process_query
+        
+        def recording(query, user_id="default", **kwargs):
+            users.append(user_id)
+            return process_query(query, user_id=user_id, **kwargs)
+        monkeypatch.setattr(evaluator.orchestrator, "process_query", recording)
+        
+        evaluator._evaluate_conversation_handling()
+        first_run = set(users)
+        evaluator._evaluate_conversation_handling()
+        assert first_run and first_run.isdisjoint(set(users) - first_run)
+        assert len(set(users)) == 2 * len(first_run)
+
+class TestTracing:
+    def setup_method(self):
+        stub = StubChatModel(latency=0.01)
+        self.orchestrator = OrchestratorAgent(
+            intent_classifier=IntentClassifier(model=stub, cache=QueryCache(), fast_path_margin=1.01),
+            billing_agent=BillingSpecialist(model=stub, retriever=RecordingRetriever()),
+        )
+    
+    def test_result_metadata(self):
+        result = self.orchestrator.process_query("Why is my bill so high?", user_id="trace1")
+        metadata = result["metadata"]
+        names = [(span["kind"], span["name"]) for span in metadata["spans"]]
+        assert ("node", "classify_intent") in names
+        assert ("node", "billing_specialist") in names
+        assert ("model", "intent_classifier") in names
+        assert ("model", "billing_specialist") in names
+        assert all(span["duration_ms"] >= 0 for span in metadata["spans"])
+        assert metadata["total_ms"] >= 10
+        assert metadata["tokens"]["prompt"] > 0 and metadata["tokens"]["completion"] > 0
+        assert metadata["cache"]["intent"] == "miss"
+        
+        # The repeat is classified from the cache
+        result = self.orchestrator.process_query("Why is my bill so high?", user_id="trace1")
+        assert result["metadata"]["cache"]["intent"] == "hit"
+        assert ("model", "intent_classifier") not in [(span["kind"], span["name"]) for span in result["metadata"]["spans"]]
+    
+    def test_async_metadata_is_per_request(self):
+        async def run_all():
+            return await asyncio.gather(*(
+                self.orchestrator.aprocess_query(f"My bill is too high {i}", user_id=f"trace{i}")
+                for i in range(5)
+            ))
+        
+        for result in asyncio.run(run_all()):
+            # Concurrent requests don't see each other's spans
+            nodes = [span["name"] for span in result["metadata"]["spans"] if span["kind"] == "node"]
+            assert nodes == ["classify_intent", "billing_specialist"]
+    
+    def test_metrics_exposition(self):
+        self.orchestrator.process_query("Why is my bill so high?", user_id="trace2")
+        text = render_metrics()
+        assert "# TYPE agent_node_duration_seconds histogram" in text
+        assert 'agent_node_duration_seconds_bucket{node="classify_intent",le="+Inf"}' in text
+        assert 'agent_model_tokens_total{component="billing_specialist",kind="prompt"}' in text
+
+class TestStreaming:
+    def setup_method(self):
+        stub = StubChatModel(latency=0.01, token_latency=0.02)
+        self.orchestrator = OrchestratorAgent(
+            intent_classifier=IntentClassifier(model=StubChatModel(latency=0.01), cache=QueryCache(), fast_path_margin=1.01),
+            billing_agent=BillingSpecialist(model=stub, retriever=RecordingRetriever()),
+            escalation_agent=EscalationHandler(model=stub),
+        )
+    
+    def collect(self, query, user_id):
+        async def run():
+            start, events = time.perf_counter(), []
+            async for event in self.orchestrator.astream_query(query, user_id=user_id):
+                events.append((time.perf_counter() - start, event))
+            return events
+        return asyncio.run(run())
+    
+    def test_tokens_stream_before_completion(self):
+        events = self.collect("Why is my bill so high?", "stream1")
+        kinds = [event["event"] for _, event in events]
+        assert kinds[0] == "intent" and kinds[-1] == "done"
+        tokens = [(elapsed, event["content"]) for elapsed, event in events if event["event"] == "token"]
+        assert len(tokens) > 5
+        done_at, done = events[-1]
+        # The first token arrives long before the ~20ms-per-word answer is complete
+        assert tokens[0][0] < done_at / 2
+        assert "".join(content for _, content in tokens) == done["response"]
+        assert done["intent"] == "billing_inquiry"
+        assert done["metadata"]["spans"]
+        
+        history = self.orchestrator.memory.get_conversation("stream1")
+        assert [message["role"] for message in history] == ["user", "assistant"]
+        assert history[-1]["content"] == done["response"]
+    
+    def test_disconnect_records_what_was_streamed(self):
+        async def run():
+            stream = self.orchestrator.astream_query("Why is my bill so high?", user_id="gone")
+            sent = []
+            async for event in stream:
+                if event["event"] == "token":
+                    sent.append(event["content"])
+                    if len(sent) == 2:
+                        break
+            # What a server does when the client hangs up
+            await stream.aclose()
+            return "".join(sent)
+        
+        sent = asyncio.run(run())
+        history = self.orchestrator.memory.get_conversation("gone")
+        assert [message["role"] for message in history] == ["user", "assistant"]
+        assert history[-1]["content"] == sent
+        assert history[-1]["metadata"]["intent"] == "billing_inquiry"
+    
+    def test_stream_without_final_state_still_completes(self):
+        from types import SimpleNamespace
+        
+        async def tokens_only(state, version):
+            for content in ("Hello", " there"):
+                yield {"event": "on_custom_event", "name": "token", "data": {"content": content}}
+        self.orchestrator.graph = SimpleNamespace(astream_events=tokens_only)
+        
+        done = self.collect("Why is my bill so high?", "no_end")[-1][1]
+        assert done["event"] == "done" and done["response"] == "Hello there"
+        assert self.orchestrator.memory.get_conversation("no_end")[-1]["content"] == "Hello there"
+    
+    def test_escalation_streams(self):
+        events = self.collect("I want to speak to a supervisor", "stream2")
+        done = events[-1][1]
+        assert done["requires_escalation"]
+        assert "".join(event["content"] for _, event in events if event["event"] == "token") == done["response"]
+    
+    def test_fallback_is_one_token(self):
+        specialist = AccountSpecialist(model=StubChatModel())
+        specialist.api_available = False
+        
+        async def run():
+            return [token async for token in specialist.astream_query("hello", {})]
+        
+        assert asyncio.run(run()) == [specialist._fallback_response("hello", {})]
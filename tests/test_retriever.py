@@ -0,0 +1,427 @@
+import pytest
+import asyncio
+import os
+import threading
+import time
+import numpy as np
+from langchain_core.documents import Document
+from evaluation.stub_llm import StubEmbeddings
+from rag import ingest
+from rag.embedding_cache import CachedEmbeddings
+from rag.ingest import IngestionPipeline, split_markdown
+from rag.lexical_index import BM25Index, tokenize
+from rag.retriever import KnowledgeBaseRetriever, reciprocal_rank_fusion
+
+KB_FILES = {
+    "fees.md": "# Late Fees\n\nA late fee of $15 applies when payment is more than 10 days overdue.",
+    "autopay.md": "# AutoPay\n\nEnroll in AutoPay to get a $5 monthly discount on your bill.",
+    "roaming.md": "# Roaming\n\nInternational roaming rates are charged per minute while abroad.",
+}
+
+@pytest.fixture
+def kb_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv("CHROMA_PERSIST_DIRECTORY", str(tmp_path / "chroma"))
+    docs = tmp_path / "billing"
+    docs.mkdir()
+    for name, content in KB_FILES.items():
+        (docs / name).write_text(content)
+    return docs
+
+@pytest.fixture
+def kb_root(tmp_path, monkeypatch):
+    """Knowledge base root with billing/ and account/ domains"""
+    monkeypatch.setenv("CHROMA_PERSIST_DIRECTORY", str(tmp_path / "chroma"))
+    root = tmp_path / "kb"
+    (root / "billing").mkdir(parents=True)
+    (root / "account").mkdir()
+    (root / "billing" / "fees.md").write_text("# Late Fees\n\nA late fee of $15 applies to overdue bill payments.")
+    (root / "account" / "password.md").write_text("# Password\n\nReset your password from the login page; no fee applies.")
+    return root
+
+class TestBM25Index:
+    def test_tokenize_drops_stopwords(self):
+        assert tokenize("What is the late fee for my bill?") == ["late", "fee", "bill"]
+
+    def test_ranks_by_term_rarity_and_frequency(self):
+        index = BM25Index.build([
+            "bill bill payment",
+            "payment options",
+            "roaming rates abroad",
+        ])
+        results = index.search("bill payment", k=3)
+        assert [doc_id for doc_id, _ in results] == [0, 1]
+        assert results[0][1] > results[1][1]
+
+    def test_top_k_and_no_matches(self):
+        index = BM25Index.build([f"plan {i}" for i in range(10)])
+        assert len(index.search("plan", k=3)) == 3
+        assert index.search("nothing", k=3) == []
+
+    def test_doc_filter(self):
+        index = BM25Index.build(["late fee", "late fee waived", "roaming"])
+        assert [doc_id for doc_id, _ in index.search("late fee", doc_filter={1, 2})] == [1]
+
+    def test_save_load_roundtrip(self, tmp_path):
+        index = BM25Index.build(["late fee policy", "autopay discount"])
+        path = str(tmp_path / "index.bm25.json")
+        index.save(path)
+        loaded = BM25Index.load(path)
+        assert loaded.fingerprint == index.fingerprint
+        assert loaded.search("late fee") == index.search("late fee")
+
+class TestKnowledgeBaseRetriever:
+    def test_lexical_fallback_uses_bm25(self, kb_dir):
+        retriever = KnowledgeBaseRetriever(str(kb_dir))
+        results = retriever.retrieve("how much is the late fee?", k=2)
+        assert "late fee" in results[0].page_content
+
+    def test_index_persisted_next_to_chroma_directory(self, kb_dir):
+        retriever = KnowledgeBaseRetriever(str(kb_dir))
+        index_path = f"{retriever.persist_directory}.bm25.json"
+        retriever.retrieve("late fee")
+        assert os.path.exists(index_path)
+
+        reloaded = KnowledgeBaseRetriever(str(kb_dir))
+        assert reloaded.lexical_index.fingerprint == retriever.lexical_index.fingerprint
+
+    def test_stale_index_is_rebuilt(self, kb_dir):
+        KnowledgeBaseRetriever(str(kb_dir))
+        (kb_dir / "fees.md").write_text("# Fees\n\nA reconnection fee applies after suspension.")
+        retriever = KnowledgeBaseRetriever(str(kb_dir))
+        assert "reconnection" in retriever.retrieve("reconnection fee", k=1)[0].page_content
+
+class TestIncrementalReindex:
+    def test_only_changed_files_are_reembedded(self, kb_dir):
+        first = KnowledgeBaseRetriever(str(kb_dir), embeddings=StubEmbeddings())
+        assert first.index_report["added"] == ["autopay.md", "fees.md", "roaming.md"]
+        assert first.index_report["chunks_added"] == 3
+
+        unchanged = KnowledgeBaseRetriever(str(kb_dir), embeddings=StubEmbeddings())
+        assert unchanged.index_report["chunks_added"] == 0
+        assert unchanged.index_report["chunks_deleted"] == 0
+
+        (kb_dir / "fees.md").write_text("# Fees\n\nA reconnection fee applies after suspension.")
+        (kb_dir / "roaming.md").unlink()
+        (kb_dir / "plans.md").write_text("# Plans\n\nThe unlimited plan includes hotspot data.")
+        stub = StubEmbeddings()
+        updated = KnowledgeBaseRetriever(str(kb_dir), embeddings=stub)
+        report = updated.index_report
+        assert (report["added"], report["changed"], report["deleted"]) == (["plans.md"], ["fees.md"], ["roaming.md"])
+        assert (report["chunks_added"], report["chunks_deleted"]) == (2, 2)
+        assert len(updated.vectorstore.get(include=[])["ids"]) == 3
+        assert "reconnection" in updated.retrieve("reconnection fee", k=1, mode="vector")[0].page_content
+
+    def test_store_without_manifest_is_reconciled(self, kb_dir):
+        retriever = KnowledgeBaseRetriever(str(kb_dir), embeddings=StubEmbeddings())
+        retriever.vectorstore.add_texts(["orphaned legacy chunk"], ids=["legacy-id"])
+        os.remove(f"{retriever.persist_directory}.manifest.json")
+
+        reconciled = KnowledgeBaseRetriever(str(kb_dir), embeddings=StubEmbeddings())
+        assert reconciled.index_report["chunks_added"] == 0
+        assert reconciled.index_report["chunks_deleted"] == 1
+        assert "legacy-id" not in reconciled.vectorstore.get(include=[])["ids"]
+
+class TestLazyLoading:
+    def test_warm_start_defers_chunk_loading(self, kb_dir):
+        KnowledgeBaseRetriever(str(kb_dir), embeddings=StubEmbeddings())
+        warm = KnowledgeBaseRetriever(str(kb_dir), embeddings=StubEmbeddings())
+        assert warm._documents is None
+        warm.retrieve("late fee", k=1, mode="vector")
+        assert warm._documents is None
+        assert "late fee" in warm.retrieve("late fee", k=1, mode="lexical")[0].page_content
+        assert len(warm.documents) == 3
+
+    def test_async_first_load_does_not_block_the_event_loop(self, kb_dir):
+        retriever = KnowledgeBaseRetriever(str(kb_dir))
+        load = retriever._load_lexical_index
+
+        def slow_load(documents):
+            time.sleep(0.3)
+            return load(documents)
+        retriever._load_lexical_index = slow_load
+
+        async def run():
+            gaps = []
+            done = asyncio.Event()
+
+            async def ticker():
+                last = time.perf_counter()
+                while not done.is_set():
+                    await asyncio.sleep(0.01)
+                    now = time.perf_counter()
+                    gaps.append(now - last)
+                    last = now
+
+            ticking = asyncio.create_task(ticker())
+            results = await retriever.aretrieve("late fee", k=1, mode="lexical")
+            done.set()
+            await ticking
+            return results, max(gaps)
+
+        results, longest_gap = asyncio.run(run())
+        assert "late fee" in results[0].page_content
+        assert longest_gap < 0.1
+
+    def test_unchanged_files_come_from_chunk_cache(self, kb_dir, monkeypatch):
+        expected = [doc.page_content for doc in KnowledgeBaseRetriever(str(kb_dir)).documents]
+        (kb_dir / "plans.md").write_text("# Plans\n\nThe unlimited plan includes hotspot data.")
+
+        split_calls = []
+        def counting_split(source_path, path):
+            split_calls.append(source_path)
+            return split_markdown(source_path, path)
+        monkeypatch.setattr(ingest, "split_markdown", counting_split)
+
+        documents = KnowledgeBaseRetriever(str(kb_dir)).documents
+        assert split_calls == ["plans.md"]
+        assert set(expected) < {doc.page_content for doc in documents}
+
+class FlakyVectorStore:
+    """Records upserted batch ids; the first `failures` calls raise"""
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.batches = []
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+
+    def add_documents(self, documents, ids):
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            time.sleep(0.01)
+            with self.lock:
+                if self.failures:
+                    self.failures -= 1
+                    raise ConnectionError("embedding request timed out")
+                self.batches.append(ids)
+        finally:
+            with self.lock:
+                self.active -= 1
+
+class TestIngestionPipeline:
+    def _documents(self, count):
+        return [Document(page_content=f"chunk {i}", metadata={"chunk_id": f"id-{i}"}) for i in range(count)]
+
+    def test_bounded_batches_with_progress(self):
+        store = FlakyVectorStore()
+        progress = []
+        pipeline = IngestionPipeline(batch_size=2, max_in_flight=2, progress=lambda stats: progress.append(stats.chunks_embedded))
+        stats = pipeline.upsert(store, iter(self._documents(5)))
+        assert sorted(id for batch in store.batches for id in batch) == [f"id-{i}" for i in range(5)]
+        assert stats.batches == 3 and stats.chunks_embedded == 5
+        assert progress[-1] == 5 and len(progress) == 3
+        assert store.max_active <= 2
+
+    def test_failed_batches_are_retried(self):
+        store = FlakyVectorStore(failures=2)
+        stats = IngestionPipeline(batch_size=10, backoff=0).upsert(store, self._documents(3))
+        assert stats.retries == 2 and len(store.batches) == 1
+
+        with pytest.raises(ConnectionError):
+            IngestionPipeline(retries=1, backoff=0).upsert(FlakyVectorStore(failures=5), self._documents(3))
+
+    def test_process_pool_split_matches_inline(self, kb_dir):
+        inline = KnowledgeBaseRetriever(str(kb_dir), pipeline=IngestionPipeline(workers=1)).documents
+        os.remove(f"{KnowledgeBaseRetriever(str(kb_dir)).persist_directory}.chunks.json")
+        pipeline = IngestionPipeline(workers=2, min_parallel_files=0)
+        parallel = KnowledgeBaseRetriever(str(kb_dir), pipeline=pipeline).documents
+        assert parallel == inline
+        assert pipeline.stats.files_split == 3
+
+class TestLiveUpdates:
+    NEW_DOC = Document(page_content="# Paperless\n\nSwitch to paperless billing for a $2 credit.", metadata={"source": "api"})
+
+    def test_add_documents_without_embeddings(self, kb_dir):
+        retriever = KnowledgeBaseRetriever(str(kb_dir))
+        assert retriever.add_documents([self.NEW_DOC]) == {"chunks_added": 1, "duplicates_skipped": 0}
+        assert "paperless" in retriever.retrieve("paperless billing credit", k=1)[0].page_content
+        assert retriever.add_documents([self.NEW_DOC]) == {"chunks_added": 0, "duplicates_skipped": 1}
+
+        restarted = KnowledgeBaseRetriever(str(kb_dir))
+        assert len(restarted.documents) == 4
+        assert "paperless" in restarted.retrieve("paperless billing credit", k=1)[0].page_content
+
+    def test_add_documents_updates_vector_store(self, kb_dir):
+        retriever = KnowledgeBaseRetriever(str(kb_dir), embeddings=StubEmbeddings())
+        retriever.add_documents([self.NEW_DOC])
+        assert "paperless" in retriever.retrieve("paperless billing", k=1, mode="vector")[0].page_content
+
+        # Neither a normal restart nor one without a manifest drops live chunks from the store
+        KnowledgeBaseRetriever(str(kb_dir), embeddings=StubEmbeddings())
+        os.remove(f"{retriever.persist_directory}.manifest.json")
+        restarted = KnowledgeBaseRetriever(str(kb_dir), embeddings=StubEmbeddings())
+        assert restarted.index_report["chunks_deleted"] == 0
+        assert len(restarted.vectorstore.get(include=[])["ids"]) == 4
+
+    def test_searches_run_during_updates(self, kb_dir):
+        retriever = KnowledgeBaseRetriever(str(kb_dir))
+        errors = []
+
+        def search():
+            for _ in range(200):
+                try:
+                    retriever.retrieve("fee discount plan", k=3)
+                except Exception as e:
+                    errors.append(e)
+
+        searcher = threading.Thread(target=search)
+        searcher.start()
+        for i in range(20):
+            retriever.add_documents([Document(page_content=f"Plan {i} includes {i} GB of data.")])
+        searcher.join()
+        assert errors == []
+        assert len(retriever.documents) == 23
+
+class TestDomains:
+    def test_chunks_tagged_with_top_level_directory(self, kb_root):
+        retriever = KnowledgeBaseRetriever(str(kb_root))
+        assert {doc.metadata["domain"] for doc in retriever.documents} == {"billing", "account"}
+
+    def test_retrieval_filtered_by_domain(self, kb_root):
+        retriever = KnowledgeBaseRetriever(str(kb_root), embeddings=StubEmbeddings())
+        for mode in ("vector", "lexical", "hybrid"):
+            results = retriever.retrieve("fee", k=3, mode=mode, domain="account")
+            assert [doc.metadata["domain"] for doc in results] == ["account"]
+            assert len(retriever.retrieve("fee", k=3, mode=mode)) == 2
+        assert asyncio.run(retriever.aretrieve("fee", k=3, domain="billing"))[0].metadata["domain"] == "billing"
+        assert retriever.retrieve("fee", k=3, domain="roaming") == []
+
+    def test_new_domain_added_live(self, kb_root):
+        retriever = KnowledgeBaseRetriever(str(kb_root), embeddings=StubEmbeddings())
+        retriever.add_documents([Document(page_content="Roaming in Canada costs $5 per day.")], domain="roaming")
+        for mode in ("vector", "lexical"):
+            results = retriever.retrieve("roaming Canada", k=3, mode=mode, domain="roaming")
+            assert [doc.metadata["domain"] for doc in results] == ["roaming"]
+
+class TestHybridRetrieval:
+    def test_reciprocal_rank_fusion(self):
+        a, b, c = (Document(page_content=text, metadata={"source": text}) for text in "abc")
+        # b is second in both lists, so it beats a and c which each top only one
+        fused = reciprocal_rank_fusion([[a, b], [c, b]], k=3)
+        assert fused[0] is b
+        assert {doc.page_content for doc in fused} == {"a", "b", "c"}
+        # With a and c tied on rank, the ranking weights decide
+        assert reciprocal_rank_fusion([[a, b], [c]], k=1, weights=[3.0, 1.0])[0] is a
+        assert reciprocal_rank_fusion([[a, b], [c]], k=1, weights=[1.0, 3.0])[0] is c
+
+    def test_modes_with_embeddings(self, kb_dir):
+        retriever = KnowledgeBaseRetriever(str(kb_dir), embeddings=StubEmbeddings())
+        assert retriever.vectorstore is not None
+        for mode in ("vector", "lexical", "hybrid"):
+            results = retriever.retrieve("late fee", k=2, mode=mode)
+            assert 0 < len(results) <= 2
+        assert "late fee" in retriever.retrieve("late fee", k=1, mode="hybrid")[0].page_content
+        assert len(asyncio.run(retriever.aretrieve("roaming rates", k=2, mode="hybrid"))) == 2
+
+    def test_failed_async_lexical_search_cancels_vector_search(self, kb_dir):
+        retriever = KnowledgeBaseRetriever(str(kb_dir), embeddings=StubEmbeddings())
+        retriever._load_search_data()
+        cancelled = []
+
+        class SlowVectorStore:
+            async def asimilarity_search(self, query, k, filter=None):
+                try:
+                    await asyncio.sleep(1)
+                except asyncio.CancelledError:
+                    cancelled.append(query)
+                    raise
+
+        def failing_search(query, k=3, domain=None):
+            raise RuntimeError("index unavailable")
+        retriever.vectorstore = SlowVectorStore()
+        retriever._lexical_search = failing_search
+
+        async def run():
+            with pytest.raises(RuntimeError):
+                await retriever.aretrieve("late fee", k=1, mode="hybrid")
+            # Cancelled before the error reached the caller, not at loop shutdown
+            return list(cancelled)
+
+        assert asyncio.run(run()) == ["late fee"]
+
+    def test_without_embeddings_every_mode_is_lexical(self, kb_dir):
+        retriever = KnowledgeBaseRetriever(str(kb_dir))
+        assert retriever.retrieve("late fee", k=1, mode="hybrid") == retriever.retrieve("late fee", k=1, mode="lexical")
+
+    def test_unknown_mode_rejected(self, kb_dir):
+        retriever = KnowledgeBaseRetriever(str(kb_dir))
+        with pytest.raises(ValueError):
+            retriever.retrieve("late fee", mode="semantic")
+
+class TestEmbeddingCache:
+    def test_repeated_text_hits_memory(self):
+        stub = StubEmbeddings()
+        cached = CachedEmbeddings(stub, batch_window=0)
+        first = cached.embed_query("late fee")
+        assert cached.embed_query("late fee") == first
+        assert cached.embed_documents(["late fee", "late fee"]) == [first, first]
+        assert stub.calls == 1
+        assert asyncio.run(cached.aembed_query("late fee")) == first
+
+    def test_disk_tier_survives_restart(self, tmp_path):
+        path = str(tmp_path / "embeddings.sqlite")
+        vector = CachedEmbeddings(StubEmbeddings(), cache_path=path, batch_window=0).embed_query("roaming rates")
+
+        stub = StubEmbeddings()
+        restarted = CachedEmbeddings(stub, cache_path=path, batch_window=0)
+        assert restarted.embed_query("roaming rates") == pytest.approx(vector, abs=1e-6)
+        assert stub.calls == 0
+        assert restarted.stats()["disk_hits"] == 1
+
+    def test_memory_keeps_float32_query_vectors_only(self):
+        cached = CachedEmbeddings(StubEmbeddings(), batch_window=0)
+        cached.embed_documents(["late fee policy", "autopay discount"])
+        assert cached.memory.stats()["size"] == 0
+
+        vector = cached.embed_query("late fee")
+        stored = cached.memory.get(cached._key("late fee"))
+        assert stored.dtype == np.float32
+        assert isinstance(vector, list) and vector == stored.tolist()
+
+    def test_each_lookup_is_counted_once(self):
+        cached = CachedEmbeddings(StubEmbeddings(), batch_window=0)
+        asyncio.run(cached.aembed_query("late fee"))
+        asyncio.run(cached.aembed_query("late fee"))
+        cached.embed_documents(["roaming", "roaming"])
+        memory = cached.stats()["memory"]
+        assert (memory["hits"], memory["misses"]) == (1, 2)
+
+    def test_unreadable_disk_tier_is_a_miss(self, tmp_path):
+        stub = StubEmbeddings()
+        cached = CachedEmbeddings(stub, cache_path=str(tmp_path / "embeddings.sqlite"), batch_window=0)
+        cached.disk._connection.execute("DROP TABLE embeddings")
+        assert cached.embed_query("late fee") == pytest.approx(stub._embed("late fee"), abs=1e-6)
+        assert stub.calls == 1
+
+    def test_concurrent_misses_are_batched(self):
+        stub = StubEmbeddings(latency=0.05)
+        cached = CachedEmbeddings(stub, batch_window=0.05)
+        queries = [f"question {i}" for i in range(8)] * 2
+        results = {}
+
+        def embed(query):
+            results[query] = cached.embed_query(query)
+
+        threads = [threading.Thread(target=embed, args=(query,)) for query in queries]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert len(results) == 8
+        assert results["question 3"] == pytest.approx(stub._embed("question 3"), abs=1e-6)
+        assert stub.calls < 8
+
+    def test_shared_across_retrievers(self, kb_dir):
+        stub = StubEmbeddings()
+        cached = CachedEmbeddings(stub, batch_window=0)
+        first = KnowledgeBaseRetriever(str(kb_dir), embeddings=cached)
+        first.retrieve("late fee", k=1, mode="vector")
+        calls = stub.calls
+
+        second = KnowledgeBaseRetriever(str(kb_dir), embeddings=cached)
+        second.retrieve("late fee", k=1, mode="vector")
+        assert stub.calls == calls
@@ -1,19 +1,62 @@
 import streamlit as st
+import requests
 import sys
 import os
+import time
+import uuid
 
 # Add project root to path for imports
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+API_URL = os.getenv("API_URL", "http://localhost:8000")
+BACKENDS = ["In-process orchestrator", "FastAPI service"]
+
 st.set_page_config(
     page_title="Multi-Agent Customer Service Demo",
     page_icon="🤖",
     layout="wide"
 )
 
+@st.cache_resource
+def load_orchestrator():
+    """Build the orchestrator once per server process and reuse it across reruns and sessions"""
+    from agents.registry import get_orchestrator
+    return get_orchestrator()
+
+def process_in_process(query: str, user_id: str, customer_context: dict) -> dict:
+    return load_orchestrator().process_query(
+        query,
+        user_id=user_id,
+        customer_context=customer_context
+    )
+
+def process_via_api(query: str, user_id: str, customer_context: dict) -> dict:
+    response = requests.post(
+        f"{API_URL}/chat",
+        json={
+            "user_id": user_id,
+            "message": query,
+            "customer_context": customer_context
+        },
+        timeout=60
+    )
+    response.raise_for_status()
+    return response.json()
+
 st.title("🤖 Multi-Agent Customer Service System")
 st.markdown("*Advanced AI-powered customer support with intelligent routing*")
 
+# Initialize session state
+if "messages" not in st.session_state:
+    st.session_state.messages = []
+if "current_query" not in st.session_state:
+    st.session_state.current_query = ""
+if "user_id" not in st.session_state:
+    # Each browser session gets its own conversation memory in the shared orchestrator
+    st.session_state.user_id = f"demo_{uuid.uuid4().hex[:8]}"
+if "latencies" not in st.session_state:
+    st.session_state.latencies = []
+
 # Sidebar with system information
 with st.sidebar:
     st.header("System Architecture")
@@ -44,12 +87,27 @@ with st.sidebar:
     for query in sample_queries:
         if st.button(query, key=f"sample_{query}"):
             st.session_state.current_query = query
+    
+    st.header("Backend")
+    default_backend = 1 if os.getenv("UI_BACKEND", "").lower() == "api" else 0
+    backend = st.radio("Process queries with", BACKENDS, index=default_backend)
+    if backend == BACKENDS[1]:
+        st.caption(f"Sending requests to {API_URL}/chat")
+    
+    st.header("Latency")
+    latency_placeholder = st.empty()
 
-# Initialize session state
-if "messages" not in st.session_state:
-    st.session_state.messages = []
-if "current_query" not in st.session_state:
-    st.session_state.current_query = ""
+def render_latency():
+    latencies = st.session_state.latencies
+    with latency_placeholder.container():
+        if not latencies:
+            st.caption("No messages yet")
+            return
+        st.metric("Last message", f"{latencies[-1]:.2f}s")
+        st.metric("Session average", f"{sum(latencies) / len(latencies):.2f}s")
+        st.line_chart(latencies)
+
+render_latency()
 
 # Main chat interface
 st.header("Customer Service Chat")
@@ -92,12 +150,6 @@ if query:
     with st.chat_message("assistant"):
         with st.spinner("Processing your request..."):
             try:
-                # Import and use the actual orchestrator
-                from agents.orchestrator import OrchestratorAgent
-                
-                # Initialize orchestrator
-                orchestrator = OrchestratorAgent()
-                
                 # Mock customer context
                 customer_context = {
                     "account_id": "DEMO123",
@@ -106,12 +158,13 @@ if query:
                     "account_status": "Active"
                 }
                 
-                # Process query through the actual system
-                result = orchestrator.process_query(
-                    query,
-                    user_id="demo_user",
-                    customer_context=customer_context
-                )
+                # Process query through the long-lived orchestrator or the API
+                process = process_via_api if backend == BACKENDS[1] else process_in_process
+                start = time.perf_counter()
+                result = process(query, st.session_state.user_id, customer_context)
+                latency = time.perf_counter() - start
+                st.session_state.latencies.append(latency)
+                render_latency()
                 
                 st.markdown(result["response"])
                 
@@ -123,7 +176,8 @@ if query:
                         "intent": result["intent"],
                         "confidence": result["confidence"],
                         "requires_escalation": result["requires_escalation"],
-                        "agent_used": "billing_specialist" if result["intent"] == "billing_inquiry" else "account_specialist"
+                        "agent_used": result.get("agent_used", "billing_specialist" if result["intent"] == "billing_inquiry" else "account_specialist"),
+                        "latency": latency
                     }
                 })
                 